@@ -2,33 +2,843 @@
 # Flask-based DNS Lookup Web Application
 # Upload CSV, process DNS lookups, download ZIP of results
 
-from flask import Flask, request, render_template_string, send_file, send_from_directory, redirect
-from markupsafe import Markup
+from flask import Flask, request, render_template_string, send_file, jsonify
+from markupsafe import Markup, escape
 import os
 import zipfile
+import csv
+import shutil
 import io
-import pandas as pd
+import sys
+import argparse
+import functools
 import dns.resolver
+import dns.asyncresolver
+import dns.rdatatype
+import dns.exception
+import dns.rcode
+import asyncio
 import re
-import whois
+import ipaddress
 import logging
+import logging.handlers
+import queue
+import contextvars
 from datetime import datetime
-from openpyxl import Workbook
-from openpyxl.styles import Border, Side, Alignment, PatternFill, Font
-from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image as XLImage
-import matplotlib.pyplot as plt
-from concurrent.futures import ThreadPoolExecutor
-from PIL import Image, ImageOps
-from fpdf import FPDF
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+import multiprocessing
+import zlib
 import uuid
-
-# --- Fix: matplotlib backend for Flask (headless) ---
-import matplotlib
-matplotlib.use('Agg')  # Use non-GUI backend for chart generation
+import threading
+import time
+import json
+import sqlite3
+from collections import OrderedDict, deque
+import hashlib
+import gzip
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+# pandas, numpy, pyarrow and python-whois are imported where a scan first
+# needs them, and the report libraries (openpyxl, matplotlib, fpdf, PIL) only
+# when that report is built, so web workers and the command line start fast.
 
 app = Flask(__name__)
 
+# --- Background job queue ---
+# /process only enqueues the upload; a bounded pool of job workers runs
+# run_dns_lookup() so the request returns immediately and the front-end polls
+# /status/<job_id> for progress.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Default per-job lookup deadline in seconds; 0 means no deadline
+JOB_DEADLINE_SECONDS = float(os.environ.get('JOB_DEADLINE_SECONDS', 0))
+# Default number of lookup processes per job; 1 keeps everything in-process
+JOB_SHARDS = int(os.environ.get('JOB_SHARDS', 1))
+# Live results: batches kept per job for late /stream subscribers, the
+# longest a collected result waits before it is published, and the interval
+# between status events while nothing new arrives
+LIVE_BUFFER_BATCHES = int(os.environ.get('LIVE_BUFFER_BATCHES', 100))
+LIVE_FLUSH_SECONDS = float(os.environ.get('LIVE_FLUSH_SECONDS', 1.0))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', 2.0))
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='dns-job')
+jobs = {}
+jobs_lock = threading.Lock()
+
+class LiveFeed:
+    # Per-domain outcomes and running chart counts of one job as they are
+    # collected. Only the most recent batches are kept, and none once the job
+    # finishes; a subscriber that falls behind skips ahead but always gets the
+    # current counts.
+    def __init__(self, max_batches=LIVE_BUFFER_BATCHES):
+        self.batches = deque(maxlen=max_batches)
+        self.seq = 0
+        self.counts = {}
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def publish(self, rows, counts):
+        with self._cond:
+            self.seq += 1
+            self.batches.append((self.seq, rows))
+            self.counts = counts
+            self._cond.notify_all()
+
+    def close(self):
+        # Finished jobs stay in memory, so only the counters survive; late
+        # subscribers replay from the stored results instead
+        with self._cond:
+            self.closed = True
+            self.batches = None
+            self._cond.notify_all()
+
+    def wait(self, after, timeout):
+        # (batches newer than seq after, counts, closed), blocking up to
+        # timeout while there is nothing new
+        with self._cond:
+            if self.seq <= after and not self.closed:
+                self._cond.wait(timeout)
+            if self.closed:
+                return [], self.counts, True
+            return [b for b in self.batches if b[0] > after], self.counts, False
+
+class Job:
+    def __init__(self, job_id, input_csv, output_dir, options=None):
+        self.job_id = job_id
+        self.input_csv = input_csv
+        self.output_dir = output_dir
+        self.status = 'queued'
+        self.total = 0
+        self.completed = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.options = options or {}
+        self.limiters = {}
+        self.deadline_expired = False
+        self.live = LiveFeed()
+        self._lock = threading.Lock()
+
+    def set_total(self, total):
+        with self._lock:
+            self.total = total
+
+    def advance(self, count=1):
+        with self._lock:
+            self.completed += count
+
+    def to_dict(self):
+        with self._lock:
+            if self.started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'completed': self.completed,
+                'total': self.total,
+                'elapsed_seconds': round(elapsed, 2),
+                'queued_seconds': round((self.started_at or time.time()) - self.created_at, 2),
+                'error': self.error,
+                'concurrency': {name: limiter.snapshot() for name, limiter in self.limiters.items()},
+                # Per-TLD WHOIS ceilings, if any; see WHOIS_RATE_PER_TLD and
+                # WHOIS_CONCURRENCY_PER_TLD
+                'whois_rate_limit': {'per_tld_per_second': whois_limiter.rate or None, 'burst': whois_limiter.capacity,
+                                     'per_tld_concurrency': whois_limiter.concurrency or None},
+                'deadline_expired': self.deadline_expired,
+                'results_url': f'/results/{self.job_id}' if self.status == 'done' else None,
+            }
+
+def run_job(job):
+    job.status = 'running'
+    job.started_at = time.time()
+    try:
+        run_dns_lookup(job.input_csv, job.output_dir, job=job, **job.options)
+        job.status = 'done'
+    except Exception as e:
+        logging.exception(f"Job {job.job_id} failed")
+        job.error = str(e)
+        job.status = 'failed'
+    finally:
+        job.finished_at = time.time()
+        job.live.close()
+        if os.path.isdir(job.output_dir):
+            job_store.register(job.job_id)
+        jobs_finished_total.inc(job.status)
+        report_stage_seconds.observe(job.finished_at - job.started_at, 'total')
+
+def submit_job(input_csv, output_dir, job_id, options=None):
+    job = Job(job_id, input_csv, output_dir, options)
+    with jobs_lock:
+        jobs[job_id] = job
+    job_executor.submit(run_job, job)
+    return job
+
+def get_job(job_id):
+    with jobs_lock:
+        return jobs.get(job_id)
+
+# --- Metrics ---
+# A small Prometheus text-format registry: histograms and counters are
+# updated from the lookup engine, the WHOIS path and the report stages, and
+# gauges for jobs and caches are read when /metrics is scraped.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+metrics_registry = []
+
+def metric_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def drain(self):
+        # Everything counted since the last drain, which starts over at zero
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values):
+        with self._lock:
+            for labels, value in values.items():
+                self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{metric_labels(self.labelnames, labels)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts, sum, count, max]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+            series[3] = max(series[3], value)
+
+    def drain(self):
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        with self._lock:
+            for labels, (counts, total, count, peak) in series.items():
+                mine = self._series.get(labels)
+                if mine is None:
+                    mine = self._series[labels] = [[0] * len(self.buckets), 0.0, 0, 0.0]
+                mine[0] = [a + b for a, b in zip(mine[0], counts)]
+                mine[1] += total
+                mine[2] += count
+                mine[3] = max(mine[3], peak)
+
+    def quantile(self, q, *labels):
+        # Upper bound of the bucket holding the q-th observation
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None or not series[2]:
+                return None
+            rank = q * series[2]
+            seen = 0
+            for bound, count in zip(self.buckets, series[0]):
+                seen += count
+                if seen >= rank:
+                    return min(bound, series[3])
+            return series[3]
+
+    def snapshot(self):
+        with self._lock:
+            items = [(labels, series[1], series[2], series[3]) for labels, series in self._series.items()]
+        return {
+            '/'.join(labels) or self.name: {
+                'count': count,
+                'mean_seconds': round(total / count, 4) if count else 0.0,
+                'p50_seconds': self.quantile(0.5, *labels),
+                'p95_seconds': self.quantile(0.95, *labels),
+                'max_seconds': round(peak, 4),
+            }
+            for labels, total, count, peak in items
+        }
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = sorted((labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items())
+        for labels, counts, total, count in series_items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{metric_labels(self.labelnames, labels, ("le", bound))} {cumulative}')
+            lines.append(f'{self.name}_bucket{metric_labels(self.labelnames, labels, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{metric_labels(self.labelnames, labels)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{metric_labels(self.labelnames, labels)} {count}')
+        return lines
+
+def register_metric(metric):
+    metrics_registry.append(metric)
+    return metric
+
+def drain_metrics():
+    # Shard workers send these deltas to the parent, which merges them into
+    # the registry /metrics serves
+    return {metric.name: metric.drain() for metric in metrics_registry}
+
+def merge_metrics(deltas):
+    for metric in metrics_registry:
+        if deltas.get(metric.name):
+            metric.merge(deltas[metric.name])
+
+dns_query_seconds = register_metric(Histogram('dns_query_duration_seconds', 'Latency of DNS queries sent to each resolver', ('record_type', 'resolver')))
+dns_queries_total = register_metric(Counter('dns_queries_total', 'DNS queries sent to each resolver by outcome', ('record_type', 'resolver', 'outcome')))
+lookup_seconds = register_metric(Histogram('domain_lookup_duration_seconds', 'Per-domain DMARC, SPF, MX and WHOIS lookup time, cache hits included', ('lookup',)))
+whois_query_seconds = register_metric(Histogram('whois_query_duration_seconds', 'Latency of WHOIS queries that missed the cache'))
+whois_lookups_total = register_metric(Counter('whois_lookups_total', 'WHOIS lookups by result', ('result',)))
+report_stage_seconds = register_metric(Histogram('report_stage_duration_seconds', 'Time spent in each step of a job', ('stage',)))
+jobs_finished_total = register_metric(Counter('jobs_finished_total', 'Finished jobs by final status', ('status',)))
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    with jobs_lock:
+        current_jobs = list(jobs.values())
+    gauges = [
+        ('jobs_queued', 'Jobs waiting for a job worker', sum(job.status == 'queued' for job in current_jobs)),
+        ('jobs_active', 'Jobs currently running', sum(job.status == 'running' for job in current_jobs)),
+        ('dns_in_flight', 'DNS queries outstanding across running jobs',
+         sum(job.limiters['dns'].snapshot()['in_flight'] for job in current_jobs if job.status == 'running' and 'dns' in job.limiters)),
+    ]
+    for name, cache in (('dns', dns_cache), ('whois', whois_cache), ('results_page', results_page_cache)):
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        gauges.append((f'{name}_cache_hit_ratio', f'{name} cache hits / lookups since start', round(stats['hits'] / lookups, 4) if lookups else 0.0))
+        gauges.append((f'{name}_cache_entries', f'Entries in the {name} cache', stats['entries']))
+    store = job_store.stats()
+    gauges.append(('job_store_bytes', 'Bytes used by finished jobs, packed or not', store['bytes']))
+    gauges.append(('job_store_jobs', 'Finished jobs kept on disk', store['jobs']))
+    for name, documentation, value in gauges:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+# --- Job manifest and results page cache ---
+# A finished job writes manifest.json listing its artifacts with size and
+# sha256, so result and download routes never list directories. The results
+# page is rendered once per job and kept, with its compressed variants, in a
+# bounded LRU; ETag/Last-Modified make repeat requests a 304.
+RESULTS_ROOT = 'webapp_results'
+MANIFEST_NAME = 'manifest.json'
+RESULTS_PAGE_CACHE_SIZE = int(os.environ.get('RESULTS_PAGE_CACHE_SIZE', 128))
+MANIFEST_CACHE_SIZE = int(os.environ.get('MANIFEST_CACHE_SIZE', 1024))
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+
+class LRUCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+manifest_lock = threading.Lock()
+manifest_cache = LRUCache(MANIFEST_CACHE_SIZE)
+results_page_cache = LRUCache(RESULTS_PAGE_CACHE_SIZE)
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def manifest_entries(output_dir, artifacts):
+    entries = {}
+    for role, path in artifacts.items():
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        entries[role] = {
+            'path': os.path.relpath(path, output_dir),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': file_digest(path),
+        }
+    return entries
+
+def write_manifest(output_dir, artifacts, stages=None):
+    # artifacts maps a role ('results', 'report', 'excel', 'html', 'pdf', 'log'
+    # or a chart file name) to its path; paths are stored relative to the job
+    # directory. stages holds the seconds spent in each step of run_dns_lookup.
+    manifest = {'job_id': os.path.basename(os.path.normpath(output_dir)), 'finished_at': time.time(),
+                'artifacts': manifest_entries(output_dir, artifacts), 'stages': stages or {}}
+    return save_manifest(output_dir, manifest)
+
+def extend_manifest(job_id, artifacts, store=None, stages=None):
+    # Records artifacts built after the job finished; stages adds the seconds
+    # their builds took to the manifest and the job's timings file
+    store = store or job_store
+    output_dir = store.job_dir(job_id)
+    with manifest_lock:
+        manifest = load_manifest(job_id, store)
+        entries = dict(manifest['artifacts'])
+        entries.update(manifest_entries(output_dir, artifacts))
+        stage_seconds = dict(manifest.get('stages') or {})
+        for stage, seconds in (stages or {}).items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+        if stages and 'timings' in entries:
+            timings_path = os.path.join(output_dir, entries['timings']['path'])
+            with open(timings_path, encoding='utf-8') as f:
+                timings = json.load(f)
+            timings['stages'] = dict(timings.get('stages') or {}, **{stage: stage_seconds[stage] for stage in stages})
+            with open(timings_path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(timings, f, indent=2)
+            os.replace(timings_path + '.tmp', timings_path)
+            entries.update(manifest_entries(output_dir, {'timings': timings_path}))
+        manifest = save_manifest(output_dir, dict(manifest, artifacts=entries, stages=stage_seconds))
+    store.resize(job_id)
+    return manifest
+
+def save_manifest(output_dir, manifest):
+    tmp_path = os.path.join(output_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_NAME))
+    manifest_cache.put(manifest['job_id'], manifest)
+    results_page_cache.discard(manifest['job_id'])
+    return manifest
+
+def scan_job_artifacts(output_dir):
+    # Jobs finished before manifests existed: find their artifacts once
+    artifacts = {}
+    for subdir, suffix, role in (('', '.xlsx', 'excel'), ('Dashboard', '.html', 'html'),
+                                 ('Dashboard', '.pdf', 'pdf'), ('Logs', '.txt', 'log'), ('Images', '.png', None)):
+        folder = os.path.join(output_dir, subdir)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.endswith(suffix):
+                artifacts.setdefault(role or name, os.path.join(folder, name))
+    return artifacts
+
+def load_manifest(job_id, store=None):
+    # Jobs live in the web app's job store unless another store is given
+    store = store or job_store
+    if not store.valid_id(job_id):
+        return None
+    store.touch(job_id)
+    manifest = manifest_cache.get(job_id)
+    if manifest is not None:
+        return manifest
+    store.open(job_id)
+    output_dir = store.job_dir(job_id)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        manifest_cache.put(job_id, manifest)
+        return manifest
+    # Only jobs the store already indexes get a manifest written for them
+    if store.known(job_id) and os.path.isdir(os.path.join(output_dir, 'Dashboard')):
+        return write_manifest(output_dir, scan_job_artifacts(output_dir))
+    return None
+
+def artifact_path(job_id, manifest, role, store=None):
+    entry = manifest['artifacts'].get(role)
+    if entry is None:
+        return None, None
+    return os.path.join((store or job_store).job_dir(job_id), entry['path']), entry
+
+class CachedPage:
+    # A fully rendered response body plus its lazily built gzip/brotli variants
+    def __init__(self, body, etag, last_modified, mimetype='text/html'):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.mimetype = mimetype
+        self._encoded = {}
+
+    def encoded(self, encoding):
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == 'br':
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=6)
+            self._encoded[encoding] = body
+        return body
+
+    def response(self, req):
+        encoding = None
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            if brotli is not None and req.accept_encodings['br']:
+                encoding = 'br'
+            elif req.accept_encodings['gzip']:
+                encoding = 'gzip'
+        body = self.body if encoding is None else self.encoded(encoding)
+        response = app.response_class(body, mimetype=self.mimetype)
+        response.set_etag(self.etag if encoding is None else f'{self.etag}-{encoding}')
+        response.last_modified = self.last_modified
+        response.vary.add('Accept-Encoding')
+        response.cache_control.no_cache = True
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response.make_conditional(req)
+
+# --- Job store ---
+# Finished jobs are indexed in SQLite with their size and last access, so
+# nothing lists RESULTS_ROOT after the index is first seeded. A background
+# sweeper packs jobs idle for JOB_PACK_IDLE_SECONDS into a single
+# <job_id>.zip (expanded again on the next access), deletes jobs finished more
+# than JOB_STORE_MAX_AGE seconds ago and evicts the least recently accessed
+# jobs while the store holds more than JOB_STORE_MAX_BYTES. 0 turns a limit off.
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(RESULTS_ROOT, 'job_store.sqlite3'))
+JOB_STORE_MAX_BYTES = int(os.environ.get('JOB_STORE_MAX_BYTES', 5 * 1024 ** 3))
+JOB_STORE_MAX_AGE = int(os.environ.get('JOB_STORE_MAX_AGE', 30 * 24 * 3600))
+JOB_PACK_IDLE_SECONDS = int(os.environ.get('JOB_PACK_IDLE_SECONDS', 3600))
+JOB_STORE_SWEEP_SECONDS = float(os.environ.get('JOB_STORE_SWEEP_SECONDS', 300))
+# Already-compressed files are stored in packed jobs as-is
+JOB_PACK_STORED_SUFFIXES = ('.xlsx', '.png', '.pdf', '.parquet', '.zip')
+
+def valid_job_id(job_id):
+    # Job ids are the canonical uuid4 strings /process hands out, so a valid
+    # id is always a single path component under RESULTS_ROOT
+    try:
+        return str(uuid.UUID(job_id)) == job_id
+    except (TypeError, ValueError, AttributeError):
+        return False
+
+def dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            total += dir_size(entry.path)
+        else:
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+class JobStore:
+    def __init__(self, root=RESULTS_ROOT, path=JOB_STORE_PATH, max_bytes=JOB_STORE_MAX_BYTES, max_age=JOB_STORE_MAX_AGE,
+                 pack_idle=JOB_PACK_IDLE_SECONDS, sweep_interval=JOB_STORE_SWEEP_SECONDS, seed=True, valid_id=valid_job_id):
+        self.root = root
+        # Which job ids may be mapped to a path under root
+        self.valid_id = valid_id
+        # Whether an empty index is seeded by listing root, which only the
+        # web app's own results directory should be
+        self.seed = seed
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pack_idle = pack_idle
+        self.sweep_interval = sweep_interval
+        self._lock = threading.RLock()
+        self._conn = None
+        self._jobs = None
+        self._dirty = set()
+        self._sweeper = None
+        self.evictions = 0
+        self.packs = 0
+        self.unpacks = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, size INTEGER NOT NULL, '
+                               'finished_at REAL NOT NULL, last_access REAL NOT NULL, packed INTEGER NOT NULL)')
+        return self._conn
+
+    def _index(self):
+        # job_id -> {size, finished_at, last_access, packed}, loaded once; a
+        # new index is seeded from the jobs already on disk
+        if self._jobs is None:
+            rows = self._connect().execute('SELECT job_id, size, finished_at, last_access, packed FROM jobs').fetchall()
+            self._jobs = {row[0]: dict(zip(('size', 'finished_at', 'last_access', 'packed'), row[1:])) for row in rows}
+            if not rows and self.seed and os.path.isdir(self.root):
+                for entry in os.scandir(self.root):
+                    if entry.is_dir() and (os.path.exists(os.path.join(entry.path, MANIFEST_NAME))
+                                           or os.path.isdir(os.path.join(entry.path, 'Dashboard'))):
+                        size, packed = dir_size(entry.path), 0
+                    elif entry.is_file() and entry.name.endswith('.zip'):
+                        size, packed = entry.stat().st_size, 1
+                    else:
+                        continue
+                    job_id = os.path.splitext(entry.name)[0] if packed else entry.name
+                    if not self.valid_id(job_id):
+                        continue
+                    mtime = entry.stat().st_mtime
+                    self._jobs[job_id] = {'size': size, 'finished_at': mtime, 'last_access': mtime, 'packed': packed}
+                self._save(self._jobs)
+        return self._jobs
+
+    def _save(self, job_ids):
+        conn = self._connect()
+        for job_id in job_ids:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                conn.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+            else:
+                conn.execute('INSERT OR REPLACE INTO jobs (job_id, size, finished_at, last_access, packed) VALUES (?, ?, ?, ?, ?)',
+                             (job_id, entry['size'], entry['finished_at'], entry['last_access'], entry['packed']))
+        conn.commit()
+
+    def job_dir(self, job_id):
+        if not self.valid_id(job_id):
+            raise ValueError(f"Invalid job id {job_id!r}")
+        return os.path.join(self.root, job_id)
+
+    def known(self, job_id):
+        with self._lock:
+            return job_id in self._index()
+
+    def archive_path(self, job_id):
+        return os.path.join(self.root, job_id + '.zip')
+
+    def register(self, job_id):
+        # Called once a job's directory is complete
+        now = time.time()
+        size = dir_size(self.job_dir(job_id))
+        with self._lock:
+            self._index()[job_id] = {'size': size, 'finished_at': now, 'last_access': now, 'packed': 0}
+            self._save([job_id])
+
+    def resize(self, job_id):
+        # After an artifact was added to an unpacked job
+        with self._lock:
+            entry = self._index().get(job_id)
+            if entry is not None and not entry['packed']:
+                entry['size'] = dir_size(self.job_dir(job_id))
+                self._dirty.add(job_id)
+
+    def touch(self, job_id):
+        # Access times are only written back by the sweeper
+        with self._lock:
+            entry = self._index().get(job_id)
+            if entry is not None:
+                entry['last_access'] = time.time()
+                self._dirty.add(job_id)
+
+    def open(self, job_id):
+        # Expands a packed job back into its directory
+        with self._lock:
+            entry = self._index().get(job_id)
+            if entry is None or not entry['packed']:
+                return
+            unpacking = self.job_dir(job_id) + '.unpacking'
+            shutil.rmtree(unpacking, ignore_errors=True)
+            with zipfile.ZipFile(self.archive_path(job_id)) as archive:
+                archive.extractall(unpacking)
+            os.replace(unpacking, self.job_dir(job_id))
+            os.remove(self.archive_path(job_id))
+            entry.update(size=dir_size(self.job_dir(job_id)), packed=0, last_access=time.time())
+            self._save([job_id])
+            self.unpacks += 1
+
+    def _forget(self, job_id):
+        manifest_cache.discard(job_id)
+        results_page_cache.discard(job_id)
+
+    def _discard(self, path):
+        # Moves a job's directory or archive out of the way under the lock;
+        # the returned path is deleted after the lock is released
+        if not os.path.exists(path):
+            return None
+        doomed = f'{path}.{uuid.uuid4().hex}.deleting'
+        os.replace(path, doomed)
+        return doomed
+
+    def _delete(self, paths):
+        for path in paths:
+            if path is None:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def _pack(self, job_id, seen):
+        # The archive is written without the lock; it only replaces the
+        # directory if the job was not touched, opened or evicted meanwhile
+        output_dir = self.job_dir(job_id)
+        archive_path = self.archive_path(job_id)
+        with zipfile.ZipFile(archive_path + '.tmp', 'w') as archive:
+            for folder, _, files in os.walk(output_dir):
+                for name in files:
+                    path = os.path.join(folder, name)
+                    compress = zipfile.ZIP_STORED if name.endswith(JOB_PACK_STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+                    archive.write(path, os.path.relpath(path, output_dir), compress_type=compress)
+        with self._lock:
+            entry = self._jobs.get(job_id)
+            if entry != seen:
+                doomed = [archive_path + '.tmp']
+            else:
+                os.replace(archive_path + '.tmp', archive_path)
+                self._forget(job_id)
+                doomed = [self._discard(output_dir)]
+                entry.update(size=os.path.getsize(archive_path), packed=1)
+                self._dirty.add(job_id)
+                self.packs += 1
+        self._delete(doomed)
+
+    def _evict(self, job_id, seen):
+        with self._lock:
+            if self._jobs.get(job_id) != seen:
+                return
+            self._forget(job_id)
+            doomed = [self._discard(self.job_dir(job_id)), self._discard(self.archive_path(job_id))]
+            del self._jobs[job_id]
+            self._dirty.add(job_id)
+            with jobs_lock:
+                jobs.pop(job_id, None)
+            self.evictions += 1
+        self._delete(doomed)
+
+    def _idle_victims(self, now, busy):
+        # [(action, job_id, index entry as seen)] for jobs past their age or
+        # idle time
+        victims = []
+        for job_id, entry in self._index().items():
+            if job_id in busy:
+                continue
+            if self.max_age and now - entry['finished_at'] > self.max_age:
+                victims.append((self._evict, job_id, dict(entry)))
+            elif self.pack_idle and not entry['packed'] and now - entry['last_access'] > self.pack_idle:
+                victims.append((self._pack, job_id, dict(entry)))
+        return victims
+
+    def _quota_victims(self, busy):
+        # The least recently accessed jobs while the store is over its quota
+        index = self._index()
+        victims = []
+        total = sum(entry['size'] for entry in index.values())
+        for job_id in sorted(index, key=lambda j: index[j]['last_access']):
+            if total <= self.max_bytes:
+                break
+            if job_id in busy:
+                continue
+            total -= index[job_id]['size']
+            victims.append((self._evict, job_id, dict(index[job_id])))
+        return victims
+
+    def _clean_up(self, victims):
+        for action, job_id, seen in victims:
+            try:
+                action(job_id, seen)
+            except OSError:
+                logging.exception(f"Job store could not clean up job {job_id}")
+
+    def sweep(self, now=None):
+        # Victims are chosen under the lock, packed or deleted outside it so
+        # touch() and register() never wait on disk I/O, and re-checked
+        # under the lock before the index changes
+        now = time.time() if now is None else now
+        with artifact_builds_lock:
+            busy = {job_id for job_id, _ in artifact_builds}
+        with self._lock:
+            victims = self._idle_victims(now, busy)
+        self._clean_up(victims)
+        if self.max_bytes:
+            # Chosen after the packs, from the packed sizes
+            with self._lock:
+                victims = self._quota_victims(busy)
+            self._clean_up(victims)
+        with self._lock:
+            self._save(self._dirty)
+            self._dirty.clear()
+
+    def start(self):
+        with self._lock:
+            if self._sweeper is None and self.sweep_interval > 0:
+                self._sweeper = threading.Thread(target=self._run_sweeper, name='job-store-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _run_sweeper(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("Job store sweep failed")
+
+    def stats(self):
+        with self._lock:
+            index = self._index()
+            return {
+                'jobs': len(index),
+                'packed': sum(entry['packed'] for entry in index.values()),
+                'bytes': sum(entry['size'] for entry in index.values()),
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'evictions': self.evictions,
+                'packs': self.packs,
+                'unpacks': self.unpacks,
+            }
+
+job_store = JobStore()
+
+@app.before_request
+def start_job_store():
+    # Started by the first request rather than at import, so shard worker
+    # processes never run a sweeper
+    job_store.start()
+
 # --- Enhanced Homepage ---
 UPLOAD_FORM = '''
 <!doctype html>
@@ -54,6 +864,7 @@ UPLOAD_FORM = '''
     .spinner { display: none; margin: 18px auto 0 auto; border: 6px solid #e6f7ec; border-top: 6px solid #008A4B; border-radius: 50%; width: 44px; height: 44px; animation: spin 1s linear infinite; }
     @keyframes spin { 100% { transform: rotate(360deg); } }
     .success-message { display: none; color: #008A4B; font-size: 1.15em; font-weight: 600; margin-top: 22px; margin-bottom: 0px; text-align: center; }
+    .progress-message { display: none; color: #222; font-size: 1.05em; margin-top: 14px; text-align: center; }
     .domain-preview { display: none; background: #f6fff9; border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.07); padding: 18px 18px; margin-bottom: 18px; font-size: 1.08em; text-align: center; }
   </style>
 </head>
@@ -74,7 +885,8 @@ UPLOAD_FORM = '''
       <div class="domain-preview" id="domainPreview" style="display:none;"></div>
       <button type="submit" id="submitBtn">Generate Report</button>
       <div class="spinner" id="spinner"></div>
-      <div class="success-message" id="successMsg">Report generated successfully! Redirecting...</div>
+      <div class="progress-message" id="progressMsg"></div>
+      <div class="success-message" id="successMsg">Upload complete! Opening live results...</div>
     </form>
   </div>
   <div class="footer">&copy; 2025 Kenvue | Powered by Python & Flask</div>
@@ -100,6 +912,12 @@ UPLOAD_FORM = '''
       };
       reader.readAsText(file);
     }
+    function showError() {
+      document.getElementById('spinner').style.display = 'none';
+      document.getElementById('progressMsg').style.display = 'none';
+      document.getElementById('submitBtn').disabled = false;
+      alert('Error generating report.');
+    }
     function handleFormSubmit(e) {
       e.preventDefault();
       document.getElementById('submitBtn').disabled = true;
@@ -108,21 +926,16 @@ UPLOAD_FORM = '''
       var formData = new FormData(document.getElementById('uploadForm'));
       fetch('/process', { method: 'POST', body: formData })
         .then(response => {
-          if (response.redirected) {
-            document.getElementById('spinner').style.display = 'none';
-            document.getElementById('successMsg').style.display = 'block';
-            setTimeout(() => { window.location.href = response.url; }, 1200);
-          } else {
-            document.getElementById('spinner').style.display = 'none';
-            document.getElementById('submitBtn').disabled = false;
-            alert('Error generating report.');
-          }
+          if (!response.ok) { throw new Error('upload failed'); }
+          return response.json();
         })
-        .catch(() => {
+        .then(job => {
+          // The results page shows live results until the reports are ready
           document.getElementById('spinner').style.display = 'none';
-          document.getElementById('submitBtn').disabled = false;
-          alert('Error generating report.');
-        });
+          document.getElementById('successMsg').style.display = 'block';
+          window.location.href = job.results_url;
+        })
+        .catch(showError);
       return false;
     }
     document.getElementById('domains_csv').addEventListener('change', showDomainPreview);
@@ -135,20 +948,175 @@ UPLOAD_FORM = '''
 def index():
     return render_template_string(UPLOAD_FORM)
 
+# --- Live results ---
+# While a job runs, /results/<job_id> serves LIVE_RESULTS_PAGE, which follows
+# /stream/<job_id> and reloads into the full dashboard once the job is done.
+LIVE_RESULTS_PAGE = '''
+<!doctype html>
+<html lang="en">
+<head>
+  <title>DNS Lookup Results (live)</title>
+  <style>
+    body { font-family: 'Segoe UI', Arial, sans-serif; background: #f6fff9; margin:0; }
+    .main-header { text-align:center; background: linear-gradient(90deg, #008A4B 0%, #6FCF97 100%); color: #fff; padding: 36px 0 18px 0; font-size:2.2em; font-weight:700; letter-spacing:1px; border-radius:0 0 18px 18px; box-shadow:0 2px 12px rgba(0,0,0,0.10); }
+    .container { max-width: 1200px; margin: 40px auto 0 auto; background: #fff; padding: 36px 36px 32px 36px; border-radius: 18px; box-shadow: 0 4px 24px rgba(0,0,0,0.10); }
+    .progress-message { color: #222; font-size: 1.1em; margin-bottom: 24px; text-align: center; }
+    .counts { display:flex; flex-wrap:wrap; gap:18px; justify-content:center; margin-bottom: 28px; }
+    .counts table, .live-table { border-collapse: collapse; font-size: 0.95em; }
+    .counts th, .counts td, .live-table th, .live-table td { border: 1px solid #ccc; padding: 6px 10px; text-align:left; }
+    .counts th, .live-table th { background: #008A4B; color: #fff; }
+    .live-table { width: 100%; }
+  </style>
+</head>
+<body>
+  <div class="main-header">DNS Lookup Results</div>
+  <div class="container">
+    <div class="progress-message" id="progressMsg">Queued...</div>
+    <div class="counts" id="counts"></div>
+    <table class="live-table">
+      <thead><tr><th>Domain</th><th>DMARC Policy</th><th>DMARC Ownership</th><th>SPF</th><th>MX</th><th>WHOIS</th></tr></thead>
+      <tbody id="liveRows"></tbody>
+    </table>
+  </div>
+  <script>
+    const MAX_ROWS = {{ max_rows }};
+    const titles = {spf_class: 'SPF Summary', mx_class: 'MX Summary', dmarc_ownership: 'DMARC Ownership',
+                    dmarc_policy: 'DMARC Policy', whois_class: 'WHOIS Summary'};
+    const source = new EventSource('/stream/{{ job_id }}');
+    function cell(tr, text) {
+      const td = document.createElement('td');
+      td.textContent = text === null ? '' : text;
+      tr.appendChild(td);
+    }
+    source.addEventListener('results', e => {
+      const body = document.getElementById('liveRows');
+      for (const row of JSON.parse(e.data)) {
+        const tr = document.createElement('tr');
+        [row.domain, row.dmarc_policy, row.dmarc_ownership, row.spf_class, row.mx_class, row.whois_class].forEach(v => cell(tr, v));
+        body.insertBefore(tr, body.firstChild);
+      }
+      while (body.children.length > MAX_ROWS) { body.removeChild(body.lastChild); }
+    });
+    source.addEventListener('counts', e => {
+      const counts = JSON.parse(e.data);
+      const box = document.getElementById('counts');
+      box.innerHTML = '';
+      for (const [attr, categories] of Object.entries(counts.charts || {})) {
+        const table = document.createElement('table');
+        const head = document.createElement('tr');
+        const th = document.createElement('th');
+        th.colSpan = 2; th.textContent = titles[attr] || attr;
+        head.appendChild(th); table.appendChild(head);
+        for (const [category, count] of Object.entries(categories)) {
+          if (!count) { continue; }
+          const tr = document.createElement('tr');
+          cell(tr, category); cell(tr, count);
+          table.appendChild(tr);
+        }
+        box.appendChild(table);
+      }
+    });
+    source.addEventListener('status', e => {
+      const job = JSON.parse(e.data);
+      const progress = document.getElementById('progressMsg');
+      if (job.status === 'queued') {
+        progress.innerText = 'Queued...';
+      } else if (job.status === 'running') {
+        progress.innerText = `Processed ${job.completed} / ${job.total} domains (${job.elapsed_seconds.toFixed(0)}s elapsed)`;
+      } else if (job.status === 'done') {
+        source.close();
+        progress.innerText = 'Report generated successfully! Loading dashboard...';
+        window.location.reload();
+      } else {
+        source.close();
+        progress.innerText = `Error generating report: ${job.error}`;
+      }
+    });
+  </script>
+</body>
+</html>
+'''
+# Most recent rows kept in the live table
+LIVE_TABLE_ROWS = int(os.environ.get('LIVE_TABLE_ROWS', 500))
+
+def sse_message(event, data, event_id=None):
+    lines = [] if event_id is None else [f'id: {event_id}']
+    lines += [f'event: {event}', f'data: {json.dumps(data, default=str)}']
+    return '\n'.join(lines) + '\n\n'
+
+@app.route('/stream/<job_id>')
+def stream_job(job_id):
+    # results events carry each newly classified domain, counts the running
+    # chart counts and status the job progress; a reconnecting client resumes
+    # after its Last-Event-ID
+    job = get_job(job_id) if valid_job_id(job_id) else None
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    try:
+        after = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        after = 0
+    def events():
+        seq = after
+        while True:
+            batches, counts, closed = job.live.wait(seq, LIVE_HEARTBEAT_SECONDS)
+            for seq, rows in batches:
+                if rows:
+                    yield sse_message('results', rows, seq)
+            if closed and seq < job.live.seq:
+                rows = stored_live_rows(job_id)
+                if rows:
+                    yield sse_message('results', rows, job.live.seq)
+            if counts:
+                yield sse_message('counts', counts)
+            yield sse_message('status', job.to_dict())
+            if closed:
+                return
+    return app.response_class(events(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def stored_live_rows(job_id):
+    # The last LIVE_TABLE_ROWS rows of a finished job, for subscribers that
+    # missed batches the closed feed no longer holds
+    path = stored_results_path(job_id)
+    if path is None:
+        return []
+    return [live_row(result) for result in deque(read_results_file(path), maxlen=LIVE_TABLE_ROWS)]
+
 # --- Enhanced Results Page ---
 @app.route('/results/<job_id>')
 def results(job_id):
-    temp_dir = os.path.join('webapp_results', job_id)
-    dashboard_dir = os.path.join(temp_dir, 'Dashboard')
-    html_files = [f for f in os.listdir(dashboard_dir) if f.endswith('.html')]
-    pdf_files = [f for f in os.listdir(dashboard_dir) if f.endswith('.pdf')]
-    excel_files = [f for f in os.listdir(temp_dir) if f.endswith('.xlsx')]
+    if not valid_job_id(job_id):
+        return "Results not found", 404
+    job_store.touch(job_id)
+    job = get_job(job_id)
+    if job is not None and job.status == 'failed':
+        # The job's status, with the error text, instead of a 202 that
+        # would have clients polling forever
+        return jsonify(job.to_dict()), 500
+    if job is not None and job.status != 'done':
+        if request.accept_mimetypes.accept_html:
+            return render_template_string(LIVE_RESULTS_PAGE, job_id=job_id, max_rows=LIVE_TABLE_ROWS), 202
+        return jsonify(job.to_dict()), 202
+    page = results_page_cache.get(job_id)
+    if page is None:
+        manifest = load_manifest(job_id)
+        if manifest is None:
+            return "Results not found", 404
+        page = render_results_page(job_id, manifest)
+        results_page_cache.put(job_id, page)
+    return page.response(request)
+
+def render_results_page(job_id, manifest):
     dashboard_html = ''
-    if html_files:
-        with open(os.path.join(dashboard_dir, html_files[0]), 'r', encoding='utf-8') as f:
+    html_path, html_entry = ensure_artifact(job_id, 'html')
+    if html_path is not None:
+        with open(html_path, 'r', encoding='utf-8') as f:
             dashboard_html = f.read().replace('{job_id}', job_id)
+    pdf_files = artifact_available(manifest, 'pdf')
+    excel_files = artifact_available(manifest, 'excel')
     # Results page template
-    return render_template_string('''
+    body = render_template_string('''
     <!doctype html>
     <html lang="en">
     <head>
@@ -176,42 +1144,105 @@ def results(job_id):
             <a class="file-btn" href="/download/{{ job_id }}/excel" target="_blank">Open Excel</a>
             <a class="file-btn" href="/download/{{ job_id }}/excel?dl=1">Download Excel</a>
           {% endif %}
+          <a class="file-btn" href="/download/{{ job_id }}/zip">Download All (ZIP)</a>
         </div>
       </div>
     </body>
     </html>
     ''', dashboard_html=Markup(dashboard_html), job_id=job_id, pdf_files=pdf_files, excel_files=excel_files)
+    # The page only depends on the dashboard HTML and which downloads exist
+    etag = hashlib.sha256('|'.join([html_entry['sha256'] if html_entry else '', str(pdf_files), str(excel_files)]).encode()).hexdigest()[:32]
+    return CachedPage(body.encode('utf-8'), etag, manifest['finished_at'])
 
 @app.route('/results/<job_id>/image/<filename>')
 def serve_dashboard_image(job_id, filename):
-    temp_dir = os.path.join('webapp_results', job_id, 'Images')
-    path = os.path.join(temp_dir, filename)
-    if os.path.exists(path):
-        return send_file(path)
+    if valid_job_id(job_id) and filename.endswith('.png'):
+        path, entry = ensure_artifact(job_id, filename)
+        if path is not None:
+            return send_file(os.path.abspath(path), etag=entry['sha256'], last_modified=entry['mtime'])
     return "Image not found", 404
 
 @app.route('/download/<job_id>/<filetype>')
 def download_file(job_id, filetype):
-    temp_dir = os.path.join('webapp_results', job_id)
-    dashboard_dir = os.path.join(temp_dir, 'Dashboard')
-    if filetype == 'pdf':
-        files = [f for f in os.listdir(dashboard_dir) if f.endswith('.pdf')]
-        if files:
-            path = os.path.join(dashboard_dir, files[0])
-            if 'dl' in request.args:
-                return send_file(path, as_attachment=True)
-            else:
-                return send_file(path)
-    elif filetype == 'excel':
-        files = [f for f in os.listdir(temp_dir) if f.endswith('.xlsx')]
-        if files:
-            path = os.path.join(temp_dir, files[0])
-            if 'dl' in request.args:
-                return send_file(path, as_attachment=True)
-            else:
-                return send_file(path)
+    role = {'pdf': 'pdf', 'excel': 'excel'}.get(filetype)
+    if role is not None and valid_job_id(job_id):
+        path, entry = ensure_artifact(job_id, role)
+        if path is not None:
+            return send_file(os.path.abspath(path), as_attachment='dl' in request.args,
+                             etag=entry['sha256'], last_modified=entry['mtime'])
     return "File not found", 404
 
+# --- Streaming ZIP bundle ---
+# /download/<job_id>/zip streams every report artifact as one archive. The
+# ZIP is written into an unseekable sink that is drained after each chunk, so
+# nothing is buffered beyond one chunk and no temp file is used; members that
+# are already compressed are stored as-is.
+ZIP_STORED_SUFFIXES = ('.xlsx', '.png', '.pdf')
+ZIP_CHUNK_BYTES = 256 * 1024
+
+class ZipStreamSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def zip_bundle(job_id):
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for role in ('excel', 'pdf', 'html', *CHART_SOURCES, 'log'):
+            # Artifacts not built yet are built as the stream reaches them
+            path, entry = ensure_artifact(job_id, role)
+            if path is None:
+                continue
+            info = zipfile.ZipInfo.from_file(path, entry['path'])
+            info.compress_type = zipfile.ZIP_STORED if path.endswith(ZIP_STORED_SUFFIXES) else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w', force_zip64=entry['size'] >= zipfile.ZIP64_LIMIT) as dst:
+                for chunk in iter(lambda: src.read(ZIP_CHUNK_BYTES), b''):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+@app.route('/download/<job_id>/zip')
+def download_bundle(job_id):
+    if not valid_job_id(job_id):
+        return "File not found", 404
+    job = get_job(job_id)
+    if job is not None and job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    if load_manifest(job_id) is None:
+        return "File not found", 404
+    return app.response_class(zip_bundle(job_id), mimetype='application/zip', direct_passthrough=True,
+                              headers={'Content-Disposition': f'attachment; filename=DNS_Lookup_{job_id}.zip'})
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify({'dns': dns_cache.stats(), 'spf_trees': spf_tree_cache.stats(), 'whois': whois_cache.stats(),
+                    'results_pages': results_page_cache.stats(), 'manifests': manifest_cache.stats(),
+                    'job_store': job_store.stats()})
+
+@app.route('/metrics')
+def metrics():
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/resolvers/stats')
+def resolvers_stats():
+    with resolver_stats_lock:
+        stats = dict(resolver_stats)
+    return jsonify({nameserver: s.snapshot() for nameserver, s in stats.items()})
+
 @app.route('/download-sample')
 def download_sample():
     sample_path = os.path.join(os.path.dirname(__file__), 'SampleDomainList.csv')
@@ -222,220 +1253,2358 @@ def process():
     file = request.files.get('domains_csv')
     if not file:
         return "No file uploaded", 400
+    # Everything is validated before the job directory exists, so a rejected
+    # request leaves nothing behind
+    try:
+        options = job_options(request.form)
+    except ValueError:
+        return "Concurrency limits, shards and deadline must be positive numbers, with each minimum at most its maximum", 400
+    baseline = request.form.get('baseline_job_id')
+    if baseline:
+        # Only a finished job the store indexes, with stored results
+        if not valid_job_id(baseline) or not job_store.known(baseline) or stored_results_path(baseline) is None:
+            return "Unknown baseline job", 400
+        options['baseline'] = baseline
     job_id = str(uuid.uuid4())
-    temp_dir = os.path.join('webapp_results', job_id)
+    temp_dir = os.path.join(RESULTS_ROOT, job_id)
     os.makedirs(temp_dir, exist_ok=True)
     temp_csv = os.path.join(temp_dir, 'uploaded_domains.csv')
     file.save(temp_csv)
-    run_dns_lookup(temp_csv, temp_dir)
-    return redirect(f'/results/{job_id}')
+    submit_job(temp_csv, temp_dir, job_id, options)
+    return jsonify({'job_id': job_id, 'status_url': f'/status/{job_id}', 'results_url': f'/results/{job_id}'}), 202
+
+@app.route('/api/jobs/<job_id>/reclassify', methods=['POST'])
+def reclassify_job(job_id):
+    # Rebuilds a finished job's reports under the current classification
+    # rules from its stored results, without any DNS or WHOIS lookups
+    if not valid_job_id(job_id) or stored_results_path(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    new_job_id = str(uuid.uuid4())
+    output_dir = os.path.join(RESULTS_ROOT, new_job_id)
+    os.makedirs(output_dir, exist_ok=True)
+    submit_job(None, output_dir, new_job_id, {'reclassify': job_id})
+    return jsonify({'job_id': new_job_id, 'status_url': f'/status/{new_job_id}', 'results_url': f'/results/{new_job_id}'}), 202
+
+def job_options(form):
+    # Optional per-job min/max overrides for the adaptive DNS and WHOIS limiters
+    # (a minimum may not exceed its maximum) plus an optional shard count and
+    # lookup deadline
+    options = {}
+    for kind, defaults in (('dns', (DNS_MIN_IN_FLIGHT, DNS_MAX_IN_FLIGHT)), ('whois', (WHOIS_MIN_WORKERS, WHOIS_WORKERS))):
+        low, high = form.get(f'{kind}_min_concurrency'), form.get(f'{kind}_max_concurrency')
+        if low or high:
+            limits = (int(low) if low else defaults[0], int(high) if high else defaults[1])
+            if min(limits) < 1 or limits[0] > limits[1]:
+                raise ValueError(limits)
+            options[f'{kind}_limits'] = limits
+    if form.get('shards'):
+        options['shards'] = int(form['shards'])
+        if options['shards'] < 1:
+            raise ValueError(options['shards'])
+    if form.get('deadline_seconds'):
+        options['deadline'] = float(form['deadline_seconds'])
+        if options['deadline'] <= 0:
+            raise ValueError(options['deadline'])
+    return options
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id) if valid_job_id(job_id) else None
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/domains')
+def job_domains(job_id):
+    # ?classification=JNJ MX (repeatable), ?fields=domain,mx_record,
+    # ?cursor=<next_cursor from the previous page>, ?limit=100
+    if not valid_job_id(job_id):
+        return jsonify({'error': 'Unknown job'}), 404
+    job = get_job(job_id)
+    if job is not None and job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    manifest = load_manifest(job_id)
+    path = artifact_path(job_id, manifest, 'columnar')[0] if manifest is not None else None
+    if path is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+    unknown = sorted(set(fields or ()) - set(DomainResult.__slots__))
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', API_PAGE_SIZE))
+        if cursor < 0 or limit < 1:
+            raise ValueError(cursor, limit)
+    except ValueError:
+        return jsonify({'error': 'cursor and limit must be non-negative integers'}), 400
+    rows, next_cursor = query_result_store(path, request.args.getlist('classification'), fields,
+                                           cursor, min(limit, API_MAX_PAGE_SIZE))
+    return jsonify({'job_id': job_id, 'count': len(rows), 'next_cursor': next_cursor, 'domains': rows})
+
+# --- Async DNS resolution engine ---
+# One long-lived asyncio resolver per job instead of a new Resolver per query.
+# A semaphore caps the number of queries outstanding at once.
+# Queries go to the best-ranked resolver first and are hedged to the next one
+# if no answer arrives within that resolver's recent latency percentile.
+DNS_NAMESERVERS = [ns.strip() for ns in os.environ.get('DNS_NAMESERVERS', '1.1.1.1,8.8.8.8,9.9.9.9').split(',') if ns.strip()]
+DNS_PORT = int(os.environ.get('DNS_PORT', 53))
+DNS_TIMEOUT = float(os.environ.get('DNS_TIMEOUT', 10))
+DNS_LIFETIME = float(os.environ.get('DNS_LIFETIME', 20))
+DNS_HEDGE_PERCENTILE = float(os.environ.get('DNS_HEDGE_PERCENTILE', 0.95))
+DNS_HEDGE_DEFAULT_DELAY = float(os.environ.get('DNS_HEDGE_DEFAULT_DELAY', 0.3))
+DNS_HEDGE_MIN_DELAY = float(os.environ.get('DNS_HEDGE_MIN_DELAY', 0.02))
+DNS_STATS_WINDOW = int(os.environ.get('DNS_STATS_WINDOW', 512))
+DNS_MAX_IN_FLIGHT = int(os.environ.get('DNS_MAX_IN_FLIGHT', 200))
+DNS_MIN_IN_FLIGHT = int(os.environ.get('DNS_MIN_IN_FLIGHT', 10))
+DNS_LATENCY_TARGET = float(os.environ.get('DNS_LATENCY_TARGET', 0.5))
+WHOIS_WORKERS = int(os.environ.get('WHOIS_WORKERS', 10))
+WHOIS_MIN_WORKERS = int(os.environ.get('WHOIS_MIN_WORKERS', 1))
+WHOIS_LATENCY_TARGET = float(os.environ.get('WHOIS_LATENCY_TARGET', 5.0))
+# Errors that mean "slow down" rather than "the record does not exist"
+DNS_CONGESTION_ERRORS = (dns.exception.Timeout, dns.resolver.NoNameservers, OSError)
+WHOIS_CONGESTION_ERRORS = (OSError,)
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit for one event loop. Healthy completions (no error,
+    # latency under target) grow the limit by one each, doubling per round trip
+    # until the first back-off and by about one per round trip after that.
+    # Congestion errors halve it, at most once per cooldown.
+    def __init__(self, name, min_limit, max_limit, latency_target, initial=None, backoff=0.5, cooldown=1.0):
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial or self.min_limit)))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.slow_start = True
+        self._last_backoff = 0.0
+        self._waiters = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                raise
+        self.in_flight += 1
+
+    def release(self, ok, latency):
+        self.in_flight -= 1
+        if ok:
+            self.successes += 1
+            if latency <= self.latency_target:
+                step = 1.0 if self.slow_start else 1.0 / self.limit
+                self.limit = min(self.max_limit, self.limit + step)
+        else:
+            self.failures += 1
+            now = time.monotonic()
+            if now - self._last_backoff >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.slow_start = False
+                self._last_backoff = now
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def snapshot(self):
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'min': self.min_limit,
+            'max': self.max_limit,
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+# --- Shared DNS answer cache ---
+# Process-wide, so overlapping domain lists uploaded by different jobs reuse
+# answers. Keyed by (name, rdtype, nameserver); positive answers live for their
+# TTL, NXDOMAIN/NoAnswer for the SOA minimum (RFC 2308). Bounded with LRU
+# eviction. Timeouts and SERVFAIL are never cached. Negative answers are kept
+# as a NegativeAnswer and raised as a fresh exception on every hit, so no
+# shared exception object collects tracebacks across jobs and threads.
+DNS_CACHE_MAX_ENTRIES = int(os.environ.get('DNS_CACHE_MAX_ENTRIES', 100000))
+DNS_NEGATIVE_TTL_DEFAULT = int(os.environ.get('DNS_NEGATIVE_TTL_DEFAULT', 300))
+DNS_NEGATIVE_TTL_MAX = int(os.environ.get('DNS_NEGATIVE_TTL_MAX', 3600))
+
+class NegativeAnswer:
+    __slots__ = ('error_class', 'kwargs')
+
+    def __init__(self, exc):
+        self.error_class = type(exc)
+        self.kwargs = dict(exc.kwargs)
+
+    def error(self):
+        return self.error_class(**self.kwargs)
+
+class DNSAnswerCache:
+    def __init__(self, max_entries=DNS_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.miss_seconds = 0.0
+
+    @staticmethod
+    def make_key(name, record_type, nameserver):
+        return (str(name).lower().rstrip('.'), str(record_type).upper(), nameserver)
+
+    def get(self, key):
+        # Returns the cached Answer or NegativeAnswer, or None on a miss
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if isinstance(entry[1], NegativeAnswer):
+                self.negative_hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def expires_in(self, key):
+        # Seconds until the cached entry expires, or None if it is not cached
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return max(0.0, entry[0] - time.monotonic())
+
+    def record_miss_latency(self, seconds):
+        with self._lock:
+            self.miss_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'avg_miss_latency_ms': round(avg_miss * 1000, 2),
+                'estimated_seconds_saved': round(self.hits * avg_miss, 2),
+            }
+
+def negative_ttl(exc):
+    # SOA-minimum TTL for an NXDOMAIN/NoAnswer, capped at DNS_NEGATIVE_TTL_MAX
+    responses = []
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        responses = list(exc.kwargs.get('responses', {}).values())
+    elif isinstance(exc, dns.resolver.NoAnswer) and exc.kwargs.get('response') is not None:
+        responses = [exc.kwargs['response']]
+    for response in responses:
+        for rrset in response.authority:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return min(rrset.ttl, rrset[0].minimum, DNS_NEGATIVE_TTL_MAX)
+    return DNS_NEGATIVE_TTL_DEFAULT
+
+dns_cache = DNSAnswerCache()
+
+# --- Typed lookup outcomes ---
+# Every DNS lookup ends in one of these, so a missing record (nxdomain/nodata)
+# is never confused with a slow or failing resolver in the sheets and charts.
+OUTCOME_ANSWER = 'answer'
+OUTCOME_NXDOMAIN = 'nxdomain'
+OUTCOME_NODATA = 'nodata'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_SERVFAIL = 'servfail'
+OUTCOME_REFUSED = 'refused'
+LOOKUP_FAILURES = (OUTCOME_TIMEOUT, OUTCOME_SERVFAIL, OUTCOME_REFUSED)
+
+def lookup_outcome(exc):
+    if isinstance(exc, dns.resolver.NXDOMAIN):
+        return OUTCOME_NXDOMAIN
+    if isinstance(exc, dns.resolver.NoAnswer):
+        return OUTCOME_NODATA
+    if isinstance(exc, dns.exception.Timeout):
+        return OUTCOME_TIMEOUT
+    if isinstance(exc, dns.resolver.NoNameservers):
+        rcodes = {error[3] for error in exc.kwargs.get('errors') or [] if len(error) > 3}
+        if rcodes and rcodes <= {dns.rcode.to_text(dns.rcode.REFUSED)}:
+            return OUTCOME_REFUSED
+    return OUTCOME_SERVFAIL
+
+def missing_record_text(record_type, outcome):
+    if outcome in LOOKUP_FAILURES:
+        return f'{record_type} lookup failed ({outcome})'
+    return f'No {record_type} record found'
+
+# --- Per-resolver latency and error stats ---
+# Shared by every job so resolver ranking and hedge delays start warm.
+class ResolverStats:
+    def __init__(self, nameserver, window=DNS_STATS_WINDOW):
+        self.nameserver = nameserver
+        self.latencies = deque(maxlen=window)
+        # Whether each of the last window queries succeeded, so a resolver's
+        # error rate recovers as its recent answers do
+        self.outcomes = deque(maxlen=window)
+        self.recent_errors = 0
+        self.queries = 0
+        self.errors = 0
+        self.wins = 0
+        self._percentiles = {}
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.queries += 1
+            if len(self.outcomes) == self.outcomes.maxlen and not self.outcomes[0]:
+                self.recent_errors -= 1
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+                self.recent_errors += 1
+            # Percentiles are recomputed lazily every few samples, not per query
+            if self.queries % 32 == 1:
+                self._percentiles = {}
+
+    def record_win(self):
+        with self._lock:
+            self.wins += 1
+
+    def percentile(self, q):
+        with self._lock:
+            if q not in self._percentiles:
+                samples = sorted(self.latencies)
+                self._percentiles[q] = samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+            return self._percentiles[q]
+
+    def error_rate(self):
+        # Over the last window queries; errors and queries are lifetime counts
+        with self._lock:
+            return self.recent_errors / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self):
+        # Lower is better: median latency inflated by the recent error rate
+        median = self.percentile(0.5)
+        return (DNS_HEDGE_DEFAULT_DELAY if median is None else median) * (1 + 10 * self.error_rate())
+
+    def snapshot(self):
+        p50, p99 = self.percentile(0.5), self.percentile(0.99)
+        return {
+            'queries': self.queries,
+            'errors': self.errors,
+            'wins': self.wins,
+            'error_rate': round(self.error_rate(), 4),
+            'p50_ms': None if p50 is None else round(p50 * 1000, 2),
+            'p99_ms': None if p99 is None else round(p99 * 1000, 2),
+        }
+
+resolver_stats = {}
+resolver_stats_lock = threading.Lock()
+
+def get_resolver_stats(nameserver):
+    with resolver_stats_lock:
+        stats = resolver_stats.get(nameserver)
+        if stats is None:
+            stats = resolver_stats[nameserver] = ResolverStats(nameserver)
+        return stats
+
+def consume_task_outcome(task):
+    # Done callback for hedged attempts whose result nobody awaits
+    if not task.cancelled():
+        task.exception()
+
+# --- SPF include-tree evaluation ---
+# get_spf_record() walks the whole policy: include:, redirect=, a, mx, ptr and
+# exists terms are counted against the RFC 7208 limits of 10 DNS lookups and 2
+# void lookups, and the pass ranges of ip4/ip6, a and mx terms are flattened.
+# Each name's subtree is evaluated once and kept for the shortest TTL it
+# depends on, so the common provider includes are resolved once per process
+# rather than once per domain; an evaluation already running is awaited.
+SPF_LOOKUP_LIMIT = int(os.environ.get('SPF_LOOKUP_LIMIT', 10))
+SPF_VOID_LOOKUP_LIMIT = int(os.environ.get('SPF_VOID_LOOKUP_LIMIT', 2))
+SPF_MX_ADDRESS_LIMIT = 10
+SPF_TREE_CACHE_MAX_ENTRIES = int(os.environ.get('SPF_TREE_CACHE_MAX_ENTRIES', 20000))
+SPF_VERSION = re.compile(r'^v=spf1(\s|$)', re.I)
+SPF_MODIFIER = re.compile(r'^([a-z][a-z0-9_.\-]*)=(.*)$', re.I)
+SPF_MECHANISM = re.compile(r'^([+\-~?]?)([a-z0-9]+)(?::([^/]+))?(?:/(\d+))?(?://(\d+))?$', re.I)
+SPF_LOOKUP_MECHANISMS = ('include', 'a', 'mx', 'ptr', 'exists')
+VOID_OUTCOMES = (OUTCOME_NXDOMAIN, OUTCOME_NODATA)
+
+class SPFTree:
+    # One name's evaluated SPF policy. lookups and void_lookups count the
+    # terms beneath the record, not the TXT query that fetched it; void says
+    # whether that TXT query itself came back empty. Cached trees are shared,
+    # so they are never modified once evaluated.
+    __slots__ = ('record', 'outcome', 'void', 'lookups', 'void_lookups', 'ips', 'error', 'expires_at', 'cacheable')
+
+    def __init__(self):
+        self.record = None
+        self.outcome = OUTCOME_ANSWER
+        self.void = False
+        self.lookups = 0
+        self.void_lookups = 0
+        self.ips = set()
+        self.error = None
+        self.expires_at = float('inf')
+        self.cacheable = True
+
+    def fail(self, error, cacheable=True):
+        # The first error wins, as in a sequential evaluation
+        if self.error is None:
+            self.error = error
+        self.cacheable = self.cacheable and cacheable
+
+    def note_ttl(self, ttl):
+        # An answer that did not make it into the DNS cache is not reused here either
+        if ttl is None:
+            self.cacheable = False
+        else:
+            self.expires_at = min(self.expires_at, time.monotonic() + ttl)
+
+    def merge(self, child, ips=True):
+        self.lookups += child.lookups
+        self.void_lookups += child.void_lookups + child.void
+        if ips:
+            self.ips.update(child.ips)
+        if child.error is not None:
+            self.fail(child.error)
+        self.cacheable = self.cacheable and child.cacheable
+        self.expires_at = min(self.expires_at, child.expires_at)
+
+    def verdict(self):
+        # The error a receiver would hit evaluating this record, or None
+        if self.lookups > SPF_LOOKUP_LIMIT:
+            return f'permerror: {self.lookups} DNS lookups (limit {SPF_LOOKUP_LIMIT})'
+        if self.void_lookups > SPF_VOID_LOOKUP_LIMIT:
+            return f'permerror: {self.void_lookups} void lookups (limit {SPF_VOID_LOOKUP_LIMIT})'
+        return self.error
+
+    def flattened_ips(self):
+        return [str(network) for version in (4, 6)
+                for network in ipaddress.collapse_addresses(n for n in self.ips if n.version == version)]
+
+spf_tree_cache = DNSAnswerCache(SPF_TREE_CACHE_MAX_ENTRIES)
+
+class DNSLookupEngine:
+    def __init__(self, nameservers=None, limiter=None, timeout=DNS_TIMEOUT, lifetime=DNS_LIFETIME, cache=dns_cache,
+                 spf_cache=spf_tree_cache):
+        self.nameservers = list(nameservers or DNS_NAMESERVERS)
+        # The cache key covers the resolver set, since any member may answer
+        self.nameserver = ','.join(self.nameservers)
+        self.resolvers = {}
+        for nameserver in self.nameservers:
+            resolver = dns.asyncresolver.Resolver(configure=False)
+            resolver.port = DNS_PORT
+            resolver.nameservers = [nameserver]
+            resolver.timeout = timeout
+            resolver.lifetime = lifetime
+            self.resolvers[nameserver] = resolver
+        self.lifetime = lifetime
+        self.stats = {nameserver: get_resolver_stats(nameserver) for nameserver in self.nameservers}
+        self.cache = cache
+        self.spf_cache = spf_cache
+        # SPF evaluations in progress, and the names each one is waiting on
+        self._spf_pending = {}
+        self._spf_waiting = {}
+        self.limiter = limiter or AdaptiveLimiter('dns', DNS_MIN_IN_FLIGHT, DNS_MAX_IN_FLIGHT, DNS_LATENCY_TARGET)
+
+    def ranked_nameservers(self):
+        return sorted(self.nameservers, key=lambda nameserver: self.stats[nameserver].score())
+
+    def hedge_delay(self, nameserver):
+        delay = self.stats[nameserver].percentile(DNS_HEDGE_PERCENTILE)
+        if delay is None:
+            delay = DNS_HEDGE_DEFAULT_DELAY
+        return min(max(delay, DNS_HEDGE_MIN_DELAY), self.lifetime)
+
+    async def _query(self, nameserver, name, record_type):
+        started = time.monotonic()
+        outcome = OUTCOME_ANSWER
+        try:
+            answers = await self.resolvers[nameserver].resolve(name, record_type)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            outcome = lookup_outcome(e)
+            self.stats[nameserver].record(time.monotonic() - started, True)
+            raise
+        except asyncio.CancelledError:
+            # A hedged duplicate that lost the race; not a resolver outcome
+            outcome = None
+            raise
+        except Exception as e:
+            outcome = lookup_outcome(e)
+            self.stats[nameserver].record(time.monotonic() - started, False)
+            raise
+        finally:
+            if outcome is not None:
+                dns_query_seconds.observe(time.monotonic() - started, record_type, nameserver)
+                dns_queries_total.inc(record_type, nameserver, outcome)
+        self.stats[nameserver].record(time.monotonic() - started, True)
+        return answers
+
+    async def _hedged_resolve(self, name, record_type):
+        # Ask the best-ranked resolver; if it has not answered within its hedge
+        # delay (or it failed), also ask the next one. The first answer or
+        # definitive NXDOMAIN/NoAnswer wins and the rest are cancelled.
+        order = self.ranked_nameservers()
+        attempts = {}
+        errors = []
+        try:
+            for i, nameserver in enumerate(order):
+                attempts[asyncio.ensure_future(self._query(nameserver, name, record_type))] = nameserver
+                last = i == len(order) - 1
+                delay = None if last else self.hedge_delay(nameserver)
+                pending = [task for task in attempts if not task.done()]
+                while pending:
+                    done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        break
+                    for task in done:
+                        error = task.exception()
+                        if error is None or isinstance(error, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+                            self.stats[attempts[task]].record_win()
+                            trace_resolver(attempts[task])
+                            return task.result()
+                        errors.append(error)
+                    if not last:
+                        break
+                    pending = [task for task in attempts if not task.done()]
+            trace_resolver(','.join(attempts.values()))
+            raise errors[-1] if errors else dns.exception.Timeout()
+        finally:
+            # Losing attempts can finish alongside the winner or after their
+            # cancel; retrieve their outcome so asyncio does not log it as a
+            # never-retrieved exception
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+                task.add_done_callback(consume_task_outcome)
+
+    async def resolve(self, name, record_type):
+        key = self.cache.make_key(name, record_type, self.nameserver)
+        cached = self.cache.get(key)
+        if isinstance(cached, NegativeAnswer):
+            trace_resolver('cache')
+            raise cached.error()
+        if cached is not None:
+            trace_resolver('cache')
+            return cached
+        await self.limiter.acquire()
+        started = time.monotonic()
+        ok = True
+        try:
+            answers = await self._hedged_resolve(name, record_type)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+            self.cache.put(key, NegativeAnswer(e), negative_ttl(e))
+            raise
+        except DNS_CONGESTION_ERRORS:
+            ok = False
+            raise
+        finally:
+            latency = time.monotonic() - started
+            self.limiter.release(ok, latency)
+            self.cache.record_miss_latency(latency)
+        self.cache.put(key, answers, answers.rrset.ttl)
+        return answers
+
+    def remaining_ttl(self, name, record_type):
+        return self.cache.expires_in(self.cache.make_key(name, record_type, self.nameserver))
+
+    async def lookup(self, name, record_type):
+        # (outcome, answers); answers is None unless the outcome is 'answer'
+        try:
+            return OUTCOME_ANSWER, await self.resolve(name, record_type)
+        except Exception as e:
+            return lookup_outcome(e), None
+
+    async def get_dns_record(self, domain, record_type):
+        outcome, answers = await self.lookup(domain, record_type)
+        if answers is None:
+            return missing_record_text(record_type, outcome), outcome
+        return ', '.join(answer.to_text() for answer in answers), outcome
+
+    async def get_spf_record(self, domain):
+        # (record, outcome, SPFTree); the tree is None unless a record was found
+        tree = await self.spf_tree(domain)
+        if tree.record is not None:
+            return tree.record, OUTCOME_ANSWER, tree
+        if tree.outcome == OUTCOME_ANSWER:
+            # TXT records exist but none of them is SPF
+            return 'No SPF record found', OUTCOME_NODATA, None
+        return missing_record_text('SPF', tree.outcome), tree.outcome, None
+
+    async def spf_tree(self, name, waiter=None):
+        # waiter is the name whose record refers to this one; an evaluation
+        # that would end up waiting on itself is an include loop
+        name = name.lower().rstrip('.')
+        key = self.spf_cache.make_key(name, 'SPF', self.nameserver)
+        cached = self.spf_cache.get(key)
+        if cached is not None:
+            trace_resolver('cache')
+            return cached
+        if waiter is not None and self._spf_reaches(name, waiter):
+            tree = SPFTree()
+            tree.fail(f'permerror: include loop at {name}', cacheable=False)
+            return tree
+        task = self._spf_pending.get(name)
+        if task is None:
+            task = self._spf_pending[name] = asyncio.ensure_future(self._evaluate_spf(name, key))
+            task.add_done_callback(lambda _: self._spf_pending.pop(name, None))
+        else:
+            # Answered by the evaluation already in progress
+            trace_resolver('cache')
+        if waiter is None:
+            return await asyncio.shield(task)
+        self._spf_waiting.setdefault(waiter, []).append(name)
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waits = self._spf_waiting[waiter]
+            waits.remove(name)
+            if not waits:
+                del self._spf_waiting[waiter]
+
+    def _spf_reaches(self, name, target):
+        # Whether name is target or is waiting, directly or not, on target
+        seen, stack = set(), [name]
+        while stack:
+            current = stack.pop()
+            if current == target:
+                return True
+            if current not in seen:
+                seen.add(current)
+                stack.extend(self._spf_waiting.get(current, ()))
+        return False
+
+    async def _evaluate_spf(self, name, key):
+        tree = SPFTree()
+        tree.outcome, answers = await self.lookup(name, 'TXT')
+        tree.note_ttl(self.remaining_ttl(name, 'TXT'))
+        tree.void = tree.outcome in VOID_OUTCOMES
+        if answers is not None:
+            # A record split over several strings is their concatenation (RFC 7208 3.3)
+            records = [text for text in (b''.join(rdata.strings).decode('utf-8', 'replace') for rdata in answers)
+                       if SPF_VERSION.match(text)]
+            if records:
+                tree.record = records[0]
+                if len(records) > 1:
+                    tree.fail('permerror: multiple SPF records')
+                await self._evaluate_spf_terms(tree, name)
+        ttl = tree.expires_at - time.monotonic()
+        if tree.cacheable and ttl > 0:
+            self.spf_cache.put(key, tree, ttl)
+        return tree
+
+    async def _evaluate_spf_terms(self, tree, name):
+        has_all, redirect_target, mechanisms = False, None, []
+        for term in tree.record.split()[1:]:
+            modifier = SPF_MODIFIER.match(term)
+            if modifier is not None:
+                if modifier.group(1).lower() == 'redirect':
+                    redirect_target = modifier.group(2)
+                continue
+            match = SPF_MECHANISM.match(term)
+            if match is None:
+                tree.fail(f'permerror: invalid term {term}')
+                continue
+            qualifier, mechanism, target, cidr4, cidr6 = match.groups()
+            mechanism = mechanism.lower()
+            passes = qualifier in ('', '+')
+            if mechanism == 'all':
+                has_all = True
+            elif mechanism in ('ip4', 'ip6'):
+                try:
+                    network = ipaddress.ip_network(f'{target}/{cidr4}' if cidr4 else target, strict=False)
+                except ValueError:
+                    network = None
+                if network is None or cidr6 is not None or network.version != int(mechanism[2]):
+                    tree.fail(f'permerror: invalid term {term}')
+                elif passes:
+                    tree.ips.add(network)
+            elif mechanism in SPF_LOOKUP_MECHANISMS:
+                tree.lookups += 1
+                if mechanism in ('include', 'exists') and not target:
+                    tree.fail(f'permerror: invalid term {term}')
+                elif int(cidr4 or 32) > 32 or int(cidr6 or 128) > 128:
+                    tree.fail(f'permerror: invalid term {term}')
+                else:
+                    mechanisms.append(self._evaluate_spf_mechanism(tree, name, mechanism, target or name,
+                                                                   int(cidr4 or 32), int(cidr6 or 128), passes))
+            else:
+                tree.fail(f'permerror: unknown mechanism {term}')
+        # redirect= only applies when the record has no all mechanism
+        if redirect_target is not None and not has_all:
+            tree.lookups += 1
+            mechanisms.append(self._evaluate_spf_include(tree, name, redirect_target,
+                                                         f'redirect={redirect_target}', True))
+        await asyncio.gather(*mechanisms)
+
+    async def _evaluate_spf_mechanism(self, tree, name, mechanism, target, cidr4, cidr6, passes):
+        if '%' in target or mechanism in ('ptr', 'exists'):
+            # These depend on the connecting client or message, so they are
+            # counted but cannot be resolved ahead of time
+            return
+        if mechanism == 'include':
+            await self._evaluate_spf_include(tree, name, target, f'include:{target}', passes)
+        elif mechanism == 'a':
+            if await self._spf_addresses(tree, target, cidr4, cidr6, passes):
+                tree.void_lookups += 1
+        else:
+            outcome, answers = await self.lookup(target, 'MX')
+            tree.note_ttl(self.remaining_ttl(target, 'MX'))
+            if answers is None:
+                if outcome in LOOKUP_FAILURES:
+                    tree.fail(f'temperror: mx:{target} lookup failed ({outcome})', cacheable=False)
+                else:
+                    tree.void_lookups += 1
+                return
+            exchanges = sorted({str(rdata.exchange).rstrip('.').lower() for rdata in answers} - {''})
+            if len(exchanges) > SPF_MX_ADDRESS_LIMIT:
+                tree.fail(f'permerror: mx:{target} has more than {SPF_MX_ADDRESS_LIMIT} exchanges')
+            await asyncio.gather(*(self._spf_addresses(tree, exchange, cidr4, cidr6, passes)
+                                   for exchange in exchanges[:SPF_MX_ADDRESS_LIMIT]))
+
+    async def _evaluate_spf_include(self, tree, name, target, term, passes):
+        if '%' in target:
+            return
+        child = await self.spf_tree(target, waiter=name)
+        # include: contributes the ranges its target passes; redirect= all of them
+        tree.merge(child, ips=passes)
+        if child.record is None:
+            if child.outcome in LOOKUP_FAILURES:
+                tree.fail(f'temperror: {term} lookup failed ({child.outcome})', cacheable=False)
+            else:
+                tree.fail(f'permerror: {term} has no SPF record')
+
+    async def _spf_addresses(self, tree, host, cidr4, cidr6, passes):
+        # A and AAAA ranges for one host; True if both lookups were void
+        answers = await asyncio.gather(self.lookup(host, 'A'), self.lookup(host, 'AAAA'))
+        for (outcome, rdatas), record_type, prefix in zip(answers, ('A', 'AAAA'), (cidr4, cidr6)):
+            tree.note_ttl(self.remaining_ttl(host, record_type))
+            if outcome in LOOKUP_FAILURES:
+                tree.fail(f'temperror: {host} {record_type} lookup failed ({outcome})', cacheable=False)
+            elif rdatas is not None and passes:
+                for rdata in rdatas:
+                    tree.ips.add(ipaddress.ip_network(f'{rdata.address}/{prefix}', strict=False))
+        return all(outcome in VOID_OUTCOMES for outcome, _ in answers)
+
+# --- WHOIS cache and per-registry rate limiting ---
+# Parsed WHOIS results are kept in SQLite so repeat jobs skip the slowest step.
+# The job's adaptive WHOIS limiter backs off when registries refuse or drop
+# connections, each TLD gets at most WHOIS_CONCURRENCY_PER_TLD of a job's
+# queries at once, and an optional token bucket per TLD additionally caps the
+# query rate for registries that need a fixed ceiling.
+WHOIS_CACHE_PATH = os.environ.get('WHOIS_CACHE_PATH', os.path.join(RESULTS_ROOT, 'whois_cache.sqlite3'))
+WHOIS_CACHE_MAX_AGE = int(os.environ.get('WHOIS_CACHE_MAX_AGE', 7 * 24 * 3600))
+WHOIS_CACHE_WRITE_ATTEMPTS = 3
+# Queries per second and burst per TLD; 0 (the default) sets no fixed rate.
+# A rate caps throughput, not just politeness: uncached names in one TLD then
+# take about (count - burst) / rate seconds, so 1000 new .com names need
+# ~1000 s at 1 query/s.
+WHOIS_RATE_PER_TLD = float(os.environ.get('WHOIS_RATE_PER_TLD', 0))
+WHOIS_BURST_PER_TLD = int(os.environ.get('WHOIS_BURST_PER_TLD', 3))
+# WHOIS queries one job has outstanding against a single TLD's registry;
+# 0 removes the cap. Unlike a rate it only queues names while a registry is
+# slow, so a job of fast registries is not held back.
+WHOIS_CONCURRENCY_PER_TLD = int(os.environ.get('WHOIS_CONCURRENCY_PER_TLD', 2))
+WHOIS_DATE_FIELDS = ('creation_date', 'expiration_date', 'updated_date')
+
+class WhoisCache:
+    def __init__(self, path=WHOIS_CACHE_PATH, max_age=WHOIS_CACHE_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            # Shard processes of one job share the file; WAL lets their reads
+            # and writes overlap
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS whois (domain TEXT PRIMARY KEY, fetched_at REAL NOT NULL, record TEXT NOT NULL)')
+        return self._conn
+
+    def get(self, domain, max_age=None):
+        # A locked or busy database is a miss, never a failed lookup
+        max_age = self.max_age if max_age is None else max_age
+        try:
+            with self._lock:
+                row = self._connect().execute('SELECT fetched_at, record FROM whois WHERE domain = ?', (domain,)).fetchone()
+        except sqlite3.OperationalError as e:
+            logging.warning(f"WHOIS cache read for {domain} failed: {e}")
+            row = None
+        if row is None or time.time() - row[0] > max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        record = json.loads(row[1])
+        record['fetched_at'] = row[0]
+        for field in WHOIS_DATE_FIELDS:
+            if record.get(field):
+                record[field] = datetime.fromisoformat(record[field])
+        return record
+
+    def put(self, domain, record):
+        stored = dict(record)
+        for field in WHOIS_DATE_FIELDS:
+            if isinstance(stored.get(field), datetime):
+                stored[field] = stored[field].isoformat()
+        # The record is only lost from the cache if the write keeps failing
+        for attempt in range(WHOIS_CACHE_WRITE_ATTEMPTS):
+            try:
+                with self._lock:
+                    conn = self._connect()
+                    conn.execute('INSERT OR REPLACE INTO whois (domain, fetched_at, record) VALUES (?, ?, ?)',
+                                 (domain, time.time(), json.dumps(stored)))
+                    conn.commit()
+                return
+            except sqlite3.OperationalError as e:
+                with self._lock:
+                    if self._conn is not None and self._conn.in_transaction:
+                        self._conn.rollback()
+                if attempt == WHOIS_CACHE_WRITE_ATTEMPTS - 1:
+                    logging.warning(f"WHOIS cache write for {domain} failed: {e}")
+                else:
+                    time.sleep(0.1 * (attempt + 1))
+
+    def stats(self):
+        with self._lock:
+            entries = self._connect().execute('SELECT COUNT(*) FROM whois').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_age_seconds': self.max_age,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token and returns how long the caller must wait before using it;
+        # a negative balance queues callers fairly behind each other.
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+def whois_tld(domain):
+    return domain.rsplit('.', 1)[-1].lower()
+
+class TldSemaphores:
+    # One asyncio semaphore per TLD; created for, and only used on, one job's
+    # event loop
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphores = {}
+
+    def get(self, domain):
+        # None when TLDs are not capped
+        if self.limit <= 0:
+            return None
+        tld = whois_tld(domain)
+        semaphore = self._semaphores.get(tld)
+        if semaphore is None:
+            semaphore = self._semaphores[tld] = asyncio.Semaphore(self.limit)
+        return semaphore
+
+class WhoisRateLimiter:
+    def __init__(self, rate=WHOIS_RATE_PER_TLD, capacity=WHOIS_BURST_PER_TLD, concurrency=WHOIS_CONCURRENCY_PER_TLD):
+        self.rate = rate
+        self.capacity = capacity
+        self.concurrency = concurrency
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def tld_slots(self):
+        # A job's per-TLD concurrency cap
+        return TldSemaphores(self.concurrency)
+
+    def reserve(self, domain):
+        if self.rate <= 0:
+            return 0.0
+        tld = whois_tld(domain)
+        with self._lock:
+            bucket = self._buckets.get(tld)
+            if bucket is None:
+                bucket = self._buckets[tld] = TokenBucket(self.rate, self.capacity)
+        return bucket.reserve()
+
+whois_cache = WhoisCache()
+whois_limiter = WhoisRateLimiter()
+
+def first_value(value):
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+def lookup_whois(domain):
+    # python-whois is blocking; this runs on the WHOIS thread pool.
+    import whois
+    try:
+        # Socket errors are raised rather than parsed as an empty record so
+        # they count as WHOIS failures and slow the WHOIS limiter down
+        w = whois.whois(domain, ignore_socket_errors=False)
+        ns_list = w.name_servers if isinstance(w.name_servers, list) else [w.name_servers] if isinstance(w.name_servers, str) else []
+        record = {'name_servers': ns_list, 'registrar': first_value(w.registrar)}
+        for field in WHOIS_DATE_FIELDS:
+            date_obj = first_value(getattr(w, field, None))
+            record[field] = date_obj if isinstance(date_obj, datetime) else None
+        return record, None
+    except Exception as e:
+        return None, e
+
+async def fetch_whois(domain, whois_executor, concurrency, tld_slots):
+    # The SQLite cache is read and written on the WHOIS threads too, so its
+    # disk I/O never stalls DNS queries on the event loop
+    loop = asyncio.get_running_loop()
+    record = await loop.run_in_executor(whois_executor, whois_cache.get, domain)
+    if record is not None:
+        whois_lookups_total.inc('cached')
+        return record, None
+    # Wait for this TLD's slot and token on the event loop, not on a WHOIS thread
+    tld_slot = tld_slots.get(domain)
+    if tld_slot is not None:
+        await tld_slot.acquire()
+    try:
+        await asyncio.sleep(whois_limiter.reserve(domain))
+        await concurrency.acquire()
+        started = time.monotonic()
+        error = None
+        try:
+            record, error = await loop.run_in_executor(whois_executor, lookup_whois, domain)
+        finally:
+            concurrency.release(not isinstance(error, WHOIS_CONGESTION_ERRORS), time.monotonic() - started)
+            whois_query_seconds.observe(time.monotonic() - started)
+    finally:
+        if tld_slot is not None:
+            tld_slot.release()
+    whois_lookups_total.inc('ok' if error is None else 'error')
+    if error is None:
+        record['fetched_at'] = time.time()
+        await loop.run_in_executor(whois_executor, whois_cache.put, domain, record)
+    return record, error
+
+# --- Query planner ---
+# Normalizes the uploaded names, collapses duplicates and maps subdomains to
+# their registrable domain so every unique DNS query and every parent zone's
+# WHOIS runs once, then the results are fanned back out to each CSV row.
+# Two-label public suffixes we see in practice; everything else is treated as a
+# single-label TLD.
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'org.nz', 'co.jp', 'ne.jp', 'or.jp',
+    'co.in', 'net.in', 'org.in', 'com.br', 'net.br', 'com.cn', 'net.cn', 'org.cn',
+    'com.mx', 'co.za', 'com.sg', 'com.hk', 'com.tw', 'co.kr', 'com.ar', 'com.tr',
+    'com.my', 'com.ph', 'co.id', 'co.th', 'com.vn', 'com.co', 'com.pe', 'com.eg',
+}
+
+def normalize_domain(raw):
+    # Lower-case, strip whitespace and the trailing dot, and IDNA-encode;
+    # returns None for blank or unencodable names.
+    if not isinstance(raw, str):
+        return None
+    name = raw.strip().rstrip('.').lower()
+    if not name:
+        return None
+    try:
+        return name.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+
+def registrable_domain(name):
+    labels = name.split('.')
+    if len(labels) > 2 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+class QueryPlan:
+    def __init__(self, domains):
+        self.rows = []
+        self.rows_by_name = {}
+        self.whois_domain = {}
+        self.invalid_rows = []
+        for raw in domains:
+            if raw is None or (isinstance(raw, float) and raw != raw):
+                continue
+            display = str(raw).strip()
+            if not display:
+                continue
+            self.rows.append(display)
+            name = normalize_domain(display)
+            if name is None:
+                self.invalid_rows.append(display)
+                continue
+            self.rows_by_name.setdefault(name, []).append(display)
+            self.whois_domain[name] = registrable_domain(name)
+
+    @property
+    def names(self):
+        return list(self.rows_by_name)
+
+    @property
+    def whois_domains(self):
+        return list(dict.fromkeys(self.whois_domain.values()))
+
+    def summary(self):
+        return (f"{len(self.rows)} rows, {len(self.rows_by_name)} unique names, "
+                f"{len(self.whois_domains)} WHOIS domains, {len(self.invalid_rows)} invalid")
+
+# --- Streaming pipeline ---
+# Uploads at or above STREAMING_THRESHOLD_BYTES are read in chunks, looked up
+# through a bounded queue and written to a write-only workbook plus a JSONL side
+# file, so peak memory does not grow with the size of the domain list.
+STREAMING_THRESHOLD_BYTES = int(os.environ.get('STREAMING_THRESHOLD_BYTES', 2 * 1024 * 1024))
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', 5000))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 1000))
+
+def count_csv_rows(path):
+    with open(path, 'rb') as f:
+        return max(sum(1 for line in f if line.strip()) - 1, 0)
+
+# --- Domain results ---
+# Lookups produce one compact DomainResult per CSV row: raw answers, parsed
+# policy, classification and timings. Counting and all openpyxl styling happen
+# afterwards in a single pass, so nothing shared is mutated during lookups.
+RESULT_SHEET_HEADERS = {
+    "DMARC": ["Domain", "Primary_Domain_Policy", "Secondary_Domain_Policy", "DMARC_Record", "Lookup_Status"],
+    "SPF": ["Domain", "SPF_Record", "Lookup_Status", "DNS_Lookups", "Void_Lookups", "Lookup_Limit_Exceeded",
+            "SPF_Error", "Flattened_IP_Ranges"],
+    "MX": ["Domain", "MX_Record", "Lookup_Status"],
+    "WHOIS": ["Domain", "NameServers", "Registrar", "RegisteredOn", "ExpiresOn", "UpdatedOn"],
+}
+
+class DomainResult:
+    __slots__ = ('domain', 'name', 'dmarc_record', 'spf_record', 'mx_record',
+                 'dmarc_status', 'spf_status', 'mx_status', 'p_policy', 'sp_policy',
+                 'spf_lookups', 'spf_void_lookups', 'spf_error', 'spf_ips',
+                 'name_servers', 'registrar', 'creation_date', 'expiration_date', 'updated_date', 'whois_error',
+                 'dmarc_ownership', 'dmarc_policy', 'spf_class', 'mx_class', 'whois_class', 'timings',
+                 'dns_expires_at', 'whois_fetched_at')
+
+    def __init__(self, domain, name=None):
+        for slot in self.__slots__:
+            setattr(self, slot, None)
+        self.domain = domain
+        self.name = name
+        self.name_servers = []
+        self.timings = {}
+
+    def for_row(self, domain):
+        # Duplicate rows share one lookup but keep their own Domain value
+        copy = DomainResult.__new__(DomainResult)
+        for slot in self.__slots__:
+            setattr(copy, slot, getattr(self, slot))
+        copy.domain = domain
+        return copy
+
+    def to_dict(self):
+        data = {slot: getattr(self, slot) for slot in self.__slots__}
+        for field in WHOIS_DATE_FIELDS:
+            if isinstance(data[field], datetime):
+                data[field] = data[field].isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        result = cls.__new__(cls)
+        for slot in cls.__slots__:
+            setattr(result, slot, data.get(slot))
+        for field in WHOIS_DATE_FIELDS:
+            if getattr(result, field):
+                setattr(result, field, datetime.fromisoformat(getattr(result, field)))
+        return result
+
+def format_date(date_obj):
+    if isinstance(date_obj, list):
+        date_obj = date_obj[0]
+    if isinstance(date_obj, datetime):
+        return date_obj.strftime("%Y-%m-%d")
+    return ""
+
+def normalize_nameservers(ns_list):
+    return [re.sub(r'\s+', '', ns.strip().lower()) for ns in ns_list if ns.strip()]
+
+# --- Classification rules ---
+# Classifications come from a declarative rule table. Each attribute reads one
+# record column and gets its failed or missing category when the lookup had no
+# answer; otherwise the first rule with a matching pattern wins, falling back
+# to the default. Patterns are literal substrings unless prefixed with "re:".
+# A rule's optional third field, and the optional missing_fill and
+# default_fill, name the result sheet fill for rows in that category.
+# Each attribute's rules compile into a single regex, so a new vendor pattern
+# costs no extra pass over the results. CLASSIFICATION_RULES_PATH may point at
+# a JSON file with the same layout.
+DEFAULT_CLASSIFICATION_RULES = {
+    'dmarc_ownership': {
+        'source': 'dmarc_record', 'status': 'dmarc_status',
+        'failed': "DMARC Lookup Failed", 'missing': "No DMARC Record", 'default': None,
+        'rules': [
+            ["Non-Migrated JNJ DMARC", ["jnj@rua.dmp.cisco.com", "jnj@ruf.dmp.cisco.com"], "yellow"],
+            ["Migrated Kenvue DMARC", ["93881cb5@inbox.ondmarc.com"]],
+        ],
+    },
+    'dmarc_policy': {
+        'source': 'dmarc_record', 'status': 'dmarc_status',
+        'failed': "DMARC Lookup Failed", 'missing': "No DMARC Record", 'default': None,
+        'rules': [
+            ["Reject DMARC Policy", ["p=reject"]],
+            ["Quarantine DMARC Policy", ["p=quarantine"]],
+            ["No DMARC Policy", ["p=none"]],
+        ],
+    },
+    'spf_class': {
+        'source': 'spf_record', 'status': 'spf_status',
+        'failed': "SPF Lookup Failed", 'missing': "No SPF Record", 'default': "Third Party SPF",
+        'rules': [
+            ["Explicit Hard Fail", [r"re:^\s*v=spf1 -all\s*$"]],
+            ["JNJ Agari SPF", ["ce.spf-protect.dmp.cisco.com", "d.espf.dmp.cisco.com"]],
+        ],
+    },
+    'mx_class': {
+        'source': 'mx_record', 'status': 'mx_status',
+        'failed': "MX Lookup Failed", 'missing': "No MX Record", 'default': "Third Party MX",
+        'rules': [
+            ["Kenvue MX", ["kenvue-com.mail.protection.outlook.com"]],
+            ["JNJ MX", ["mx1.jnj-sd.iphmx.com", "mx2.jnj-sd.iphmx.com"]],
+        ],
+    },
+    # No status column: a WHOIS error leaves no name servers, which is "missing"
+    'whois_class': {
+        'source': 'name_servers', 'status': None,
+        'failed': None, 'missing': "No Name Servers Found", 'default': "Non-Kenvue Domain",
+        'missing_fill': "red", 'default_fill': "yellow",
+        'rules': [
+            ["Kenvue Owned Domains", ["kenvuedns"], "green"],
+        ],
+    },
+}
+# Fill names used by the result sheets and the classification rules
+SHEET_FILL_COLORS = {'red': 'FF4433', 'green': '4CBB17', 'blue': '87CEEB', 'orange': 'FBCEB1', 'yellow': 'FFFF00'}
+DMARC_POLICY_PATTERNS = {'p': re.compile(r'p=([^;]+)'), 'sp': re.compile(r'sp=([^;]+)')}
+# Results are classified in batches of this many rows as they are collected
+CLASSIFY_BATCH_ROWS = int(os.environ.get('CLASSIFY_BATCH_ROWS', 1000))
+
+def load_classification_rules(path=None):
+    path = path or os.environ.get('CLASSIFICATION_RULES_PATH')
+    if not path:
+        return DEFAULT_CLASSIFICATION_RULES
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def compile_rule_patterns(rules):
+    # One named group per rule inside a lookahead, so finditer reports every
+    # position any rule matches at, overlapping or not; at a shared position
+    # the earlier rule wins
+    groups = []
+    for i, (category, patterns, *_) in enumerate(rules):
+        alternatives = [p[3:] if p.startswith('re:') else re.escape(p) for p in patterns]
+        groups.append(f"(?P<r{i}>{'|'.join(alternatives)})")
+    return re.compile('(?=' + '|'.join(groups) + ')') if groups else None
+
+def record_column(results, column):
+    # (codes, distinct values) for one result column. Name server lists are
+    # matched as one normalized, newline-joined string.
+    import numpy as np
+    import pandas as pd
+    values = [getattr(result, column) or '' for result in results]
+    if column == 'name_servers':
+        codes, uniques = pd.factorize(np.array(["\n".join(value) for value in values], dtype=object))
+        uniques = np.array(["\n".join(normalize_nameservers(u.split("\n"))) for u in uniques], dtype=object)
+        return codes, uniques
+    return pd.factorize(np.array(values, dtype=object))
+
+class ClassificationRules:
+    def __init__(self, table):
+        self.table = table
+        self.matchers = {attr: compile_rule_patterns(spec['rules']) for attr, spec in table.items()}
+        self.columns = list(dict.fromkeys(
+            column for spec in table.values() for column in (spec['source'], spec['status']) if column))
+        self.fills = {attr: self.category_fills(spec) for attr, spec in table.items()}
+
+    @staticmethod
+    def category_fills(spec):
+        fills = {spec['missing']: spec.get('missing_fill'), spec['default']: spec.get('default_fill')}
+        for category, _, *fill in spec['rules']:
+            fills[category] = fill[0] if fill else None
+        for category, fill in fills.items():
+            if fill is not None and fill not in SHEET_FILL_COLORS:
+                raise ValueError(f'Unknown fill {fill!r} for {category!r}')
+        return {category: fill for category, fill in fills.items() if category is not None and fill is not None}
+
+    def fill(self, attr, category):
+        # Result sheet fill name for a category, or None when it has none
+        return self.fills.get(attr, {}).get(category)
+
+    def chart_categories(self):
+        # Dashboard order: missing, then each rule's category, then the default
+        return {attr: tuple(dict.fromkeys(
+                    c for c in (spec['missing'], *(rule[0] for rule in spec['rules']), spec['default'])
+                    if c is not None))
+                for attr, spec in self.table.items()}
+
+    @staticmethod
+    def first_rule(matcher, text):
+        best = None
+        for match in matcher.finditer(text):
+            i = int(match.lastgroup[1:])
+            if best is None or i < best:
+                best = i
+                if i == 0:
+                    break
+        return best
+
+    def classify(self, results):
+        # Column-wise over the batch: each column is factorized so patterns run
+        # once per distinct record, then categories are scattered back by code
+        if not results:
+            return results
+        import numpy as np
+        columns = {column: record_column(results, column) for column in self.columns}
+        codes, uniques = columns['dmarc_record']
+        assigned = {}
+        for policy_type, pattern in DMARC_POLICY_PATTERNS.items():
+            policies = np.empty(len(uniques), dtype=object)
+            for i, text in enumerate(uniques):
+                match = pattern.search(text)
+                policies[i] = match.group(1) if match else f'No {policy_type} policy found'
+            assigned[f'{policy_type}_policy'] = policies[codes]
+        for attr, spec in self.table.items():
+            codes, uniques = columns[spec['source']]
+            matcher = self.matchers[attr]
+            categories = [rule[0] for rule in spec['rules']]
+            matched = np.empty(len(uniques), dtype=object)
+            for i, text in enumerate(uniques):
+                rule = self.first_rule(matcher, text) if matcher is not None else None
+                matched[i] = spec['default'] if rule is None else categories[rule]
+            matched = matched[codes]
+            if spec['status']:
+                status_codes, statuses = columns[spec['status']]
+                failed = np.isin(statuses, list(LOOKUP_FAILURES))[status_codes]
+                missing = (statuses != OUTCOME_ANSWER)[status_codes]
+            else:
+                failed = np.zeros(len(results), dtype=bool)
+                missing = (uniques == '')[codes]
+            assigned[attr] = np.select([failed, missing], [spec['failed'], spec['missing']], matched)
+        for attr, values in assigned.items():
+            for result, value in zip(results, values.tolist()):
+                setattr(result, attr, value)
+        return results
+
+classification_rules = ClassificationRules(load_classification_rules())
+
+def spf_limit_text(result):
+    # Results stored before SPF trees were evaluated have no counts
+    if result.spf_lookups is None:
+        return None
+    return "Yes" if result.spf_lookups > SPF_LOOKUP_LIMIT or result.spf_void_lookups > SPF_VOID_LOOKUP_LIMIT else "No"
+
+def result_sheet_rows(result):
+    # (sheet, values, fill) for each sheet; fill names map to the workbook fills
+    dmarc_record = result.dmarc_record
+    p_policy, sp_policy = result.p_policy, result.sp_policy
+    dmarc_fill = None
+    if result.dmarc_status != OUTCOME_ANSWER:
+        dmarc_fill = 'red'
+    elif p_policy == 'quarantine' and sp_policy == 'quarantine':
+        dmarc_fill = 'green'
+    elif p_policy == 'reject' and sp_policy == 'reject':
+        dmarc_fill = 'blue'
+    elif p_policy == 'none' and sp_policy == 'none':
+        dmarc_fill = 'orange'
+    dmarc_fill = classification_rules.fill('dmarc_ownership', result.dmarc_ownership) or dmarc_fill
+    spf_fill = 'green'
+    if result.spf_status != OUTCOME_ANSWER:
+        spf_fill = 'red'
+    elif result.spf_error:
+        spf_fill = 'orange'
+    rows = [
+        ("DMARC", [result.domain, p_policy, sp_policy, dmarc_record, result.dmarc_status], dmarc_fill),
+        ("SPF", [result.domain, result.spf_record, result.spf_status, result.spf_lookups, result.spf_void_lookups,
+                 spf_limit_text(result), result.spf_error, ", ".join(result.spf_ips or [])], spf_fill),
+        ("MX", [result.domain, result.mx_record, result.mx_status], 'green' if result.mx_status == OUTCOME_ANSWER else 'red'),
+    ]
+    if result.whois_error is None:
+        fill = classification_rules.fill('whois_class', result.whois_class)
+        rows.append(("WHOIS", [result.domain, "\n".join(result.name_servers), result.registrar,
+                               format_date(result.creation_date), format_date(result.expiration_date),
+                               format_date(result.updated_date)], fill))
+    else:
+        rows.append(("WHOIS", [result.domain, f"Error: {result.whois_error}", "", "", "", ""], 'red'))
+    return rows
+
+# Chart categories per classification attribute, in dashboard order. Lookup
+# failure categories are added on demand.
+CHART_CATEGORIES = classification_rules.chart_categories()
+
+class ReportAggregate:
+    # Everything the reports need besides the rows themselves: chart counts,
+    # the failed-lookup count and sheet column widths. Shards build their own
+    # and the parent merges them.
+    def __init__(self):
+        self.charts = {attr: dict.fromkeys(categories, 0) for attr, categories in CHART_CATEGORIES.items()}
+        self.failed_lookups = 0
+        self.rows = 0
+        self.column_widths = {name: [len(h) for h in header] for name, header in RESULT_SHEET_HEADERS.items()}
+
+    def add(self, result):
+        self.rows += 1
+        for attr, counts in self.charts.items():
+            category = getattr(result, attr)
+            if category is not None:
+                counts[category] = counts.get(category, 0) + 1
+        if any(status in LOOKUP_FAILURES for status in (result.dmarc_status, result.spf_status, result.mx_status)):
+            self.failed_lookups += 1
+        for sheet_name, values, fill in result_sheet_rows(result):
+            widths = self.column_widths[sheet_name]
+            for i, value in enumerate(values):
+                if value:
+                    widths[i] = max(widths[i], len(str(value)))
+
+    def counts(self):
+        # A copy of the chart counts for the live feed
+        return {'charts': {attr: dict(counts) for attr, counts in self.charts.items()},
+                'failed_lookups': self.failed_lookups, 'rows': self.rows}
+
+    def merge(self, other):
+        # In place, so existing references to the chart dicts stay valid
+        self.rows += other.rows
+        self.failed_lookups += other.failed_lookups
+        for attr, counts in other.charts.items():
+            for category, count in counts.items():
+                self.charts[attr][category] = self.charts[attr].get(category, 0) + count
+        for sheet_name, widths in other.column_widths.items():
+            mine = self.column_widths[sheet_name]
+            for i, width in enumerate(widths):
+                mine[i] = max(mine[i], width)
+        return self
+
+LIVE_ROW_FIELDS = ('domain', 'p_policy', 'sp_policy', 'dmarc_status', 'spf_status', 'mx_status',
+                   'dmarc_ownership', 'dmarc_policy', 'spf_class', 'mx_class', 'whois_class')
+
+def live_row(result):
+    return {field: getattr(result, field) for field in LIVE_ROW_FIELDS}
+
+# --- Per-job logging ---
+# Every run_dns_lookup() call logs through its own logger, which only puts
+# records on a queue; a QueueListener thread writes them to that run's log
+# file, so lookups never wait on file I/O and concurrent jobs in one process
+# keep separate logs. Each domain gets one JSON record with the record type,
+# resolver ('cache' for cached answers), seconds and outcome of every lookup.
+JOB_LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOOKUP_RECORD_TYPES = {'DMARC': 'TXT', 'SPF': 'TXT', 'MX': 'MX', 'WHOIS': 'WHOIS'}
+# The current lookup's trace dict, set per lookup task by timed()
+lookup_trace = contextvars.ContextVar('lookup_trace', default=None)
+
+def trace_resolver(resolver):
+    # Only the lookup's first query is recorded, e.g. the SPF record itself
+    # rather than its includes
+    trace = lookup_trace.get()
+    if trace is not None:
+        trace.setdefault('resolver', resolver)
+
+class JobLog:
+    def __init__(self, name, path):
+        self.path = path
+        self.handler = logging.FileHandler(path, encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter(JOB_LOG_FORMAT))
+        records = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(records, self.handler)
+        # Not registered with logging.getLogger, so finished jobs leave nothing behind
+        self.logger = logging.Logger(f'dns_lookup.{name}', logging.INFO)
+        self.logger.addHandler(logging.handlers.QueueHandler(records))
+        self._open = False
+
+    def __enter__(self):
+        self.listener.start()
+        self._open = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Writes out everything queued; later records are dropped
+        if self._open:
+            self._open = False
+            self.logger.disabled = True
+            self.listener.stop()
+            self.handler.close()
+
+async def timed(timings, key, awaitable, traces=None):
+    started = time.monotonic()
+    if traces is not None:
+        # Runs inside the lookup's own task, so the trace is this lookup's alone
+        traces[key] = {}
+        lookup_trace.set(traces[key])
+    try:
+        return await awaitable
+    finally:
+        elapsed = time.monotonic() - started
+        timings[key] = round(elapsed, 4)
+        lookup_seconds.observe(elapsed, key)
+
+async def lookup_domain_result(name, engine, whois_future, deadline=None, log=None):
+    # deadline is an event-loop time; lookups still running then are cancelled
+    # and recorded as timed out, keeping whatever already finished.
+    result = DomainResult(name, name)
+    traces = {}
+    timed_out = {
+        'DMARC': (missing_record_text('TXT', OUTCOME_TIMEOUT), OUTCOME_TIMEOUT),
+        'SPF': (missing_record_text('SPF', OUTCOME_TIMEOUT), OUTCOME_TIMEOUT, None),
+        'MX': (missing_record_text('MX', OUTCOME_TIMEOUT), OUTCOME_TIMEOUT),
+        'WHOIS': (None, TimeoutError('job deadline reached')),
+    }
+    timeout = None if deadline is None else deadline - asyncio.get_running_loop().time()
+    outcomes = dict(timed_out)
+    if timeout is None or timeout > 0:
+        # DMARC, SPF, MX and the parent zone's WHOIS are awaited concurrently;
+        # the WHOIS future is shared with other names, so it is shielded
+        tasks = {
+            'DMARC': asyncio.ensure_future(timed(result.timings, 'DMARC', engine.get_dns_record(f"_dmarc.{name}", "TXT"), traces)),
+            'SPF': asyncio.ensure_future(timed(result.timings, 'SPF', engine.get_spf_record(name), traces)),
+            'MX': asyncio.ensure_future(timed(result.timings, 'MX', engine.get_dns_record(name, 'MX'), traces)),
+            'WHOIS': asyncio.ensure_future(timed(result.timings, 'WHOIS', asyncio.shield(whois_future))),
+        }
+        done, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        for key, task in tasks.items():
+            if task in done:
+                outcomes[key] = task.result()
+    (result.dmarc_record, result.dmarc_status), (result.spf_record, result.spf_status, spf_tree), \
+        (result.mx_record, result.mx_status), (w, whois_error) = (outcomes[k] for k in ('DMARC', 'SPF', 'MX', 'WHOIS'))
+    if spf_tree is not None:
+        result.spf_lookups = spf_tree.lookups
+        result.spf_void_lookups = spf_tree.void_lookups
+        result.spf_error = spf_tree.verdict()
+        result.spf_ips = spf_tree.flattened_ips()
+    if whois_error is None:
+        result.name_servers = list(w['name_servers'])
+        result.registrar = w['registrar']
+        for field in WHOIS_DATE_FIELDS:
+            setattr(result, field, w[field])
+        result.whois_fetched_at = w.get('fetched_at')
+    else:
+        result.whois_error = str(whois_error)
+    # Wall-clock time the first of this name's cached answers expires; failed
+    # lookups are not cached, so their results are never reused by a re-scan
+    ttls = [engine.remaining_ttl(n, t) for n, t in ((f"_dmarc.{name}", 'TXT'), (name, 'TXT'), (name, 'MX'))]
+    if None not in ttls:
+        result.dns_expires_at = time.time() + min(ttls)
+    if log is not None:
+        whois_outcome = OUTCOME_ANSWER if whois_error is None else \
+            OUTCOME_TIMEOUT if isinstance(whois_error, TimeoutError) else 'error'
+        outcomes = {'DMARC': result.dmarc_status, 'SPF': result.spf_status, 'MX': result.mx_status, 'WHOIS': whois_outcome}
+        log.info(json.dumps({'domain': name, 'lookups': [
+            {'lookup': key, 'record_type': record_type, 'resolver': traces.get(key, {}).get('resolver'),
+             'seconds': result.timings.get(key), 'outcome': outcomes[key]}
+            for key, record_type in LOOKUP_RECORD_TYPES.items()]}))
+    return result
+
+def invalid_domain_result(domain):
+    result = DomainResult(domain)
+    result.dmarc_record = 'No TXT record found'
+    result.spf_record = 'No SPF record found'
+    result.mx_record = 'No MX record found'
+    # A name that cannot be encoded cannot exist in the DNS
+    result.dmarc_status = result.spf_status = result.mx_status = OUTCOME_NXDOMAIN
+    result.whois_error = 'Invalid domain name'
+    return result
+
+# --- Incremental re-scan ---
+# A job can name a previous job as its baseline. Names whose baseline DNS
+# answers are still within TTL and whose WHOIS record is still fresh are
+# reused as-is; everything else is re-queried and compared with the baseline
+# for the Changes sheet and dashboard section. Baseline results are read from
+# disk by name through a SQLite index of the results file, built once per
+# baseline job, so a re-scan never holds the baseline in memory.
+CHANGES_SHEET_HEADERS = ["Domain", "Field", "Previous", "Current"]
+DASHBOARD_CHANGES_LIMIT = int(os.environ.get('DASHBOARD_CHANGES_LIMIT', 200))
+
+def stored_results_path(job_id):
+    # A finished job's JSONL results file, or None
+    manifest = load_manifest(job_id)
+    if manifest is None or 'results' not in manifest['artifacts']:
+        return None
+    return artifact_path(job_id, manifest, 'results')[0]
+
+def read_results_file(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield DomainResult.from_dict(json.loads(line))
+
+def build_results_index(job_id, output_dir, manifest, report, store):
+    # name -> byte offset of the name's first line in the results file
+    results_path, _ = artifact_path(job_id, manifest, 'results', store)
+    path = os.path.join(os.path.dirname(results_path), 'results_index.sqlite3')
+    if os.path.exists(path + '.tmp'):
+        os.remove(path + '.tmp')
+    conn = sqlite3.connect(path + '.tmp')
+    try:
+        conn.execute('CREATE TABLE results (name TEXT PRIMARY KEY, offset INTEGER NOT NULL)')
+        with open(results_path, 'rb') as f:
+            def rows():
+                offset = 0
+                for line in f:
+                    name = json.loads(line).get('name')
+                    if name is not None:
+                        yield name, offset
+                    offset += len(line)
+            conn.executemany('INSERT OR IGNORE INTO results (name, offset) VALUES (?, ?)', rows())
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(path + '.tmp', path)
+    return path
+
+class BaselineResults:
+    # A finished job's stored results, read by name through its results index
+    def __init__(self, results_path, index_path):
+        self._results = open(results_path, 'rb')
+        self._conn = sqlite3.connect(index_path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute('SELECT offset FROM results WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            self._results.seek(row[0])
+            line = self._results.readline()
+        return DomainResult.from_dict(json.loads(line))
+
+    def close(self):
+        self._conn.close()
+        self._results.close()
+
+def load_baseline_results(job_id):
+    # The baseline job's results by name, or None; the index is built on
+    # first use and recorded in the baseline's manifest, so shards reuse it
+    path = stored_results_path(job_id)
+    if path is None:
+        return None
+    index_path, _ = ensure_artifact(job_id, 'results_index')
+    if index_path is None:
+        return None
+    return BaselineResults(path, index_path)
+
+def reusable_result(result, now):
+    return (result.dns_expires_at is not None and now < result.dns_expires_at
+            and result.whois_fetched_at is not None and now - result.whois_fetched_at < WHOIS_CACHE_MAX_AGE)
+
+def normalize_record_set(value, separator):
+    # Sorted, de-duplicated, lowercased parts of a record (SPF terms, MX
+    # answers), so answers that only come back in another order compare equal
+    if value is None:
+        return value
+    return sorted({' '.join(part.lower().split()) for part in str(value).split(separator) if part.strip()})
+
+def result_changes(previous, current):
+    # (field, previous, current) for each tracked field that differs; fields
+    # whose lookup failed this time are skipped rather than reported as changed
+    changes = []
+    for field, attr, status, separator in (('SPF', 'spf_record', 'spf_status', ' '), ('MX', 'mx_record', 'mx_status', ','),
+                                           ('DMARC Policy', 'p_policy', 'dmarc_status', None),
+                                           ('DMARC Subdomain Policy', 'sp_policy', 'dmarc_status', None)):
+        if getattr(current, status) in LOOKUP_FAILURES or getattr(previous, status) in LOOKUP_FAILURES:
+            continue
+        before, after = getattr(previous, attr), getattr(current, attr)
+        if separator is not None:
+            before, after = normalize_record_set(before, separator), normalize_record_set(after, separator)
+        if before != after:
+            changes.append((field, getattr(previous, attr), getattr(current, attr)))
+    if current.whois_error is None and previous.whois_error is None:
+        before, after = sorted(set(normalize_nameservers(previous.name_servers))), sorted(set(normalize_nameservers(current.name_servers)))
+        if before != after:
+            changes.append(('NameServers', ', '.join(before), ', '.join(after)))
+    return changes
+
+# --- Columnar result store ---
+# Every job also keeps its typed per-domain results in Parquet so tools can
+# query them without parsing the workbook. Rows are written in fixed-size row
+# groups and the footer records which classifications occur in each group, so
+# a filtered read only touches the columns and row groups it needs.
+RESULT_STORE_ROW_GROUP = int(os.environ.get('RESULT_STORE_ROW_GROUP', 10000))
+CLASSIFICATION_COLUMNS = ('dmarc_ownership', 'dmarc_policy', 'spf_class', 'mx_class', 'whois_class')
+@functools.lru_cache(maxsize=None)
+def result_store_schema():
+    import pyarrow as pa
+    types = {
+        'name_servers': pa.list_(pa.string()),
+        'creation_date': pa.timestamp('us'),
+        'expiration_date': pa.timestamp('us'),
+        'updated_date': pa.timestamp('us'),
+        'timings': pa.map_(pa.string(), pa.float64()),
+        'spf_lookups': pa.int32(),
+        'spf_void_lookups': pa.int32(),
+        'spf_ips': pa.list_(pa.string()),
+        'dns_expires_at': pa.float64(),
+        'whois_fetched_at': pa.float64(),
+    }
+    return pa.schema([(slot, types.get(slot, pa.string())) for slot in DomainResult.__slots__])
+
+def store_value(field, value):
+    if value is None:
+        return None
+    if field in ('name_servers', 'spf_ips'):
+        return [str(item) for item in value]
+    if field in ('spf_lookups', 'spf_void_lookups'):
+        return int(value)
+    if field == 'timings':
+        return list(value.items())
+    if field in WHOIS_DATE_FIELDS:
+        value = first_value(value)
+        return value.replace(tzinfo=None) if isinstance(value, datetime) else None
+    if field in ('dns_expires_at', 'whois_fetched_at'):
+        return float(value)
+    return str(value)
+
+def json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, list) and value and isinstance(value[0], tuple):
+        return dict(value)
+    return value
+
+class ColumnarResultWriter:
+    def __init__(self, path, row_group_size=RESULT_STORE_ROW_GROUP):
+        self.path = path
+        self.row_group_size = row_group_size
+        import pyarrow.parquet as pq
+        self.schema = result_store_schema()
+        self._writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+        self._columns = {field: [] for field in self.schema.names}
+        self._rows = 0
+        self._row_group_classes = []
+
+    def append(self, result):
+        for field, column in self._columns.items():
+            column.append(store_value(field, getattr(result, field)))
+        self._rows += 1
+        if self._rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        classes = {value for field in CLASSIFICATION_COLUMNS for value in self._columns[field] if value is not None}
+        self._row_group_classes.append(sorted(classes))
+        import pyarrow as pa
+        self._writer.write_table(pa.table(self._columns, schema=self.schema), row_group_size=self._rows)
+        self._columns = {field: [] for field in self._columns}
+        self._rows = 0
+
+    def close(self):
+        self._flush()
+        self._writer.add_key_value_metadata({'row_group_classes': json.dumps(self._row_group_classes)})
+        self._writer.close()
+
+def query_result_store(path, classifications=(), fields=None, cursor=0, limit=100):
+    # Rows matching any of the classifications (all rows if none), starting
+    # at row index cursor; returns (rows, next_cursor or None)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(path)
+    footer = parquet.metadata.metadata or {}
+    row_group_classes = json.loads(footer.get(b'row_group_classes', b'[]'))
+    # Stores written before a field was added simply lack its column
+    fields = [field for field in fields or DomainResult.__slots__ if field in parquet.schema_arrow.names]
+    wanted = set(classifications)
+    columns = list(dict.fromkeys(fields + (list(CLASSIFICATION_COLUMNS) if wanted else [])))
+    rows = []
+    start = 0
+    for i in range(parquet.num_row_groups):
+        end = start + parquet.metadata.row_group(i).num_rows
+        skip = end <= cursor or (wanted and i < len(row_group_classes) and not wanted.intersection(row_group_classes[i]))
+        if not skip:
+            offset = max(cursor - start, 0)
+            table = parquet.read_row_group(i, columns=columns).slice(offset)
+            positions = range(start + offset, end)
+            if wanted:
+                value_set = pa.array(sorted(wanted), type=pa.string())
+                mask = pc.is_in(table[CLASSIFICATION_COLUMNS[0]], value_set=value_set)
+                for field in CLASSIFICATION_COLUMNS[1:]:
+                    mask = pc.or_(mask, pc.is_in(table[field], value_set=value_set))
+                mask = pc.fill_null(mask, False)
+                positions = [p for p, keep in zip(positions, mask.to_pylist()) if keep]
+                table = table.filter(mask)
+            for position, row in zip(positions, table.select(fields).to_pylist()):
+                rows.append({field: json_value(value) for field, value in row.items()})
+                if len(rows) >= limit:
+                    total = parquet.metadata.num_rows
+                    return rows, (position + 1 if position + 1 < total else None)
+        start = end
+    return rows, None
+
+# --- Charts ---
+# Charts are drawn through the Figure API instead of pyplot, so the five
+# summaries render concurrently without sharing global state. Each one is
+# rendered once to PNG bytes, which the workbook, the dashboard image route
+# and the PDF all reuse.
+CHART_BORDER_PX = 6
+CHART_POSITIONS = {
+    'spf_chart.png': "A1",
+    'mx_chart.png': "J1",
+    'dmarc_ownership.png': "A25",
+    'dmarc_policy.png': "J25",
+    'whois_chart.png': "A49",
+}
+
+def render_pie_chart(data, title):
+    from matplotlib.figure import Figure
+    sizes = list(data.values())
+    fig = Figure(figsize=(8, 6))
+    ax = fig.add_subplot()
+    ax.pie(sizes, labels=[f"{l} ({v} / {sum(sizes)} - {v/sum(sizes)*100:.1f}%)" for l, v in data.items()], autopct='', startangle=140)
+    ax.set_title(title, fontsize=14, pad=20)
+    # The border is the figure's own edge; half of the line falls outside
+    # the canvas, so it is drawn twice as wide as the visible border.
+    fig.patch.set_edgecolor('black')
+    fig.patch.set_linewidth(2 * CHART_BORDER_PX * 72 / fig.dpi)
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+@functools.lru_cache(maxsize=None)
+def chart_pdf_class():
+    from fpdf import FPDF
+    from PIL import Image
+
+    class ChartPDF(FPDF):
+        # FPDF 1.7 can only read images from disk; names found in charts are
+        # decoded from the in-memory PNG bytes instead.
+        def __init__(self, charts, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.charts = charts
+
+        def _parsepng(self, name):
+            if name not in self.charts:
+                return super()._parsepng(name)
+            img = Image.open(io.BytesIO(self.charts[name])).convert('RGB')
+            w, h = img.size
+            raw = img.tobytes()
+            stride = 3 * w
+            # Every scanline starts with PNG filter type 0, as /Predictor 15 expects
+            data = zlib.compress(b''.join(b'\x00' + raw[i:i + stride] for i in range(0, len(raw), stride)))
+            return {'w': w, 'h': h, 'cs': 'DeviceRGB', 'bpc': 8, 'f': 'FlateDecode',
+                    'dp': f'/Predictor 15 /Colors 3 /BitsPerComponent 8 /Columns {w}',
+                    'pal': '', 'trns': '', 'data': data}
+    return ChartPDF
+
+# --- Sharded execution ---
+# Large jobs can split their lookups across worker processes. Rows are sharded
+# by registrable domain so a zone's names and its WHOIS stay in one process;
+# each shard runs the normal streaming lookup path on its own event loop and
+# hands back its side file plus a ReportAggregate, and the parent merges them
+# and builds the reports once. While they run, shards send an update per
+# classified batch: progress, live rows, running counts, limiter snapshots and
+# metric deltas. Every TLD appears in every shard, so each shard gets an equal
+# share of the per-TLD WHOIS rate and concurrency and of the WHOIS
+# concurrency ceiling.
+shard_progress = None
+shard_live = False
+current_shard = None
+
+def init_shard_worker(progress, live, whois_rate, whois_burst, whois_concurrency, shards):
+    global shard_progress, shard_live, whois_limiter
+    shard_progress = progress
+    shard_live = live
+    whois_limiter = WhoisRateLimiter(whois_rate / shards, max(1, whois_burst // shards),
+                                     whois_concurrency and max(1, whois_concurrency // shards))
+
+def run_lookup_shard(shard, input_csv_path, output_dir, options):
+    global current_shard
+    current_shard = shard
+    return run_dns_lookup(input_csv_path, output_dir, streaming=True, lookup_only=True, **options)
+
+class ShardedLimiter:
+    # The parent's view of one adaptive limiter across all shards, built from
+    # the snapshots the shards send; /status and /metrics read it like an
+    # AdaptiveLimiter
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def update(self, shard, snapshot):
+        with self._lock:
+            self._snapshots[shard] = snapshot
+
+    def snapshot(self):
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+        return {key: sum(snapshot[key] for snapshot in snapshots)
+                for key in ('limit', 'in_flight', 'min', 'max', 'successes', 'failures')}
+
+def sum_live_counts(counts):
+    # Running chart counts of several shards, in the ReportAggregate.counts() layout
+    total = {'charts': {}, 'failed_lookups': 0, 'rows': 0}
+    for shard_counts in counts:
+        total['failed_lookups'] += shard_counts['failed_lookups']
+        total['rows'] += shard_counts['rows']
+        for attr, categories in shard_counts['charts'].items():
+            merged = total['charts'].setdefault(attr, {})
+            for category, count in categories.items():
+                merged[category] = merged.get(category, 0) + count
+    return total
+
+def split_csv_shards(input_csv_path, shard_dir, shards):
+    # Returns ([shard csv paths that received rows], total rows)
+    import pandas as pd
+    os.makedirs(shard_dir, exist_ok=True)
+    paths = [os.path.join(shard_dir, f'shard_{i}.csv') for i in range(shards)]
+    counts = [0] * shards
+    files = [open(path, 'w', encoding='utf-8', newline='') for path in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        for writer in writers:
+            writer.writerow(['Domain'])
+        for chunk in pd.read_csv(input_csv_path, chunksize=STREAM_CHUNK_ROWS):
+            for raw in chunk["Domain"]:
+                name = normalize_domain(raw)
+                key = registrable_domain(name) if name else str(raw)
+                i = zlib.crc32(key.encode('utf-8')) % shards
+                writers[i].writerow([raw if isinstance(raw, str) else ''])
+                counts[i] += 1
+    finally:
+        for f in files:
+            f.close()
+    return [path for path, count in zip(paths, counts) if count], sum(counts)
 
 # --- DNS Lookup Logic as Function ---
-def run_dns_lookup(input_csv_path, output_dir):
-    # Setup output folders
-    images_dir = os.path.join(output_dir, "Images")
-    dashboard_dir = os.path.join(output_dir, "Dashboard")
+def run_dns_lookup(input_csv_path, output_dir, **options):
+    # Setup output folders; the reports themselves are built on demand later
     logs_dir = os.path.join(output_dir, "Logs")
-    for d in [images_dir, dashboard_dir, logs_dir]:
-        os.makedirs(d, exist_ok=True)
+    os.makedirs(logs_dir, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M")
-    human_timestamp = datetime.now().strftime("%B %d, %Y at %I:%M %p IST")
     log_file = os.path.join(logs_dir, f"DNS_Script_Logs_{timestamp}.txt")
-    html_file = os.path.join(dashboard_dir, f"DNS_Lookup_Summary_Dashboard_{timestamp}.html")
-    final_output_file = os.path.join(output_dir, f"DNS_Lookup_Results_{timestamp}.xlsx")
-    pdf_file = os.path.join(dashboard_dir, f"DNS_Lookup_Report_{timestamp}.pdf")
-    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    # Load domains
-    df = pd.read_csv(input_csv_path)
-    # Workbook setup
-    wb = Workbook()
-    ws_dmarc = wb.active; ws_dmarc.title = "DMARC"
-    ws_spf = wb.create_sheet("SPF")
-    ws_mx = wb.create_sheet("MX")
-    ws_whois = wb.create_sheet("WHOIS")
+    with JobLog(os.path.basename(os.path.normpath(output_dir)), log_file) as job_log:
+        try:
+            return lookup_and_persist(input_csv_path, output_dir, timestamp, job_log, **options)
+        except Exception:
+            job_log.logger.exception("Lookup failed")
+            raise
+
+def lookup_and_persist(input_csv_path, output_dir, timestamp, job_log, job=None, streaming=None, dns_limits=None, whois_limits=None,
+                       deadline=None, baseline=None, shards=None, lookup_only=False, reclassify=None, columnar=True):
+    # columnar=False skips the Parquet store (and pyarrow) for callers that
+    # never read it, such as a scan without the parquet format
+    import pandas as pd
+    log = job_log.logger
+    logs_dir = os.path.dirname(job_log.path)
+    log_file = job_log.path
+    human_timestamp = datetime.now().strftime("%B %d, %Y at %I:%M %p IST")
+    results_file = os.path.join(output_dir, f"DNS_Lookup_Results_{timestamp}.jsonl")
+    columnar_file = os.path.join(output_dir, f"DNS_Lookup_Results_{timestamp}.parquet")
+    report_file = os.path.join(output_dir, f"DNS_Lookup_Report_{timestamp}.json")
+    changes_file = os.path.join(output_dir, f"DNS_Lookup_Changes_{timestamp}.jsonl")
+    # Large uploads go through the streaming pipeline so memory stays flat;
+    # reclassifying a stored job streams its results file the same way
+    if reclassify is not None:
+        streaming = True
+    elif streaming is None:
+        streaming = os.path.getsize(input_csv_path) >= STREAMING_THRESHOLD_BYTES
+    # Several lookup processes when requested; shards themselves never re-shard
+    shards = JOB_SHARDS if shards is None else shards
+    sharded = shards > 1 and not lookup_only and reclassify is None
+    # Re-scans diff against the baseline job's stored results
+    baseline_results = None
+    if baseline is not None:
+        baseline_results = load_baseline_results(baseline)
+        if baseline_results is None:
+            raise ValueError(f"Baseline job {baseline} has no stored results")
+    reused_count = 0
+    # Chart counts and column widths are tracked as results arrive, so the
+    # reports never need to re-walk the results for them
+    aggregate = ReportAggregate()
+    unclassified = []
+    last_flush = time.monotonic()
+    # The limiters of the current lookup pass, for shard updates
+    active_limiters = {}
+    # Inside a shard worker, updates go to the parent instead of a job
+    in_shard = job is None and shard_progress is not None
+    def collect(result, sink):
+        # Results are classified a batch at a time, then counted and handed to sink
+        unclassified.append(result)
+        # Jobs and shards also flush on a timer so live results stay current
+        if len(unclassified) >= CLASSIFY_BATCH_ROWS or \
+                ((job is not None or in_shard) and time.monotonic() - last_flush >= LIVE_FLUSH_SECONDS):
+            flush_collected(sink)
+        if job is not None:
+            job.advance()
+    def flush_collected(sink):
+        nonlocal last_flush
+        classification_rules.classify(unclassified)
+        for result in unclassified:
+            aggregate.add(result)
+            sink(result)
+        if job is not None and unclassified:
+            job.live.publish([live_row(result) for result in unclassified], aggregate.counts())
+        elif in_shard and unclassified:
+            send_shard_update(len(unclassified), [live_row(result) for result in unclassified] if shard_live else [])
+        unclassified.clear()
+        last_flush = time.monotonic()
+    def send_shard_update(completed, rows):
+        shard_progress.put({'shard': current_shard, 'completed': completed, 'rows': rows, 'counts': aggregate.counts(),
+                            'limiters': {name: limiter.snapshot() for name, limiter in active_limiters.items()},
+                            'metrics': drain_metrics()})
+    def side_file_sink(side_file):
+        return lambda result: side_file.write(json.dumps(result.to_dict(), default=str) + '\n')
+    def baseline_result(name, now):
+        # The baseline's result for name if it can be reused without re-querying
+        nonlocal reused_count
+        if baseline_results is None:
+            return None
+        previous = baseline_results.get(name)
+        if previous is None or not reusable_result(previous, now):
+            return None
+        reused_count += 1
+        return previous
+    # Per-job (min, max) overrides for the adaptive DNS and WHOIS limiters
+    dns_min, dns_max = dns_limits or (DNS_MIN_IN_FLIGHT, DNS_MAX_IN_FLIGHT)
+    whois_min, whois_max = whois_limits or (WHOIS_MIN_WORKERS, WHOIS_WORKERS)
+    # Wall-clock budget for the lookups; whatever is unfinished when it expires
+    # is reported as timed out and the reports are built from the rest
+    if deadline is None:
+        deadline = JOB_DEADLINE_SECONDS or None
+    def deadline_at():
+        return None if deadline is None else asyncio.get_running_loop().time() + deadline
+    def new_limiters():
+        dns_concurrency = AdaptiveLimiter('dns', dns_min, dns_max, DNS_LATENCY_TARGET)
+        whois_concurrency = AdaptiveLimiter('whois', whois_min, whois_max, WHOIS_LATENCY_TARGET)
+        active_limiters.update(dns=dns_concurrency, whois=whois_concurrency)
+        if job is not None:
+            job.limiters = {'dns': dns_concurrency, 'whois': whois_concurrency}
+        return dns_concurrency, whois_concurrency
+    async def process_all(plan):
+        dns_concurrency, whois_concurrency = new_limiters()
+        engine = DNSLookupEngine(limiter=dns_concurrency)
+        expires = deadline_at()
+        results = []
+        now = time.time()
+        reused = {}
+        for name in plan.names:
+            previous = baseline_result(name, now)
+            if previous is not None:
+                reused[name] = previous
+        for name, previous in reused.items():
+            for domain in plan.rows_by_name[name]:
+                collect(previous.for_row(domain), results.append)
+        query_names = [name for name in plan.names if name not in reused]
+        async def process_name(name, whois_tasks):
+            result = await lookup_domain_result(name, engine, whois_tasks[plan.whois_domain[name]], expires, log)
+            for domain in plan.rows_by_name[name]:
+                collect(result.for_row(domain), results.append)
+        tld_slots = whois_limiter.tld_slots()
+        whois_executor = ThreadPoolExecutor(max_workers=whois_concurrency.max_limit, thread_name_prefix='whois')
+        try:
+            whois_tasks = {d: asyncio.ensure_future(fetch_whois(d, whois_executor, whois_concurrency, tld_slots))
+                           for d in dict.fromkeys(plan.whois_domain[name] for name in query_names)}
+            await asyncio.gather(*(process_name(name, whois_tasks) for name in query_names))
+            for task in whois_tasks.values():
+                task.cancel()
+        finally:
+            # Don't wait on WHOIS calls that outlived the deadline
+            whois_executor.shutdown(wait=False, cancel_futures=True)
+        for domain in plan.invalid_rows:
+            collect(invalid_domain_result(domain), results.append)
+        flush_collected(results.append)
+        return results
+    async def stream_all(side_file):
+        # CSV chunks feed a bounded queue drained by a fixed set of workers; each
+        # result goes straight to the row-oriented side file. Duplicates across
+        # chunks are absorbed by the DNS and WHOIS caches.
+        dns_concurrency, whois_concurrency = new_limiters()
+        engine = DNSLookupEngine(limiter=dns_concurrency)
+        expires = deadline_at()
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        inflight_whois = {}
+        tld_slots = whois_limiter.tld_slots()
+        rows_seen = 0
+        def whois_future(domain, whois_executor):
+            task = inflight_whois.get(domain)
+            if task is None:
+                task = inflight_whois[domain] = asyncio.ensure_future(
+                    fetch_whois(domain, whois_executor, whois_concurrency, tld_slots))
+                task.add_done_callback(lambda _: inflight_whois.pop(domain, None))
+            return task
+        sink = side_file_sink(side_file)
+        def emit(result):
+            collect(result, sink)
+        async def worker(whois_executor):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                name, domains, whois_domain = item
+                if name is None:
+                    emit(invalid_domain_result(domains[0]))
+                    continue
+                result = await lookup_domain_result(name, engine, whois_future(whois_domain, whois_executor), expires, log)
+                for domain in domains:
+                    emit(result.for_row(domain))
+        whois_executor = ThreadPoolExecutor(max_workers=whois_concurrency.max_limit, thread_name_prefix='whois')
+        try:
+            # Enough workers to saturate the DNS limiter at its maximum (3 queries per name)
+            workers = [asyncio.ensure_future(worker(whois_executor)) for _ in range(max(1, dns_concurrency.max_limit // 3))]
+            for chunk in pd.read_csv(input_csv_path, chunksize=STREAM_CHUNK_ROWS):
+                plan = QueryPlan(chunk["Domain"])
+                rows_seen += len(plan.rows)
+                now = time.time()
+                for name, domains in plan.rows_by_name.items():
+                    previous = baseline_result(name, now)
+                    if previous is not None:
+                        for domain in domains:
+                            emit(previous.for_row(domain))
+                        continue
+                    await queue.put((name, domains, plan.whois_domain[name]))
+                for domain in plan.invalid_rows:
+                    await queue.put((None, [domain], None))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            for task in list(inflight_whois.values()):
+                task.cancel()
+        finally:
+            whois_executor.shutdown(wait=False, cancel_futures=True)
+        flush_collected(sink)
+        return rows_seen
+    def run_sharded(shard_dir):
+        # Returns (total rows, shard side files, whether any shard hit the deadline)
+        nonlocal reused_count
+        shard_inputs, rows = split_csv_shards(input_csv_path, shard_dir, shards)
+        if job is not None:
+            job.set_total(rows)
+        count = max(1, len(shard_inputs))
+        # The WHOIS concurrency ceiling is split like the rate (see init_shard_worker)
+        options = {'dns_limits': dns_limits, 'whois_limits': (max(1, whois_min // count), max(1, whois_max // count)),
+                   'deadline': deadline, 'baseline': baseline}
+        # spawn, not fork: the parent holds threads, event loops and a SQLite handle
+        context = multiprocessing.get_context('spawn')
+        progress = context.Queue()
+        limiters = {'dns': ShardedLimiter(), 'whois': ShardedLimiter()}
+        if job is not None:
+            job.limiters = limiters
+        shard_counts = {}
+        def drain_progress():
+            while True:
+                update = progress.get()
+                if update is None:
+                    return
+                merge_metrics(update['metrics'])
+                for name, snapshot in update['limiters'].items():
+                    limiters[name].update(update['shard'], snapshot)
+                shard_counts[update['shard']] = update['counts']
+                if job is not None:
+                    job.advance(update['completed'])
+                    if update['completed']:
+                        job.live.publish(update['rows'], sum_live_counts(shard_counts.values()))
+        drainer = threading.Thread(target=drain_progress, name='shard-progress', daemon=True)
+        drainer.start()
+        side_files = []
+        expired = False
+        try:
+            with ProcessPoolExecutor(max_workers=count, mp_context=context, initializer=init_shard_worker,
+                                     initargs=(progress, job is not None, whois_limiter.rate, whois_limiter.capacity,
+                                               whois_limiter.concurrency, count)) as pool:
+                futures = [pool.submit(run_lookup_shard, i, path, os.path.join(shard_dir, f'shard_{i}'), options)
+                           for i, path in enumerate(shard_inputs)]
+                for i, future in enumerate(futures):
+                    shard = future.result()
+                    # The shard directories are removed afterwards; their logs are kept beside this job's
+                    os.replace(shard['log_file'], os.path.join(logs_dir, f"DNS_Script_Logs_{timestamp}_shard_{i}.txt"))
+                    aggregate.merge(shard['aggregate'])
+                    reused_count += shard['reused']
+                    expired = expired or shard['deadline_expired']
+                    side_files.append(shard['results_file'])
+        finally:
+            # Workers have exited, so all of their progress messages are queued
+            progress.put(None)
+            drainer.join()
+        return rows, side_files, expired
+    # Seconds spent per step (lookup, excel, charts, html, pdf), for the
+    # manifest and the benchmark harness
+    stage_seconds = {}
+    stage_mark = time.perf_counter()
+    def stage_done(name):
+        nonlocal stage_mark
+        now = time.perf_counter()
+        stage_seconds[name] = round(stage_seconds.get(name, 0.0) + now - stage_mark, 4)
+        stage_mark = now
+    lookups_started = time.monotonic()
+    shard_expired = False
+    if sharded:
+        shard_dir = os.path.join(output_dir, 'Shards')
+        total_domains, side_files, shard_expired = run_sharded(shard_dir)
+        log.info(f"Lookups ran in {len(side_files)} shard processes")
+        results = (result for path in side_files for result in read_results_file(path))
+    elif reclassify is not None:
+        source_file = stored_results_path(reclassify)
+        if source_file is None:
+            raise ValueError(f"Job {reclassify} has no stored results")
+        with open(source_file, 'rb') as f:
+            total_domains = sum(1 for _ in f)
+        if job is not None:
+            job.set_total(total_domains)
+        with open(results_file, 'w', encoding='utf-8') as side_file:
+            sink = side_file_sink(side_file)
+            for result in read_results_file(source_file):
+                collect(result, sink)
+            flush_collected(sink)
+        log.info(f"Reclassified {total_domains} stored results from job {reclassify}")
+        results = read_results_file(results_file)
+    elif streaming:
+        if job is not None:
+            job.set_total(count_csv_rows(input_csv_path))
+        with open(results_file, 'w', encoding='utf-8') as side_file:
+            total_domains = asyncio.run(stream_all(side_file))
+        results = read_results_file(results_file)
+    else:
+        df = pd.read_csv(input_csv_path)
+        plan = QueryPlan(df["Domain"])
+        log.info(f"Query plan: {plan.summary()}")
+        total_domains = len(plan.rows)
+        if job is not None:
+            job.set_total(total_domains)
+        results = asyncio.run(process_all(plan))
+    deadline_expired = shard_expired or (deadline is not None and time.monotonic() - lookups_started >= deadline)
+    if deadline_expired:
+        log.warning(f"Job deadline of {deadline}s reached; unfinished lookups were marked as timed out")
+    if job is not None:
+        job.deadline_expired = deadline_expired
+    if lookup_only:
+        if baseline_results is not None:
+            baseline_results.close()
+        if in_shard:
+            # Final limiter state and whatever was measured after the last batch
+            send_shard_update(0, [])
+        return {'aggregate': aggregate, 'results_file': results_file, 'log_file': log_file,
+                'total_domains': total_domains, 'reused': reused_count, 'deadline_expired': deadline_expired}
+    stage_done('lookup')
+    log.info(f"DNS cache stats: {dns_cache.stats()}")
+    if baseline_results is not None:
+        log.info(f"Reused {reused_count} of {total_domains} domains from baseline job {baseline}")
+    # Single pass over the collected results that only persists them: the
+    # row store for re-scans, the columnar store and the baseline changes
+    changes = 0
+    changed_domains = set()
+    changes_out = open(changes_file, 'w', encoding='utf-8') if baseline_results is not None else None
+    # The in-memory and sharded paths store their results here for later
+    # re-scans; the streaming path has already written them
+    stored_results = None if streaming and not sharded else open(results_file, 'w', encoding='utf-8')
+    result_store = ColumnarResultWriter(columnar_file) if columnar else None
+    # This job's own lookup-time distribution, for its timing breakdown
+    job_lookup_seconds = Histogram('job_lookup_duration_seconds', 'Per-domain lookup time in this job', ('lookup',))
+    for result in results:
+        previous = baseline_results.get(result.name) if changes_out is not None else None
+        if previous is not None:
+            for field, before, after in result_changes(previous, result):
+                changes_out.write(json.dumps([result.domain, field, before, after], default=str) + '\n')
+                changes += 1
+                changed_domains.add(result.domain)
+        if stored_results is not None:
+            stored_results.write(json.dumps(result.to_dict(), default=str) + '\n')
+        if result_store is not None:
+            result_store.append(result)
+        for key, seconds in (result.timings or {}).items():
+            job_lookup_seconds.observe(seconds, key)
+    if stored_results is not None:
+        stored_results.close()
+    if changes_out is not None:
+        changes_out.close()
+        baseline_results.close()
+    if result_store is not None:
+        result_store.close()
+    if sharded:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    # Everything the on-demand report builders need besides the results
+    report = {
+        'timestamp': timestamp,
+        'human_timestamp': human_timestamp,
+        'total_domains': total_domains,
+        'charts': aggregate.charts,
+        'failed_lookups': aggregate.failed_lookups,
+        'column_widths': aggregate.column_widths,
+        'deadline_expired': deadline_expired,
+        'baseline': baseline,
+        'reused': reused_count,
+        'changes': changes,
+        'changed_domains': len(changed_domains),
+    }
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    stage_done('persist')
+    log.info(f"Stage timings: {stage_seconds}")
+    for stage, seconds in stage_seconds.items():
+        report_stage_seconds.observe(seconds, stage)
+    timings_file = os.path.join(logs_dir, f"DNS_Timings_{timestamp}.json")
+    with open(timings_file, 'w', encoding='utf-8') as f:
+        json.dump({'stages': stage_seconds, 'lookups': job_lookup_seconds.snapshot(), 'dns_cache': dns_cache.stats()}, f, indent=2)
+    # Excel, charts, the dashboard and the PDF are added to the manifest as
+    # they are first requested (see ensure_artifact)
+    outputs = {'log': log_file, 'timings': timings_file, 'results': results_file, 'report': report_file}
+    if result_store is not None:
+        outputs['columnar'] = columnar_file
+    if changes_out is not None:
+        outputs['changes'] = changes_file
+    # Flushed first, so the manifest records the finished log
+    job_log.close()
+    write_manifest(output_dir, outputs, stage_seconds)
+    return list(outputs.values())
+
+# --- On-demand report artifacts ---
+# A finished job only has its stored results and the report state written by
+# run_dns_lookup. The workbook, each chart, the dashboard and the PDF are built
+# the first time something asks for them, then cached on disk and recorded in
+# the manifest. Concurrent requests for the same artifact share one build.
+CHART_SOURCES = {
+    'spf_chart.png': ('spf_class', "SPF Summary", "SPF SUMMARY"),
+    'mx_chart.png': ('mx_class', "MX Summary", "MX SUMMARY"),
+    'dmarc_ownership.png': ('dmarc_ownership', "DMARC Ownership", "DMARC OWNERSHIP"),
+    'dmarc_policy.png': ('dmarc_policy', "DMARC Policy", "DMARC POLICY"),
+    'whois_chart.png': ('whois_class', "WHOIS Summary", "WHOIS SUMMARY"),
+}
+artifact_builds = {}
+artifact_builds_lock = threading.Lock()
+
+def read_changes(output_dir, manifest, limit=None):
+    entry = manifest['artifacts'].get('changes')
+    if entry is None:
+        return
+    with open(os.path.join(output_dir, entry['path']), encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if limit is not None and i >= limit:
+                return
+            yield json.loads(line)
+
+def build_chart(filename):
+    def build(job_id, output_dir, manifest, report, store):
+        attr, title, _ = CHART_SOURCES[filename]
+        images_dir = os.path.join(output_dir, "Images")
+        os.makedirs(images_dir, exist_ok=True)
+        path = os.path.join(images_dir, filename)
+        with open(path, 'wb') as f:
+            f.write(render_pie_chart(report['charts'][attr], title))
+        return path
+    return build
+
+def job_charts(job_id, store=None):
+    # filename -> PNG bytes for every chart, building missing ones in parallel
+    with ThreadPoolExecutor(max_workers=len(CHART_SOURCES)) as executor:
+        paths = dict(zip(CHART_SOURCES, executor.map(lambda filename: ensure_artifact(job_id, filename, store)[0], CHART_SOURCES)))
+    charts = {}
+    for filename, path in paths.items():
+        with open(path, 'rb') as f:
+            charts[filename] = f.read()
+    return charts
+
+def build_excel(job_id, output_dir, manifest, report, store):
+    from openpyxl import Workbook
+    from openpyxl.styles import Border, Side, Alignment, PatternFill, Font
+    from openpyxl.utils import get_column_letter
+    from openpyxl.drawing.image import Image as XLImage
+    from openpyxl.cell import WriteOnlyCell
+    path = os.path.join(output_dir, f"DNS_Lookup_Results_{report['timestamp']}.xlsx")
+    charts = job_charts(job_id, store)
+    # Every column width is known up front, so the workbook is streamed
+    wb = Workbook(write_only=True)
+    sheets = {name: wb.create_sheet(name) for name in RESULT_SHEET_HEADERS}
+    ws_changes = wb.create_sheet("Changes") if report['baseline'] is not None else None
     ws_summary = wb.create_sheet("Summary")
     thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
     header_fill = PatternFill(start_color='FFA500', end_color='FFA500', fill_type='solid')
-    light_red_fill = PatternFill(start_color='FF4433', end_color='FF4433', fill_type='solid')
-    light_green_fill = PatternFill(start_color='4CBB17', end_color='4CBB17', fill_type='solid')
-    light_blue_fill = PatternFill(start_color='87CEEB', end_color='87CEEB', fill_type='solid')
-    orange_fill = PatternFill(start_color='FBCEB1', end_color='FBCEB1', fill_type='solid')
-    light_yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
     bold_font = Font(bold=True)
     center_align = Alignment(wrap_text=True, vertical='center')
-    ws_dmarc.append(["Domain", "Primary_Domain_Policy", "Secondary_Domain_Policy", "DMARC_Record"])
-    ws_spf.append(["Domain", "SPF_Record"])
-    ws_mx.append(["Domain", "MX_Record"])
-    ws_whois.append(["Domain", "NameServers", "Registrar", "RegisteredOn", "ExpiresOn", "UpdatedOn"])
-    for sheet in [ws_dmarc, ws_spf, ws_mx, ws_whois, ws_summary]:
-        for cell in sheet[1]:
-            cell.fill = header_fill
-            cell.font = bold_font
+    fills = {name: PatternFill(start_color=color, end_color=color, fill_type='solid') for name, color in SHEET_FILL_COLORS.items()}
+    def append_styled_row(ws, values, fill=None, font=None):
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
             cell.border = thin_border
             cell.alignment = center_align
-        sheet.auto_filter.ref = sheet.dimensions
-    spf_chart_data = {"No SPF Record": 0, "Explicit Hard Fail": 0, "JNJ Agari SPF": 0, "Third Party SPF": 0}
-    mx_chart_data = {"No MX Record": 0, "Kenvue MX": 0, "JNJ MX": 0, "Third Party MX": 0}
-    dmarc_ownership = {"No DMARC Record": 0, "Non-Migrated JNJ DMARC": 0, "Migrated Kenvue DMARC": 0}
-    dmarc_policy = {"No DMARC Record": 0, "Reject DMARC Policy": 0, "Quarantine DMARC Policy": 0, "No DMARC Policy": 0}
-    whois_chart_data = {"No Name Servers Found": 0, "Kenvue Owned Domains": 0, "Non-Kenvue Domain": 0}
-    def get_dns_record(domain, record_type, nameserver='1.1.1.1'):
-        resolver = dns.resolver.Resolver()
-        resolver.nameservers = [nameserver]
-        resolver.timeout = 10
-        resolver.lifetime = 20
-        try:
-            answers = resolver.resolve(domain, record_type)
-            return ', '.join(answer.to_text() for answer in answers)
-        except:
-            return f'No {record_type} record found'
-    def get_spf_record(domain, nameserver='1.1.1.1'):
-        resolver = dns.resolver.Resolver()
-        resolver.nameservers = [nameserver]
-        resolver.timeout = 10
-        resolver.lifetime = 20
-        try:
-            answers = resolver.resolve(domain, 'TXT')
-            for rdata in answers:
-                for txt_string in rdata.strings:
-                    decoded = txt_string.decode('utf-8')
-                    if decoded.startswith('v=spf1'):
-                        return decoded
-            return 'No SPF record found'
-        except:
-            return 'No SPF record found'
-    def extract_policy(dmarc_record, policy_type):
-        match = re.search(policy_type + '=([^;]+)', dmarc_record)
-        return match.group(1) if match else f'No {policy_type} policy found'
-    def format_date(date_obj):
-        if isinstance(date_obj, list):
-            date_obj = date_obj[0]
-        if isinstance(date_obj, datetime):
-            return date_obj.strftime("%Y-%m-%d")
-        return ""
-    def normalize_nameservers(ns_list):
-        return [re.sub(r'\s+', '', ns.strip().lower()) for ns in ns_list if ns.strip()]
-    def process_domain(domain):
-        logging.info(f"Processing domain: {domain}")
-        dmarc_record = get_dns_record(f"_dmarc.{domain}", "TXT")
-        p_policy = extract_policy(dmarc_record, 'p')
-        sp_policy = extract_policy(dmarc_record, 'sp')
-        if 'No TXT record found' in dmarc_record:
-            dmarc_ownership["No DMARC Record"] += 1
-            dmarc_policy["No DMARC Record"] += 1
-        else:
-            if "jnj@rua.dmp.cisco.com" in dmarc_record or "jnj@ruf.dmp.cisco.com" in dmarc_record:
-                dmarc_ownership["Non-Migrated JNJ DMARC"] += 1
-            elif "93881cb5@inbox.ondmarc.com" in dmarc_record:
-                dmarc_ownership["Migrated Kenvue DMARC"] += 1
-            if 'p=reject' in dmarc_record:
-                dmarc_policy["Reject DMARC Policy"] += 1
-            elif 'p=quarantine' in dmarc_record:
-                dmarc_policy["Quarantine DMARC Policy"] += 1
-            elif 'p=none' in dmarc_record:
-                dmarc_policy["No DMARC Policy"] += 1
-        ws_dmarc.append([domain, p_policy, sp_policy, dmarc_record])
-        row_dmarc = ws_dmarc.max_row
-        for cell in ws_dmarc[row_dmarc]:
-            cell.border = thin_border
-            cell.alignment = center_align
-            if dmarc_record == 'No TXT record found':
-                cell.fill = light_red_fill
-            elif p_policy == 'quarantine' and sp_policy == 'quarantine':
-                cell.fill = light_green_fill
-            elif p_policy == 'reject' and sp_policy == 'reject':
-                cell.fill = light_blue_fill
-            elif p_policy == 'none' and sp_policy == 'none':
-                cell.fill = orange_fill
-            if "rua=mailto:jnj@rua.dmp.cisco.com" in dmarc_record.lower() or "ruf=mailto:jnj@ruf.dmp.cisco.com" in dmarc_record.lower():
-                cell.fill = light_yellow_fill
-        spf_record = get_spf_record(domain)
-        ws_spf.append([domain, spf_record])
-        row_spf = ws_spf.max_row
-        for cell in ws_spf[row_spf]:
-            cell.border = thin_border
-            cell.alignment = center_align
-            cell.fill = light_green_fill if 'No' not in spf_record else light_red_fill
-        if 'No SPF record found' in spf_record:
-            spf_chart_data["No SPF Record"] += 1
-        elif spf_record.strip() == 'v=spf1 -all':
-            spf_chart_data["Explicit Hard Fail"] += 1
-        elif "ce.spf-protect.dmp.cisco.com" in spf_record or "d.espf.dmp.cisco.com" in spf_record:
-            spf_chart_data["JNJ Agari SPF"] += 1
-        else:
-            spf_chart_data["Third Party SPF"] += 1
-        mx_record = get_dns_record(domain, 'MX')
-        ws_mx.append([domain, mx_record])
-        row_mx = ws_mx.max_row
-        for cell in ws_mx[row_mx]:
-            cell.border = thin_border
-            cell.alignment = center_align
-            cell.fill = light_green_fill if 'No' not in mx_record else light_red_fill
-        if 'No MX record found' in mx_record:
-            mx_chart_data["No MX Record"] += 1
-        elif "kenvue-com.mail.protection.outlook.com" in mx_record:
-            mx_chart_data["Kenvue MX"] += 1
-        elif "mx1.jnj-sd.iphmx.com" in mx_record or "mx2.jnj-sd.iphmx.com" in mx_record:
-            mx_chart_data["JNJ MX"] += 1
-        else:
-            mx_chart_data["Third Party MX"] += 1
-        try:
-            w = whois.whois(domain)
-            ns_list = w.name_servers if isinstance(w.name_servers, list) else [w.name_servers] if isinstance(w.name_servers, str) else []
-            ns_display = "\n".join(ns_list)
-            normalized_ns = normalize_nameservers(ns_list)
-            if not normalized_ns:
-                whois_chart_data["No Name Servers Found"] += 1
-            elif any("kenvuedns" in ns for ns in normalized_ns):
-                whois_chart_data["Kenvue Owned Domains"] += 1
-            else:
-                whois_chart_data["Non-Kenvue Domain"] += 1
-            ws_whois.append([domain, ns_display, w.registrar, format_date(w.creation_date), format_date(w.expiration_date), format_date(w.updated_date)])
-            row_whois = ws_whois.max_row
-            fill = light_green_fill if any("kenvuedns" in ns for ns in normalized_ns) else light_red_fill if not normalized_ns else light_yellow_fill
-            for cell in ws_whois[row_whois]:
-                cell.border = thin_border
-                cell.alignment = center_align
+            if fill is not None:
                 cell.fill = fill
-        except Exception as e:
-            whois_chart_data["No Name Servers Found"] += 1
-            ws_whois.append([domain, f"Error: {e}", "", "", "", ""])
-            row_whois = ws_whois.max_row
-            for cell in ws_whois[row_whois]:
-                cell.border = thin_border
-                cell.alignment = center_align
-                cell.fill = light_red_fill
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        for _ in executor.map(process_domain, df["Domain"]):
-            pass
-    for ws in [ws_dmarc, ws_spf, ws_mx, ws_whois]:
-        for col in ws.columns:
-            max_length = max(len(str(cell.value)) if cell.value else 0 for cell in col)
-            ws.column_dimensions[get_column_letter(col[0].column)].width = max_length + 2
-    def create_and_embed_chart(data, title, filename, position):
-        labels = list(data.keys())
-        sizes = list(data.values())
-        plt.figure(figsize=(8, 6))
-        plt.pie(sizes, labels=[f"{l} ({v} / {sum(sizes)} - {v/sum(sizes)*100:.1f}%)" for l, v in data.items()], autopct='', startangle=140)
-        plt.title(title, fontsize=14, pad=20)
-        chart_path = os.path.join(images_dir, filename)
-        plt.savefig(chart_path, bbox_inches='tight')
-        plt.close()
-        img = Image.open(chart_path)
-        bordered = ImageOps.expand(img, border=6, fill='black')
-        bordered.save(chart_path)
-        xl_img = XLImage(chart_path)
+            if font is not None:
+                cell.font = font
+            cells.append(cell)
+        ws.append(cells)
+    def start_sheet(ws, headers, widths):
+        for i, width in enumerate(widths, start=1):
+            ws.column_dimensions[get_column_letter(i)].width = width + 2
+        append_styled_row(ws, headers, fill=header_fill, font=bold_font)
+        ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}1"
+    for name, ws in sheets.items():
+        start_sheet(ws, RESULT_SHEET_HEADERS[name], report['column_widths'][name])
+    results_path, _ = artifact_path(job_id, manifest, 'results', store)
+    for result in read_results_file(results_path):
+        for sheet_name, values, fill in result_sheet_rows(result):
+            append_styled_row(sheets[sheet_name], values, fills.get(fill))
+    if ws_changes is not None:
+        # One pass for the widths and one for the rows, so the changes are never all in memory
+        widths = [len(h) for h in CHANGES_SHEET_HEADERS]
+        for change in read_changes(output_dir, manifest):
+            widths = [max(w, len(str(value or ''))) for w, value in zip(widths, change)]
+        start_sheet(ws_changes, CHANGES_SHEET_HEADERS, widths)
+        for change in read_changes(output_dir, manifest):
+            append_styled_row(ws_changes, change, fills['yellow'])
+    for filename, position in CHART_POSITIONS.items():
+        xl_img = XLImage(io.BytesIO(charts[filename]))
         xl_img.width = 500
         xl_img.height = 400
         ws_summary.add_image(xl_img, position)
-    create_and_embed_chart(spf_chart_data, "SPF Summary", "spf_chart.png", "A1")
-    create_and_embed_chart(mx_chart_data, "MX Summary", "mx_chart.png", "J1")
-    create_and_embed_chart(dmarc_ownership, "DMARC Ownership", "dmarc_ownership.png", "A25")
-    create_and_embed_chart(dmarc_policy, "DMARC Policy", "dmarc_policy.png", "J25")
-    create_and_embed_chart(whois_chart_data, "WHOIS Summary", "whois_chart.png", "A49")
-    wb.save(final_output_file)
-    def dashboard_image_url(filename):
-        return f"/results/{os.path.basename(output_dir)}/image/{filename}"
+    wb.save(path)
+    return path
+
+def build_dashboard(job_id, output_dir, manifest, report, store):
+    dashboard_dir = os.path.join(output_dir, "Dashboard")
+    os.makedirs(dashboard_dir, exist_ok=True)
+    path = os.path.join(dashboard_dir, f"DNS_Lookup_Summary_Dashboard_{report['timestamp']}.html")
+    charts = report['charts']
+    spf_chart_data, mx_chart_data = charts['spf_class'], charts['mx_class']
+    dmarc_ownership, dmarc_policy, whois_chart_data = charts['dmarc_ownership'], charts['dmarc_policy'], charts['whois_class']
     def write_summary_table(f, title, summary_dict):
         f.write('<table class="summary-table"><tr><th>Category</th><th>Count</th></tr>')
         for k, v in summary_dict.items():
@@ -450,50 +3619,49 @@ def run_dns_lookup(input_csv_path, output_dir):
                 seen.add(p)
         return unique
     def get_dynamic_pointer_spf(spf_data):
-        total = sum(spf_data.values())
-        if spf_data["No SPF Record"] > 0:
+        if spf_data.get("No SPF Record", 0) > 0:
             return f"{spf_data['No SPF Record']} domains are missing SPF records. Please review these for improved email security."
-        elif spf_data["Explicit Hard Fail"] > 0:
+        elif spf_data.get("Explicit Hard Fail", 0) > 0:
             return f"{spf_data['Explicit Hard Fail']} domains have explicit hard fail SPF policies. Ensure this is intentional."
-        elif spf_data["JNJ Agari SPF"] > 0:
+        elif spf_data.get("JNJ Agari SPF", 0) > 0:
             return f"{spf_data['JNJ Agari SPF']} domains use JNJ Agari SPF. Confirm these are correctly configured."
-        else:
+        elif "Third Party SPF" in spf_data:
             return f"Most domains ({spf_data['Third Party SPF']}) use third-party SPF records. Review for compliance."
     def get_dynamic_pointer_mx(mx_data):
-        if mx_data["No MX Record"] > 0:
+        if mx_data.get("No MX Record", 0) > 0:
             return f"{mx_data['No MX Record']} domains are missing MX records. These domains cannot receive emails."
-        elif mx_data["Kenvue MX"] > 0:
+        elif mx_data.get("Kenvue MX", 0) > 0:
             return f"{mx_data['Kenvue MX']} domains are using Kenvue MX. Ensure these are managed as expected."
-        elif mx_data["JNJ MX"] > 0:
+        elif mx_data.get("JNJ MX", 0) > 0:
             return f"{mx_data['JNJ MX']} domains are still using JNJ MX. Review migration status."
-        else:
+        elif "Third Party MX" in mx_data:
             return f"Most domains ({mx_data['Third Party MX']}) use third-party MX records. Review for compliance."
     def get_dynamic_pointer_dmarc_ownership(dmarc_ownership):
-        if dmarc_ownership["No DMARC Record"] > 0:
+        if dmarc_ownership.get("No DMARC Record", 0) > 0:
             return f"{dmarc_ownership['No DMARC Record']} domains lack DMARC records. Add DMARC for better protection."
-        elif dmarc_ownership["Migrated Kenvue DMARC"] > 0:
+        elif dmarc_ownership.get("Migrated Kenvue DMARC", 0) > 0:
             return f"{dmarc_ownership['Migrated Kenvue DMARC']} domains have migrated to Kenvue DMARC. Good progress!"
-        elif dmarc_ownership["Non-Migrated JNJ DMARC"] > 0:
+        elif dmarc_ownership.get("Non-Migrated JNJ DMARC", 0) > 0:
             return f"{dmarc_ownership['Non-Migrated JNJ DMARC']} domains still use JNJ DMARC. Review migration plan."
         else:
             return "All domains have DMARC records."
     def get_dynamic_pointer_dmarc_policy(dmarc_policy):
-        if dmarc_policy["No DMARC Record"] > 0:
+        if dmarc_policy.get("No DMARC Record", 0) > 0:
             return f"{dmarc_policy['No DMARC Record']} domains lack DMARC records. Add DMARC for better protection."
-        elif dmarc_policy["Reject DMARC Policy"] > 0:
+        elif dmarc_policy.get("Reject DMARC Policy", 0) > 0:
             return f"{dmarc_policy['Reject DMARC Policy']} domains enforce reject DMARC policy. This is recommended."
-        elif dmarc_policy["Quarantine DMARC Policy"] > 0:
+        elif dmarc_policy.get("Quarantine DMARC Policy", 0) > 0:
             return f"{dmarc_policy['Quarantine DMARC Policy']} domains enforce quarantine DMARC policy. We can consider upgrading to reject policy."
-        elif dmarc_policy["No DMARC Policy"] > 0:
+        elif dmarc_policy.get("No DMARC Policy", 0) > 0:
             return f"{dmarc_policy['No DMARC Policy']} domains have no DMARC policy. Set a policy for better protection."
         else:
             return "All domains have DMARC policies."
     def get_dynamic_pointer_whois(whois_data):
-        if whois_data["No Name Servers Found"] > 0:
+        if whois_data.get("No Name Servers Found", 0) > 0:
             return f"{whois_data['No Name Servers Found']} domains have no name servers. Review registration status and confirm with DNS Team if Kenvue actually owns these."
-        elif whois_data["Kenvue Owned Domains"] > 0:
+        elif whois_data.get("Kenvue Owned Domains", 0) > 0:
             return f"{whois_data['Kenvue Owned Domains']} domains are Kenvue owned. Good asset management!"
-        elif whois_data["Non-Kenvue Domain"] > 0:
+        elif whois_data.get("Non-Kenvue Domain", 0) > 0:
             return f"{whois_data['Non-Kenvue Domain']} domains point to Non-Kenvue DNS. Review ownership and risk."
         else:
             return "All domains have valid name servers."
@@ -502,7 +3670,14 @@ def run_dns_lookup(input_csv_path, output_dir):
     dmarc_ownership_pointer = get_dynamic_pointer_dmarc_ownership(dmarc_ownership)
     dmarc_policy_pointer = get_dynamic_pointer_dmarc_policy(dmarc_policy)
     whois_pointer = get_dynamic_pointer_whois(whois_chart_data)
-    unique_pointers = get_unique_pointers(spf_pointer, mx_pointer, dmarc_ownership_pointer, dmarc_policy_pointer, whois_pointer)
+    # Categories are looked up with .get() because the rule table can rename
+    # them; a pointer whose fallback category no longer exists is left out
+    unique_pointers = get_unique_pointers(*(p for p in (spf_pointer, mx_pointer, dmarc_ownership_pointer, dmarc_policy_pointer, whois_pointer) if p is not None))
+    if report['failed_lookups']:
+        reason = "lookups failed or the job deadline was reached" if report['deadline_expired'] else "resolvers timed out or failed"
+        unique_pointers.append(f"{report['failed_lookups']} domains have incomplete DNS results because {reason}. Re-run these before acting on them.")
+    if report['baseline'] is not None:
+        unique_pointers.append(f"{report['changed_domains']} domains changed SPF, MX, DMARC policy or name servers since baseline job {report['baseline']}; {report['reused']} unchanged domains were reused without re-querying.")
     html_content = '''
         <html>
         <head>
@@ -546,8 +3721,8 @@ def run_dns_lookup(input_csv_path, output_dir):
             <div class="pointer-box">
                 <div class="pointer-title">Key Insights</div>
                 <ul>
-        '''.format(total_domains=len(df), human_timestamp=human_timestamp)
-    with open(html_file, "w") as f:
+        '''.format(total_domains=report['total_domains'], human_timestamp=report['human_timestamp'])
+    with open(path, "w") as f:
         f.write(html_content)
         for pointer in unique_pointers:
             f.write(f'<li>{pointer}</li>')
@@ -555,6 +3730,19 @@ def run_dns_lookup(input_csv_path, output_dir):
                 </ul>
             </div>
         ''')
+        # Changes since the baseline job
+        if report['baseline'] is not None:
+            f.write('<div class="summary-section">')
+            f.write('<div class="summary-table-container" style="max-width:1100px;">')
+            f.write(f'<div class="summary-table-title">Changes Since Baseline ({report["changes"]})</div>')
+            f.write('<table class="summary-table"><tr>' + ''.join(f'<th>{h}</th>' for h in CHANGES_SHEET_HEADERS) + '</tr>')
+            for change in read_changes(output_dir, manifest, DASHBOARD_CHANGES_LIMIT):
+                f.write('<tr>' + ''.join(f'<td>{escape(value or "")}</td>' for value in change) + '</tr>')
+            f.write('</table>')
+            if report['changes'] > DASHBOARD_CHANGES_LIMIT:
+                f.write(f'<p>Showing the first {DASHBOARD_CHANGES_LIMIT}; see the Changes sheet for all {report["changes"]}.</p>')
+            f.write('</div>')
+            f.write('</div><hr>')
         # SPF
         f.write('<div class="summary-section">')
         f.write('<div class="summary-table-container">')
@@ -562,8 +3750,8 @@ def run_dns_lookup(input_csv_path, output_dir):
         write_summary_table(f, None, spf_chart_data)
         f.write('</div>')
         f.write('<div class="dashboard-img-container">')
-        f.write(f'<span class="tooltip"><img class="dashboard-img" src="/results/{{job_id}}/image/spf_chart.png" alt="SPF Summary" title="SPF Chart: Distribution of SPF record types."/><span class="tooltiptext">SPF Chart: Shows distribution of SPF record types across domains.</span></span>')
-        f.write(f'<a class="download-btn" href="/results/{{job_id}}/image/spf_chart.png" download>Download SPF Image</a>')
+        f.write('<span class="tooltip"><img class="dashboard-img" src="/results/{job_id}/image/spf_chart.png" alt="SPF Summary" title="SPF Chart: Distribution of SPF record types."/><span class="tooltiptext">SPF Chart: Shows distribution of SPF record types across domains.</span></span>')
+        f.write('<a class="download-btn" href="/results/{job_id}/image/spf_chart.png" download>Download SPF Image</a>')
         f.write('</div>')
         f.write('</div><hr>')
         # MX
@@ -573,8 +3761,8 @@ def run_dns_lookup(input_csv_path, output_dir):
         write_summary_table(f, None, mx_chart_data)
         f.write('</div>')
         f.write('<div class="dashboard-img-container">')
-        f.write(f'<span class="tooltip"><img class="dashboard-img" src="/results/{{job_id}}/image/mx_chart.png" alt="MX Summary" title="MX Chart: Distribution of MX record types."/><span class="tooltiptext">MX Chart: Shows distribution of MX record types across domains.</span></span>')
-        f.write(f'<a class="download-btn" href="/results/{{job_id}}/image/mx_chart.png" download>Download MX Image</a>')
+        f.write('<span class="tooltip"><img class="dashboard-img" src="/results/{job_id}/image/mx_chart.png" alt="MX Summary" title="MX Chart: Distribution of MX record types."/><span class="tooltiptext">MX Chart: Shows distribution of MX record types across domains.</span></span>')
+        f.write('<a class="download-btn" href="/results/{job_id}/image/mx_chart.png" download>Download MX Image</a>')
         f.write('</div>')
         f.write('</div><hr>')
         # DMARC Ownership
@@ -584,8 +3772,8 @@ def run_dns_lookup(input_csv_path, output_dir):
         write_summary_table(f, None, dmarc_ownership)
         f.write('</div>')
         f.write('<div class="dashboard-img-container">')
-        f.write(f'<span class="tooltip"><img class="dashboard-img" src="/results/{{job_id}}/image/dmarc_ownership.png" alt="DMARC Ownership" title="DMARC Ownership Chart: Ownership status."/><span class="tooltiptext">DMARC Ownership Chart: Shows DMARC ownership status across domains.</span></span>')
-        f.write(f'<a class="download-btn" href="/results/{{job_id}}/image/dmarc_ownership.png" download>Download DMARC Ownership Image</a>')
+        f.write('<span class="tooltip"><img class="dashboard-img" src="/results/{job_id}/image/dmarc_ownership.png" alt="DMARC Ownership" title="DMARC Ownership Chart: Ownership status."/><span class="tooltiptext">DMARC Ownership Chart: Shows DMARC ownership status across domains.</span></span>')
+        f.write('<a class="download-btn" href="/results/{job_id}/image/dmarc_ownership.png" download>Download DMARC Ownership Image</a>')
         f.write('</div>')
         f.write('</div><hr>')
         # DMARC Policy
@@ -595,8 +3783,8 @@ def run_dns_lookup(input_csv_path, output_dir):
         write_summary_table(f, None, dmarc_policy)
         f.write('</div>')
         f.write('<div class="dashboard-img-container">')
-        f.write(f'<span class="tooltip"><img class="dashboard-img" src="/results/{{job_id}}/image/dmarc_policy.png" alt="DMARC Policy" title="DMARC Policy Chart: Policy status."/><span class="tooltiptext">DMARC Policy Chart: Shows DMARC policy status across domains.</span></span>')
-        f.write(f'<a class="download-btn" href="/results/{{job_id}}/image/dmarc_policy.png" download>Download DMARC Policy Image</a>')
+        f.write('<span class="tooltip"><img class="dashboard-img" src="/results/{job_id}/image/dmarc_policy.png" alt="DMARC Policy" title="DMARC Policy Chart: Policy status."/><span class="tooltiptext">DMARC Policy Chart: Shows DMARC policy status across domains.</span></span>')
+        f.write('<a class="download-btn" href="/results/{job_id}/image/dmarc_policy.png" download>Download DMARC Policy Image</a>')
         f.write('</div>')
         f.write('</div><hr>')
         # WHOIS
@@ -606,32 +3794,128 @@ def run_dns_lookup(input_csv_path, output_dir):
         write_summary_table(f, None, whois_chart_data)
         f.write('</div>')
         f.write('<div class="dashboard-img-container">')
-        f.write(f'<span class="tooltip"><img class="dashboard-img" src="/results/{{job_id}}/image/whois_chart.png" alt="WHOIS Summary" title="WHOIS Chart: Ownership status."/><span class="tooltiptext">WHOIS Chart: Shows domain ownership and name server status.</span></span>')
-        f.write(f'<a class="download-btn" href="/results/{{job_id}}/image/whois_chart.png" download>Download WHOIS Image</a>')
+        f.write('<span class="tooltip"><img class="dashboard-img" src="/results/{job_id}/image/whois_chart.png" alt="WHOIS Summary" title="WHOIS Chart: Ownership status."/><span class="tooltiptext">WHOIS Chart: Shows domain ownership and name server status.</span></span>')
+        f.write('<a class="download-btn" href="/results/{job_id}/image/whois_chart.png" download>Download WHOIS Image</a>')
         f.write('</div>')
         f.write('</div><hr>')
         f.write("</body></html>")
-    pdf = FPDF()
+    return path
+
+def build_pdf(job_id, output_dir, manifest, report, store):
+    dashboard_dir = os.path.join(output_dir, "Dashboard")
+    os.makedirs(dashboard_dir, exist_ok=True)
+    path = os.path.join(dashboard_dir, f"DNS_Lookup_Report_{report['timestamp']}.pdf")
+    pdf = chart_pdf_class()(job_charts(job_id, store))
     pdf.set_auto_page_break(auto=True, margin=15)
-    for title, chart in zip([
-        "SPF SUMMARY", "MX SUMMARY", "DMARC OWNERSHIP", "DMARC POLICY", "WHOIS SUMMARY"],
-        ["spf_chart.png", "mx_chart.png", "dmarc_ownership.png", "dmarc_policy.png", "whois_chart.png"]):
-        chart_path = os.path.join(images_dir, chart)
+    for chart, (_, _, title) in CHART_SOURCES.items():
         pdf.add_page()
         pdf.set_font("Arial", size=16)
         pdf.cell(200, 16, txt=title, ln=True, align='C')
-        pdf.image(chart_path, x=10, y=30, w=180)
-    pdf.output(pdf_file)
-    # Return all output file paths for ZIP
-    return [final_output_file, html_file, pdf_file,
-            os.path.join(images_dir, "spf_chart.png"),
-            os.path.join(images_dir, "mx_chart.png"),
-            os.path.join(images_dir, "dmarc_ownership.png"),
-            os.path.join(images_dir, "dmarc_policy.png"),
-            os.path.join(images_dir, "whois_chart.png"),
-            log_file]
+        pdf.image(chart, x=10, y=30, w=180)
+    pdf.output(path)
+    return path
+
+# role -> (report stage, builder(job_id, output_dir, manifest, report, store) -> path)
+ARTIFACT_BUILDERS = {'excel': ('excel', build_excel), 'html': ('html', build_dashboard), 'pdf': ('pdf', build_pdf),
+                     'results_index': ('baseline_index', build_results_index)}
+ARTIFACT_BUILDERS.update({filename: ('charts', build_chart(filename)) for filename in CHART_SOURCES})
+
+def artifact_available(manifest, role):
+    return role in manifest['artifacts'] or (role in ARTIFACT_BUILDERS and 'report' in manifest['artifacts'])
+
+def ensure_artifact(job_id, role, store=None):
+    # (path, manifest entry) of a job artifact, building it first if needed;
+    # (None, None) when the job has no such artifact
+    store = store or job_store
+    manifest = load_manifest(job_id, store)
+    if manifest is None:
+        return None, None
+    if role in manifest['artifacts'] or not artifact_available(manifest, role):
+        return artifact_path(job_id, manifest, role, store)
+    key = (job_id, role)
+    with artifact_builds_lock:
+        # Re-checked under the lock: a build may have finished since
+        manifest = load_manifest(job_id, store)
+        build = None if role in manifest['artifacts'] else artifact_builds.get(key)
+        owner = build is None and role not in manifest['artifacts']
+        if owner:
+            build = artifact_builds[key] = Future()
+    if owner:
+        try:
+            stage, builder = ARTIFACT_BUILDERS[role]
+            output_dir = store.job_dir(job_id)
+            report_path, _ = artifact_path(job_id, manifest, 'report', store)
+            with open(report_path, encoding='utf-8') as f:
+                report = json.load(f)
+            started = time.perf_counter()
+            path = builder(job_id, output_dir, manifest, report, store)
+            seconds = time.perf_counter() - started
+            report_stage_seconds.observe(seconds, stage)
+            extend_manifest(job_id, {role: path}, store, {stage: seconds})
+            build.set_result(None)
+        except Exception as e:
+            build.set_exception(e)
+            raise
+        finally:
+            with artifact_builds_lock:
+                artifact_builds.pop(key, None)
+    elif build is not None:
+        build.result()
+    return artifact_path(job_id, load_manifest(job_id, store), role, store)
+
+# --- Command line ---
+# python -m Enhanced_DNS_Lookup_WebApp scan domains.csv --out DIR --formats xlsx,json
+# runs one scan without the web server, for cron and pipelines. DIR is used as
+# a one-off job directory and only the requested formats are built, so a json
+# scan never loads the report libraries. With no command the web app starts.
+CLI_FORMATS = {
+    'json': ('results', 'report'),
+    'parquet': ('columnar',),
+    'xlsx': ('excel',),
+    'pdf': ('pdf',),
+    'png': tuple(CHART_SOURCES),
+}
+
+def cli_formats(value):
+    formats = list(dict.fromkeys(f.strip().lower() for f in value.split(',') if f.strip()))
+    unknown = [f for f in formats if f not in CLI_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f"unknown format {', '.join(unknown) or value!r}; choose from {', '.join(CLI_FORMATS)}")
+    return formats
+
+def scan(input_csv, out, formats=('json',), deadline=None, shards=None):
+    # Returns the paths of the requested artifacts
+    output_dir = os.path.abspath(out)
+    os.makedirs(output_dir, exist_ok=True)
+    # The artifact helpers address jobs as <store root>/<job_id>; a scan is
+    # not part of the web app's job store, so it gets an in-memory one that
+    # never lists the output directory's siblings
+    root, job_id = os.path.split(output_dir)
+    store = JobStore(root=root, path=':memory:', max_bytes=0, max_age=0, pack_idle=0, seed=False, valid_id=job_id.__eq__)
+    run_dns_lookup(input_csv, output_dir, deadline=deadline, shards=shards, columnar='parquet' in formats)
+    return [ensure_artifact(job_id, role, store)[0] for fmt in formats for role in CLI_FORMATS[fmt]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DNS, DMARC, SPF, MX and WHOIS lookups for a list of domains')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='run the web app (the default)')
+    serve.add_argument('--port', type=int, default=int(os.environ.get('PORT', 10000)))
+    scan_parser = commands.add_parser('scan', help='scan a CSV of domains and write the reports to a directory')
+    scan_parser.add_argument('input_csv', help="CSV file with a 'Domain' column")
+    scan_parser.add_argument('--out', required=True, help='output directory')
+    scan_parser.add_argument('--formats', type=cli_formats, default=['json'],
+                             help=f"comma-separated, from {', '.join(CLI_FORMATS)} (default json)")
+    scan_parser.add_argument('--deadline', type=float, help='lookup deadline in seconds')
+    scan_parser.add_argument('--shards', type=int, help='lookup processes')
+    args = parser.parse_args(argv)
+    if args.command == 'scan':
+        if (args.deadline is not None and args.deadline <= 0) or (args.shards is not None and args.shards < 1):
+            parser.error('--deadline and --shards must be positive')
+        for path in scan(args.input_csv, args.out, args.formats, args.deadline, args.shards):
+            print(path)
+        return 0
+    app.run(host='0.0.0.0', port=getattr(args, 'port', None) or int(os.environ.get('PORT', 10000)))
+    return 0
 
 if __name__ == '__main__':
-    import os
-    port = int(os.environ.get('PORT', 10000))
-    app.run(host='0.0.0.0', port=port)
+    sys.exit(main())
@@ -0,0 +1,431 @@
+# benchmark.py
+# Offline throughput benchmark for run_dns_lookup()
+# Starts a stand-in DNS server and a fake WHOIS server on localhost, feeds
+# synthetic domain lists through the full pipeline and records domains/sec,
+# per-domain latency, peak RSS and per-stage time, so regressions show up
+# before deploy without touching public resolvers or registries.
+#
+#   python benchmark.py --sizes 100,1000,10000 --output bench.json
+#   python benchmark.py --sizes 1000 --dns-loss 0.02 --dns-servfail 0.01 --compare bench.json
+#   python benchmark.py --sizes 100 --whois-rate 1
+#
+# Runs use the app's default WHOIS configuration unless --whois-rate sets a
+# fixed per-TLD rate, so the headline numbers are what a real job would see.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+BENCH_TTL = 300
+STAGES = ('lookup', 'persist', 'charts', 'html', 'excel', 'pdf')
+
+# --- Synthetic zone ---
+# Every answer is derived from a hash of the registrable label, so a given
+# domain always gets the same records and the report mix stays realistic.
+DMARC_RECORDS = [
+    'v=DMARC1; p=reject; sp=reject; rua=mailto:93881cb5@inbox.ondmarc.com',
+    'v=DMARC1; p=quarantine; sp=quarantine; rua=mailto:jnj@rua.dmp.cisco.com',
+    'v=DMARC1; p=none; rua=mailto:dmarc@example.net',
+    None,
+]
+SPF_RECORDS = [
+    'v=spf1 include:ce.spf-protect.dmp.cisco.com -all',
+    'v=spf1 include:spf.protection.outlook.com -all',
+    'v=spf1 -all',
+    None,
+]
+# The include targets above answer with their own provider-style records
+# (address ranges, one nested include, no loops) whatever their label hashes to
+INCLUDE_SPF_RECORDS = {
+    'spf.protection.outlook.com': 'v=spf1 ip4:40.92.0.0/15 ip4:40.107.0.0/16 ip4:52.100.0.0/15 ip4:104.47.0.0/17 '
+                                  'ip6:2a01:111:f400::/48 ip6:2a01:111:f403::/49 include:spfd.protection.outlook.com -all',
+    'spfd.protection.outlook.com': 'v=spf1 ip4:51.4.72.0/24 ip4:51.5.72.0/24 ip6:2a01:4180:4051:800::/64 -all',
+    'ce.spf-protect.dmp.cisco.com': 'v=spf1 ip4:68.232.128.0/19 ip4:216.71.128.0/19 ip6:2607:f140:8000::/34 -all',
+}
+MX_RECORDS = [
+    '0 kenvue-com.mail.protection.outlook.com.',
+    '10 mx1.jnj-sd.iphmx.com.',
+    '10 mx.example.net.',
+    None,
+]
+NAME_SERVERS = [
+    ['NS1.KENVUEDNS.COM', 'NS2.KENVUEDNS.COM'],
+    ['NS1.EXAMPLE-DNS.NET', 'NS2.EXAMPLE-DNS.NET'],
+    [],
+]
+
+def variant(label, choices):
+    digest = hashlib.md5(label.encode()).digest()
+    return choices[digest[0] % len(choices)]
+
+def base_label(name):
+    labels = name.rstrip('.').lower().split('.')
+    return labels[-2] if len(labels) >= 2 else labels[0]
+
+def synthetic_domains(count, seed):
+    # ~2% duplicates, ~3% names that do not exist, ~5% subdomains
+    rng = random.Random(seed)
+    domains = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.02 and domains:
+            domains.append(rng.choice(domains))
+        elif roll < 0.05:
+            domains.append(f'nx{i}.com')
+        elif roll < 0.10:
+            domains.append(f'mail.bench{i}.com')
+        else:
+            domains.append(f'bench{i}.com')
+    return domains
+
+# --- Stand-in servers ---
+class ServerConfig:
+    def __init__(self, latency, jitter, loss, error_rate, seed):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.referrals = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+class FakeDNSProtocol(asyncio.DatagramProtocol):
+    def __init__(self, config):
+        self.config = config
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            query = dns.message.from_wire(data)
+        except Exception:
+            return
+        config = self.config
+        config.requests += 1
+        if config.rng.random() < config.loss:
+            config.dropped += 1
+            return
+        response = self.answer(query)
+        asyncio.get_running_loop().call_later(config.delay(), self.transport.sendto, response.to_wire(), addr)
+
+    def answer(self, query):
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.RA
+        if self.config.rng.random() < self.config.error_rate:
+            self.config.errors += 1
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response
+        question = query.question[0]
+        name = question.name.to_text(omit_final_dot=True).lower()
+        label = base_label(name)
+        if label.startswith('nx'):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(self.soa(question.name))
+            return response
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        if rdtype == 'TXT' and name.startswith('_dmarc.'):
+            record = variant(label, DMARC_RECORDS)
+            texts = [f'"{record}"'] if record else []
+        elif rdtype == 'TXT':
+            record = INCLUDE_SPF_RECORDS.get(name) or variant(label, SPF_RECORDS)
+            texts = [f'"{record}"', '"google-site-verification=bench"'] if record else []
+        elif rdtype == 'MX':
+            record = variant(label, MX_RECORDS)
+            texts = [record] if record else []
+        else:
+            texts = []
+        if texts:
+            response.answer.append(dns.rrset.from_text_list(question.name, BENCH_TTL, 'IN', rdtype, texts))
+        else:
+            response.authority.append(self.soa(question.name))
+        return response
+
+    @staticmethod
+    def soa(name):
+        return dns.rrset.from_text(name.parent() if len(name) > 2 else name, BENCH_TTL, 'IN', 'SOA',
+                                   'ns1.bench. hostmaster.bench. 1 3600 600 86400 60')
+
+def whois_text(domain):
+    label = base_label(domain)
+    lines = [
+        f'Domain Name: {domain.upper()}',
+        'Registrar: Bench Registrar, Inc.',
+        'Updated Date: 2024-01-15T10:00:00Z',
+        'Creation Date: 2001-03-04T05:06:07Z',
+        'Registry Expiry Date: 2030-03-04T05:06:07Z',
+    ]
+    lines += [f'Name Server: {ns}' for ns in variant(label, NAME_SERVERS)]
+    return '\r\n'.join(lines) + '\r\n'
+
+def referral_text(tld):
+    # What whois.iana.org answers for a bare TLD; python-whois follows the
+    # "whois:" line to the registry before asking about the domain itself
+    return f'domain:       {tld.upper()}\r\nwhois:        whois.bench-registry.test\r\n'
+
+async def handle_whois(reader, writer, config):
+    try:
+        query = (await reader.readline()).decode('utf-8', 'replace').strip()
+        if '.' not in query:
+            config.referrals += 1
+            writer.write(referral_text(query).encode())
+            await writer.drain()
+            return
+        config.requests += 1
+        await asyncio.sleep(config.delay())
+        if config.rng.random() < config.loss:
+            config.dropped += 1
+            return
+        if config.rng.random() < config.error_rate or base_label(query).startswith('nx'):
+            config.errors += 1
+            writer.write(f'No match for "{query.upper()}".\r\n'.encode())
+        else:
+            writer.write(whois_text(query).encode())
+        await writer.drain()
+    finally:
+        writer.close()
+
+class StandInServers:
+    # The DNS server listens on the same UDP port on each loopback address so
+    # the engine's multi-resolver hedging is exercised; WHOIS is one TCP port.
+    def __init__(self, args):
+        self.addresses = [f'127.0.0.{i + 1}' for i in range(args.resolvers)]
+        self.dns_config = ServerConfig(args.dns_latency, args.dns_jitter, args.dns_loss, args.dns_servfail, args.seed)
+        self.whois_config = ServerConfig(args.whois_latency, args.whois_jitter, args.whois_loss, args.whois_error, args.seed + 1)
+        self.loop = asyncio.new_event_loop()
+        self.dns_port = None
+        self.whois_port = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bench-servers', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._listen())
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _listen(self):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        probe.bind((self.addresses[0], 0))
+        self.dns_port = probe.getsockname()[1]
+        probe.close()
+        for address in self.addresses:
+            await self.loop.create_datagram_endpoint(lambda: FakeDNSProtocol(self.dns_config), local_addr=(address, self.dns_port))
+        server = await asyncio.start_server(lambda r, w: handle_whois(r, w, self.whois_config), '127.0.0.1', 0)
+        self.whois_port = server.sockets[0].getsockname()[1]
+
+# --- Single run (child process) ---
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def run_one(args):
+    # Runs in a fresh interpreter so peak RSS and the caches belong to one size
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='dns-bench-', dir=args.workdir)
+    os.environ.update({
+        'DNS_NAMESERVERS': args.nameservers,
+        'DNS_PORT': str(args.dns_port),
+        'DNS_TIMEOUT': str(args.dns_timeout),
+        'DNS_LIFETIME': str(args.dns_timeout * 3),
+        'WHOIS_CACHE_PATH': os.path.join(workdir, 'whois_cache.sqlite3'),
+    })
+    import resource
+    import whois
+    # python-whois always dials port 43; send those connections to the fake server
+    whois_port = args.whois_port
+    class RedirectedSocket(socket.socket):
+        def connect(self, address):
+            return super().connect(('127.0.0.1', whois_port) if address[1] == 43 else address)
+    whois.NICClient.get_socket = staticmethod(lambda: RedirectedSocket(socket.AF_INET, socket.SOCK_STREAM))
+    import pyarrow.parquet as pq
+    import Enhanced_DNS_Lookup_WebApp as app_module
+    if args.whois_rate == 'off':
+        # No per-TLD rate or concurrency cap at all
+        app_module.whois_limiter = app_module.WhoisRateLimiter(rate=0, concurrency=0)
+    elif args.whois_rate != 'default':
+        app_module.whois_limiter = app_module.WhoisRateLimiter(rate=float(args.whois_rate))
+
+    input_csv = os.path.join(workdir, 'domains.csv')
+    with open(input_csv, 'w', encoding='utf-8') as f:
+        f.write('Domain\n')
+        for domain in synthetic_domains(args.run_one, args.seed):
+            f.write(domain + '\n')
+    output_dir = os.path.join(workdir, 'job')
+    streaming = {'auto': None, 'on': True, 'off': False}[args.streaming]
+    started = time.perf_counter()
+    app_module.run_dns_lookup(input_csv, output_dir, streaming=streaming)
+    elapsed = time.perf_counter() - started
+    # Reports are built on first request; build them all once, as a user
+    # opening every download would, and time each kind
+    store = app_module.JobStore(root=workdir, path=':memory:', max_bytes=0, max_age=0, pack_idle=0)
+    with open(os.path.join(output_dir, app_module.MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    for stage, roles in (('charts', list(app_module.CHART_SOURCES)), ('html', ['html']), ('excel', ['excel']), ('pdf', ['pdf'])):
+        stage_started = time.perf_counter()
+        for role in roles:
+            app_module.ensure_artifact('job', role, store)
+        manifest['stages'][stage] = round(time.perf_counter() - stage_started, 4)
+    columnar = os.path.join(output_dir, manifest['artifacts']['columnar']['path'])
+    # A domain's lookups run concurrently, so its latency is its slowest stage
+    latencies = [max(timings.values()) if timings else 0.0
+                 for timings in (dict(t or []) for t in pq.read_table(columnar, columns=['timings'])['timings'].to_pylist())]
+    whois_errors = pq.read_table(columnar, columns=['whois_error'])['whois_error'].to_pylist()
+    lookup_seconds = manifest['stages'].get('lookup') or elapsed
+    return {
+        'domains': args.run_one,
+        'streaming': args.streaming,
+        'elapsed_seconds': round(elapsed, 3),
+        'domains_per_sec': round(args.run_one / lookup_seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'whois_rate': args.whois_rate,
+        'whois_ok': whois_errors.count(None),
+        'whois_failed': len(whois_errors) - whois_errors.count(None),
+        'stages': manifest['stages'],
+        'dns_cache': app_module.dns_cache.stats(),
+    }
+
+# --- Driver ---
+def compare(results, previous, tolerance):
+    # Regressions beyond tolerance against an earlier --output file
+    before = {r['domains']: r for r in previous}
+    failures = []
+    for result in results:
+        old = before.get(result['domains'])
+        if old is None:
+            continue
+        if result['domains_per_sec'] < old['domains_per_sec'] * (1 - tolerance):
+            failures.append(f"{result['domains']} domains: {result['domains_per_sec']} domains/sec, was {old['domains_per_sec']}")
+        for key in ('p99_ms', 'peak_rss_mb'):
+            if old.get(key) and result.get(key) and result[key] > old[key] * (1 + tolerance):
+                failures.append(f"{result['domains']} domains: {key} {result[key]}, was {old[key]}")
+    return failures
+
+def print_table(results):
+    header = f"{'domains':>8} {'dom/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8} " + ' '.join(f'{s:>8}' for s in STAGES)
+    print(header + f" {'WHOIS rate':>10}")
+    for r in results:
+        stages = ' '.join(f"{r['stages'].get(s, 0):>8.2f}" for s in STAGES)
+        print(f"{r['domains']:>8} {r['domains_per_sec']:>9} {r['p50_ms']!s:>8} {r['p99_ms']!s:>8} {r['peak_rss_mb']:>8} {stages} "
+              f"{r.get('whois_rate', '')!s:>10}")
+
+def whois_rate(value):
+    if value in ('off', 'default'):
+        return value
+    try:
+        if float(value) > 0:
+            return value
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected off, default or a positive number, got {value!r}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark for the DNS lookup pipeline')
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma-separated domain counts (100 to 100000)')
+    parser.add_argument('--streaming', choices=('auto', 'on', 'off'), default='auto')
+    parser.add_argument('--resolvers', type=int, default=2, help='loopback addresses the DNS server listens on')
+    parser.add_argument('--dns-latency', type=float, default=0.005, help='seconds')
+    parser.add_argument('--dns-jitter', type=float, default=0.002, help='seconds')
+    parser.add_argument('--dns-loss', type=float, default=0.0, help='fraction of queries dropped')
+    parser.add_argument('--dns-servfail', type=float, default=0.0, help='fraction of queries answered SERVFAIL')
+    parser.add_argument('--dns-timeout', type=float, default=1.0, help='resolver timeout used during the run')
+    parser.add_argument('--whois-latency', type=float, default=0.02, help='seconds')
+    parser.add_argument('--whois-jitter', type=float, default=0.01, help='seconds')
+    parser.add_argument('--whois-loss', type=float, default=0.0, help='fraction of connections closed unanswered')
+    parser.add_argument('--whois-error', type=float, default=0.0, help='fraction of queries answered "No match"')
+    parser.add_argument('--whois-rate', type=whois_rate, default='default',
+                        help="per-TLD WHOIS queries/sec during the run: default (the app's setting), "
+                             "off (no per-TLD rate or concurrency cap) or a number")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workdir', default=None, help='parent directory for run artifacts')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='earlier --output file; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed regression fraction for --compare')
+    # Internal: a single size in a child process
+    parser.add_argument('--run-one', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--dns-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--whois-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--nameservers', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_one:
+        print(json.dumps(run_one(args)))
+        return 0
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    servers = StandInServers(args).start()
+    results = []
+    try:
+        for size in sizes:
+            command = [sys.executable, os.path.abspath(__file__), '--run-one', str(size),
+                       '--dns-port', str(servers.dns_port), '--whois-port', str(servers.whois_port),
+                       '--nameservers', ','.join(servers.addresses), '--dns-timeout', str(args.dns_timeout),
+                       '--streaming', args.streaming, '--seed', str(args.seed), '--whois-rate', args.whois_rate]
+            if args.workdir:
+                command += ['--workdir', args.workdir]
+            child = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if child.returncode != 0:
+                sys.stderr.write(child.stderr)
+                return child.returncode
+            results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+    finally:
+        servers.stop()
+    print_table(results)
+    print(f"DNS server: {servers.dns_config.requests} queries, {servers.dns_config.dropped} dropped, {servers.dns_config.errors} SERVFAIL; "
+          f"WHOIS server: {servers.whois_config.requests} queries, {servers.whois_config.referrals} referrals, "
+          f"{servers.whois_config.dropped} dropped, {servers.whois_config.errors} errors")
+    # A run where no WHOIS lookup succeeded measured the failure path, not the pipeline
+    broken = [r['domains'] for r in results if not r.get('whois_ok')]
+    if broken:
+        print(f"FAILED: no successful WHOIS lookups in the {', '.join(map(str, broken))} domain run(s)")
+        return 1
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            failures = compare(results, json.load(f), args.tolerance)
+        for failure in failures:
+            print(f"REGRESSION: {failure}")
+        if failures:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_slow_start_then_additive_increase(clock):
+    limiter = app.AdaptiveLimiter('dns', 1, 100, latency_target=1.0)
+    for _ in range(3):
+        limiter.in_flight += 1
+        limiter.release(True, 0.1)
+    assert limiter.limit == 4
+    limiter.in_flight += 1
+    limiter.release(False, 0.1)
+    assert limiter.limit == 2 and not limiter.slow_start
+    limiter.in_flight += 1
+    limiter.release(True, 0.1)
+    assert limiter.limit == 2.5
+
+
+def test_slow_or_failed_calls_never_grow_the_limit(clock):
+    limiter = app.AdaptiveLimiter('whois', 2, 8, latency_target=1.0, initial=6)
+    limiter.in_flight += 1
+    limiter.release(True, 5.0)
+    assert limiter.limit == 6
+    limiter.in_flight += 2
+    limiter.release(False, 0.1)
+    limiter.release(False, 0.1)
+    # A second failure inside the cooldown does not halve again
+    assert limiter.limit == 3
+    clock[0] += 1.0
+    limiter.in_flight += 2
+    limiter.release(False, 0.1)
+    limiter.release(False, 0.1)
+    assert limiter.limit == 2
+    assert limiter.snapshot() == {'limit': 2, 'in_flight': 0, 'min': 2, 'max': 8, 'successes': 1, 'failures': 4}
+
+
+def test_limit_stays_within_bounds(clock):
+    limiter = app.AdaptiveLimiter('dns', 1, 2, latency_target=1.0)
+    for _ in range(5):
+        limiter.in_flight += 1
+        limiter.release(True, 0.1)
+    assert limiter.limit == 2
+
+
+def test_waiters_are_admitted_as_the_limit_allows():
+    async def main():
+        limiter = app.AdaptiveLimiter('dns', 1, 1, latency_target=1.0)
+        await limiter.acquire()
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        limiter.release(True, 0.1)
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('form', [
+    {'dns_min_concurrency': '50', 'dns_max_concurrency': '5'},
+    {'whois_min_concurrency': '0'},
+    {'shards': '0'},
+])
+def test_invalid_job_options_are_rejected(form):
+    with pytest.raises(ValueError):
+        app.job_options(MultiDict(form))
+
+
+def test_job_options_fill_in_the_default_bound():
+    options = app.job_options(MultiDict({'dns_max_concurrency': '40', 'deadline_seconds': '30'}))
+    assert options == {'dns_limits': (app.DNS_MIN_IN_FLIGHT, 40), 'deadline': 30.0}
@@ -0,0 +1,73 @@
+import copy
+
+import pytest
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def make_result(domain, dmarc=None, spf=None, mx=None, name_servers=(), status=app.OUTCOME_ANSWER):
+    result = app.DomainResult(domain)
+    result.dmarc_record, result.spf_record, result.mx_record = dmarc, spf, mx
+    result.dmarc_status = status if dmarc else app.OUTCOME_NXDOMAIN
+    result.spf_status = status if spf else app.OUTCOME_NODATA
+    result.mx_status = status if mx else app.OUTCOME_NODATA
+    result.name_servers = list(name_servers)
+    return result
+
+
+def test_first_matching_rule_wins_and_defaults_apply():
+    rules = app.ClassificationRules(app.DEFAULT_CLASSIFICATION_RULES)
+    jnj = make_result('a.test', dmarc='v=DMARC1; p=reject; sp=quarantine; rua=mailto:jnj@rua.dmp.cisco.com',
+                      spf='v=spf1 -all', mx='10 kenvue-com.mail.protection.outlook.com.',
+                      name_servers=['NS1.KENVUEDNS.COM '])
+    other = make_result('b.test', dmarc='v=DMARC1; p=none', spf='v=spf1 include:mail.example -all',
+                        mx='10 mx.example.', name_servers=['ns1.example.net'])
+    rules.classify([jnj, other])
+    assert (jnj.dmarc_ownership, jnj.dmarc_policy, jnj.p_policy, jnj.sp_policy) == \
+        ("Non-Migrated JNJ DMARC", "Reject DMARC Policy", 'reject', 'quarantine')
+    assert (jnj.spf_class, jnj.mx_class, jnj.whois_class) == \
+        ("Explicit Hard Fail", "Kenvue MX", "Kenvue Owned Domains")
+    assert (other.dmarc_ownership, other.dmarc_policy, other.sp_policy) == (None, "No DMARC Policy", 'No sp policy found')
+    assert (other.spf_class, other.mx_class, other.whois_class) == ("Third Party SPF", "Third Party MX", "Non-Kenvue Domain")
+
+
+def test_missing_and_failed_lookups_get_their_categories():
+    rules = app.ClassificationRules(app.DEFAULT_CLASSIFICATION_RULES)
+    missing = make_result('missing.test')
+    failed = make_result('failed.test', dmarc='x', spf='x', mx='x', status=app.OUTCOME_TIMEOUT)
+    rules.classify([missing, failed])
+    assert (missing.dmarc_ownership, missing.spf_class, missing.mx_class, missing.whois_class) == \
+        ("No DMARC Record", "No SPF Record", "No MX Record", "No Name Servers Found")
+    assert (failed.dmarc_policy, failed.spf_class, failed.mx_class) == \
+        ("DMARC Lookup Failed", "SPF Lookup Failed", "MX Lookup Failed")
+
+
+def test_regex_patterns_and_rule_order():
+    table = {'mx_class': {'source': 'mx_record', 'status': 'mx_status', 'failed': 'Failed', 'missing': 'Missing',
+                          'default': 'Other', 'rules': [['First', ['re:mx\\d\\.vendor']], ['Second', ['vendor']]]}}
+    table['dmarc_policy'] = copy.deepcopy(app.DEFAULT_CLASSIFICATION_RULES['dmarc_policy'])
+    rules = app.ClassificationRules(table)
+    results = [make_result(f'{i}.test', dmarc='p=none', mx=mx)
+               for i, mx in enumerate(['10 mx1.vendor.example.', '10 mail.vendor.example.', '10 mx.other.'])]
+    rules.classify(results)
+    assert [r.mx_class for r in results] == ['First', 'Second', 'Other']
+
+
+def test_renamed_categories_keep_their_fills():
+    table = copy.deepcopy(app.DEFAULT_CLASSIFICATION_RULES)
+    table['dmarc_ownership']['rules'][0][0] = 'Legacy DMARC'
+    table['whois_class']['rules'][0][0] = 'Ours'
+    table['whois_class']['missing'] = 'Unregistered'
+    rules = app.ClassificationRules(table)
+    assert rules.fill('dmarc_ownership', 'Legacy DMARC') == 'yellow'
+    assert rules.fill('whois_class', 'Ours') == 'green'
+    assert rules.fill('whois_class', 'Unregistered') == 'red'
+    assert rules.fill('whois_class', 'Non-Kenvue Domain') == 'yellow'
+    assert rules.fill('dmarc_ownership', 'Non-Migrated JNJ DMARC') is None
+
+
+def test_unknown_fill_is_rejected():
+    table = copy.deepcopy(app.DEFAULT_CLASSIFICATION_RULES)
+    table['mx_class']['rules'][0].append('purple')
+    with pytest.raises(ValueError):
+        app.ClassificationRules(table)
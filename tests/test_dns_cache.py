@@ -0,0 +1,54 @@
+import dns.name
+import dns.resolver
+import pytest
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_with_their_ttl(clock):
+    cache = app.DNSAnswerCache()
+    key = cache.make_key('Example.COM.', 'txt', '192.0.2.53')
+    assert key == ('example.com', 'TXT', '192.0.2.53')
+    cache.put(key, 'answer', 30)
+    clock[0] += 29
+    assert cache.get(key) == 'answer'
+    assert cache.expires_in(key) == 1
+    clock[0] += 1
+    assert cache.get(key) is None
+    assert (cache.stats()['hits'], cache.stats()['misses'], cache.stats()['entries']) == (1, 1, 0)
+
+
+def test_zero_ttl_is_not_cached(clock):
+    cache = app.DNSAnswerCache()
+    cache.put('key', 'answer', 0)
+    assert cache.get('key') is None
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = app.DNSAnswerCache(max_entries=2)
+    cache.put('a', 1, 60)
+    cache.put('b', 2, 60)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 60)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_negative_answers_raise_a_fresh_exception_per_hit(clock):
+    cache = app.DNSAnswerCache()
+    error = dns.resolver.NXDOMAIN(qnames=[dns.name.from_text('missing.test')])
+    cache.put('missing', app.NegativeAnswer(error), 60)
+    cached = cache.get('missing')
+    assert isinstance(cached, app.NegativeAnswer)
+    first, second = cached.error(), cache.get('missing').error()
+    assert isinstance(first, dns.resolver.NXDOMAIN) and first is not second
+    assert first.kwargs == error.kwargs
+    assert cache.stats()['negative_hits'] == 2
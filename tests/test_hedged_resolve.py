@@ -0,0 +1,77 @@
+import asyncio
+import gc
+
+import dns.resolver
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def test_simultaneous_negative_answers_are_all_retrieved(monkeypatch):
+    # Both resolvers answer NXDOMAIN at the same instant, after the hedge delay
+    engine = app.DNSLookupEngine(nameservers=['192.0.2.1', '192.0.2.2'])
+    monkeypatch.setattr(engine, 'hedge_delay', lambda nameserver: 0.01)
+    release = asyncio.Event()
+
+    async def query(nameserver, name, record_type):
+        await release.wait()
+        raise dns.resolver.NXDOMAIN()
+
+    monkeypatch.setattr(engine, '_query', query)
+    unretrieved = []
+
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+        task = asyncio.ensure_future(engine._hedged_resolve('example.test', 'TXT'))
+        await asyncio.sleep(0.05)
+        release.set()
+        try:
+            await task
+        except dns.resolver.NXDOMAIN:
+            pass
+        else:
+            raise AssertionError('expected NXDOMAIN')
+
+    asyncio.run(main())
+    # The losing task is only reported when it is collected
+    gc.collect()
+    assert unretrieved == []
+
+
+def test_first_answer_wins_and_the_slower_attempt_is_cancelled(monkeypatch):
+    engine = app.DNSLookupEngine(nameservers=['192.0.2.3', '192.0.2.4'])
+    monkeypatch.setattr(engine, 'ranked_nameservers', lambda: ['192.0.2.3', '192.0.2.4'])
+    monkeypatch.setattr(engine, 'hedge_delay', lambda nameserver: 0.01)
+    cancelled = []
+
+    async def query(nameserver, name, record_type):
+        if nameserver == '192.0.2.3':
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(nameserver)
+                raise
+        return f'answer from {nameserver}'
+
+    monkeypatch.setattr(engine, '_query', query)
+
+    async def main():
+        result = await engine._hedged_resolve('example.test', 'TXT')
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 'answer from 192.0.2.4'
+    assert cancelled == ['192.0.2.3']
+
+
+def test_resolver_error_rate_only_counts_the_recent_window():
+    stats = app.ResolverStats('192.0.2.53', window=4)
+    for _ in range(4):
+        stats.record(0.01, False)
+    assert stats.error_rate() == 1.0
+    errored = stats.score()
+    for _ in range(3):
+        stats.record(0.01, True)
+    assert stats.error_rate() == 0.25
+    stats.record(0.01, True)
+    assert stats.error_rate() == 0.0 and stats.score() < errored
+    assert (stats.snapshot()['queries'], stats.snapshot()['errors']) == (8, 4)
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import uuid
+
+import pytest
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def make_store(tmp_path, monkeypatch):
+    # The web app's job store, rooted in a temporary directory
+    def make_store(**limits):
+        store = app.JobStore(root=str(tmp_path / 'results'), path=str(tmp_path / 'jobs.sqlite3'),
+                             **dict(dict(max_bytes=0, max_age=0, pack_idle=0), **limits), sweep_interval=0)
+        os.makedirs(store.root, exist_ok=True)
+        monkeypatch.setattr(app, 'job_store', store)
+        return store
+    return make_store
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+def finished_job(store, size=100):
+    job_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(store.root, job_id, 'Logs'))
+    with open(os.path.join(store.root, job_id, 'Logs', 'results.jsonl'), 'wb') as f:
+        f.write(os.urandom(size))
+    store.register(job_id)
+    return job_id
+
+
+def legacy_job(store):
+    # A job directory from before manifests existed
+    job_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(store.root, job_id, 'Dashboard'))
+    return job_id
+
+
+@pytest.mark.parametrize('job_id', ['..', '../outside', 'a/b', '', str(uuid.uuid4()).upper(), None])
+def test_only_canonical_uuids_are_job_ids(job_id):
+    assert not app.valid_job_id(job_id)
+
+
+def test_job_dir_refuses_invalid_ids(store):
+    job_id = str(uuid.uuid4())
+    assert store.job_dir(job_id) == os.path.join(store.root, job_id)
+    with pytest.raises(ValueError):
+        store.job_dir('../outside')
+
+
+def test_invalid_ids_never_reach_the_filesystem(store, tmp_path):
+    assert app.load_manifest('..', store) is None
+    assert app.load_manifest('../outside', store) is None
+    assert not list(tmp_path.rglob(app.MANIFEST_NAME))
+
+
+def test_legacy_manifest_is_only_written_for_indexed_jobs(store):
+    store.stats()  # seeds the index before the directory appears
+    job_id = legacy_job(store)
+    assert app.load_manifest(job_id, store) is None
+    assert not os.path.exists(os.path.join(store.job_dir(job_id), app.MANIFEST_NAME))
+    store.register(job_id)
+    assert app.load_manifest(job_id, store)['job_id'] == job_id
+
+
+@pytest.mark.parametrize('path', ['/results/..', '/results/not-a-job', '/status/not-a-job',
+                                  '/download/not-a-job/zip', '/download/not-a-job/pdf',
+                                  '/api/jobs/not-a-job/domains'])
+def test_routes_404_on_invalid_ids(store, tmp_path, path):
+    assert app.app.test_client().get(path).status_code == 404
+    assert not list(tmp_path.rglob(app.MANIFEST_NAME))
+
+
+@pytest.mark.parametrize('baseline', ['../outside', 'a/b', str(uuid.uuid4())])
+def test_unknown_baselines_are_rejected_before_touching_the_disk(store, tmp_path, baseline):
+    os.makedirs(tmp_path / 'outside' / 'Dashboard')
+    response = app.app.test_client().post('/process', data={
+        'domains_csv': (io.BytesIO(b'Domain\nexample.com\n'), 'domains.csv'), 'baseline_job_id': baseline})
+    assert response.status_code == 400
+    assert not list(tmp_path.rglob(app.MANIFEST_NAME))
+
+
+def test_idle_jobs_are_packed_and_unpacked_on_access(make_store, clock):
+    store = make_store(pack_idle=60)
+    job_id = finished_job(store)
+    with open(os.path.join(store.job_dir(job_id), 'Logs', 'results.jsonl'), 'rb') as f:
+        data = f.read()
+    store.sweep(now=clock[0] + 60)
+    assert os.path.isdir(store.job_dir(job_id))
+    store.sweep(now=clock[0] + 61)
+    assert not os.path.exists(store.job_dir(job_id))
+    assert os.path.exists(store.archive_path(job_id))
+    assert (store.stats()['packed'], store.stats()['packs']) == (1, 1)
+    assert os.listdir(store.root) == [os.path.basename(store.archive_path(job_id))]
+    store.open(job_id)
+    with open(os.path.join(store.job_dir(job_id), 'Logs', 'results.jsonl'), 'rb') as f:
+        assert f.read() == data
+    assert not os.path.exists(store.archive_path(job_id))
+    assert (store.stats()['packed'], store.stats()['unpacks']) == (0, 1)
+
+
+def test_a_job_touched_while_packing_is_left_alone(make_store, clock):
+    store = make_store(pack_idle=60)
+    job_id = finished_job(store)
+    seen = dict(store._index()[job_id])
+    clock[0] += 30
+    store.touch(job_id)
+    store._pack(job_id, seen)
+    assert os.path.isdir(store.job_dir(job_id))
+    assert os.listdir(store.root) == [job_id]
+    assert store.stats()['packs'] == 0
+
+
+def test_jobs_past_their_age_are_evicted(make_store, clock):
+    store = make_store(max_age=3600)
+    old = finished_job(store)
+    clock[0] += 1800
+    new = finished_job(store)
+    store.sweep(now=clock[0] + 1801)
+    assert not store.known(old) and store.known(new)
+    assert os.listdir(store.root) == [new]
+    assert store.stats()['evictions'] == 1
+
+
+def test_least_recently_accessed_jobs_are_evicted_over_quota(make_store, clock):
+    store = make_store(max_bytes=250)
+    first = finished_job(store)
+    clock[0] += 1
+    second = finished_job(store)
+    clock[0] += 1
+    third = finished_job(store)
+    clock[0] += 1
+    store.touch(first)
+    store.sweep()
+    assert [store.known(job_id) for job_id in (first, second, third)] == [True, False, True]
+    assert store.stats()['bytes'] == 200
+    assert sorted(os.listdir(store.root)) == sorted([first, third])
+
+
+def test_sweeps_are_written_back_to_the_index(make_store, clock):
+    store = make_store(max_age=60)
+    evicted = finished_job(store)
+    clock[0] += 30
+    kept = finished_job(store)
+    clock[0] += 10
+    store.touch(kept)
+    store.sweep(now=clock[0] + 21)
+    store._conn.close()
+    reopened = make_store()
+    assert reopened.known(kept) and not reopened.known(evicted)
+    assert reopened._index()[kept]['last_access'] == clock[0]
+
+
+def test_artifact_build_seconds_are_recorded(store, monkeypatch):
+    job_id = str(uuid.uuid4())
+    output_dir = store.job_dir(job_id)
+    os.makedirs(os.path.join(output_dir, 'Logs'))
+    outputs = {'report': os.path.join(output_dir, 'Logs', 'report.json'),
+               'timings': os.path.join(output_dir, 'Logs', 'DNS_Timings_1.json')}
+    for path, data in ((outputs['report'], {}), (outputs['timings'], {'stages': {'persist': 1.5}, 'lookups': {}})):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    app.write_manifest(output_dir, outputs, {'persist': 1.5})
+    store.register(job_id)
+
+    def build_notes(job_id, output_dir, manifest, report, store):
+        path = os.path.join(output_dir, 'notes.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('notes')
+        return path
+    monkeypatch.setitem(app.ARTIFACT_BUILDERS, 'notes', ('notes', build_notes))
+    assert app.ensure_artifact(job_id, 'notes', store)[0] == os.path.join(output_dir, 'notes.txt')
+    manifest = app.load_manifest(job_id, store)
+    assert set(manifest['stages']) == {'persist', 'notes'}
+    with open(outputs['timings'], encoding='utf-8') as f:
+        timings = json.load(f)
+    assert timings['stages'] == manifest['stages']
+    assert timings['lookups'] == {}
+    assert manifest['artifacts']['timings']['sha256'] == app.file_digest(outputs['timings'])
@@ -0,0 +1,26 @@
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def test_names_are_normalized_and_idna_encoded():
+    assert app.normalize_domain('  Example.COM. ') == 'example.com'
+    assert app.normalize_domain('Bücher.de') == 'xn--bcher-kva.de'
+    assert app.normalize_domain('   ') is None
+    assert app.normalize_domain(float('nan')) is None
+    assert app.normalize_domain('a..b') is None
+
+
+def test_registrable_domain_knows_multi_label_suffixes():
+    assert app.registrable_domain('mail.example.com') == 'example.com'
+    assert app.registrable_domain('shop.example.co.uk') == 'example.co.uk'
+    assert app.registrable_domain('co.uk') == 'co.uk'
+
+
+def test_duplicates_share_one_name_and_keep_their_rows():
+    plan = app.QueryPlan(['Example.com', 'example.com.', ' www.example.com', None, float('nan'), '', 'a..b',
+                          'bücher.de'])
+    assert plan.rows == ['Example.com', 'example.com.', 'www.example.com', 'a..b', 'bücher.de']
+    assert plan.names == ['example.com', 'www.example.com', 'xn--bcher-kva.de']
+    assert plan.rows_by_name['example.com'] == ['Example.com', 'example.com.']
+    assert plan.whois_domains == ['example.com', 'xn--bcher-kva.de']
+    assert plan.invalid_rows == ['a..b']
+    assert plan.summary() == '5 rows, 3 unique names, 2 WHOIS domains, 1 invalid'
@@ -0,0 +1,68 @@
+import json
+import os
+import uuid
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def make_result(**fields):
+    result = app.DomainResult('example.com', 'example.com')
+    result.spf_status = result.mx_status = result.dmarc_status = app.OUTCOME_ANSWER
+    for field, value in fields.items():
+        setattr(result, field, value)
+    return result
+
+
+def test_reordered_records_are_not_changes():
+    previous = make_result(spf_record='v=spf1 include:a.test include:b.test -all', mx_record='10 a.test.,20 b.test.',
+                           p_policy='reject', name_servers=['NS1.example.net', 'ns2.example.net'])
+    current = make_result(spf_record='v=spf1  include:b.test include:A.test -all', mx_record='20 b.test., 10 a.test.',
+                          p_policy='reject', name_servers=['ns2.example.net', 'ns1.example.net '])
+    assert app.result_changes(previous, current) == []
+
+
+def test_changed_fields_are_reported_with_their_raw_values():
+    previous = make_result(spf_record='v=spf1 -all', mx_record='10 a.test.', p_policy='none', sp_policy='none',
+                           name_servers=['ns1.example.net'])
+    current = make_result(spf_record='v=spf1 include:a.test -all', mx_record='10 a.test.', p_policy='reject',
+                          sp_policy='none', name_servers=['ns1.other.net'])
+    assert app.result_changes(previous, current) == [
+        ('SPF', 'v=spf1 -all', 'v=spf1 include:a.test -all'),
+        ('DMARC Policy', 'none', 'reject'),
+        ('NameServers', 'ns1.example.net', 'ns1.other.net'),
+    ]
+
+
+def test_failed_lookups_are_skipped():
+    previous = make_result(spf_record='v=spf1 -all', mx_record='10 a.test.', name_servers=['ns1.example.net'])
+    current = make_result(spf_record=None, spf_status=app.OUTCOME_TIMEOUT, mx_record=None,
+                          mx_status=app.OUTCOME_NXDOMAIN, whois_error='timed out')
+    # A timeout is not a change, but an MX record that disappeared is
+    assert app.result_changes(previous, current) == [('MX', '10 a.test.', None)]
+
+
+def test_baseline_results_are_read_by_name_from_disk(tmp_path, monkeypatch):
+    store = app.JobStore(root=str(tmp_path), path=str(tmp_path / 'jobs.sqlite3'), max_bytes=0, max_age=0, pack_idle=0)
+    monkeypatch.setattr(app, 'job_store', store)
+    job_id = str(uuid.uuid4())
+    output_dir = store.job_dir(job_id)
+    os.makedirs(output_dir)
+    outputs = {'results': os.path.join(output_dir, 'results.jsonl'), 'report': os.path.join(output_dir, 'report.json')}
+    with open(outputs['results'], 'w', encoding='utf-8') as f:
+        for domain, name, registrar in (('a.test', 'a.test', 'First'), ('www.b.test', 'b.test', 'R'),
+                                        ('A.TEST', 'a.test', 'Second'), ('not a domain', None, None)):
+            result = app.DomainResult(domain, name)
+            result.registrar = registrar
+            f.write(json.dumps(result.to_dict()) + '\n')
+    with open(outputs['report'], 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+    app.write_manifest(output_dir, outputs)
+    store.register(job_id)
+    baseline = app.load_baseline_results(job_id)
+    try:
+        assert (baseline.get('a.test').domain, baseline.get('a.test').registrar) == ('a.test', 'First')
+        assert baseline.get('b.test').domain == 'www.b.test'
+        assert baseline.get('c.test') is None and baseline.get(None) is None
+    finally:
+        baseline.close()
+    assert 'results_index' in app.load_manifest(job_id)['artifacts']
@@ -0,0 +1,42 @@
+import pytest
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+@pytest.fixture
+def store(tmp_path):
+    # 10 rows in row groups of 4; every third row is JNJ MX
+    path = str(tmp_path / 'results.parquet')
+    writer = app.ColumnarResultWriter(path, row_group_size=4)
+    for i in range(10):
+        result = app.DomainResult(f'd{i}.test', f'd{i}.test')
+        result.mx_class = 'JNJ MX' if i % 3 == 0 else 'Third Party MX'
+        result.timings = {'MX': 0.01 * i}
+        writer.append(result)
+    writer.close()
+    return path
+
+
+def pages(path, **kwargs):
+    cursor, seen = 0, []
+    while cursor is not None:
+        rows, cursor = app.query_result_store(path, cursor=cursor, **kwargs)
+        seen.append([row['domain'] for row in rows])
+    return seen
+
+
+def test_cursor_pages_cover_every_row_once(store):
+    assert pages(store, fields=['domain'], limit=3) == [
+        ['d0.test', 'd1.test', 'd2.test'], ['d3.test', 'd4.test', 'd5.test'],
+        ['d6.test', 'd7.test', 'd8.test'], ['d9.test']]
+
+
+def test_classification_filter_pages_across_row_groups(store):
+    assert pages(store, classifications=['JNJ MX'], fields=['domain'], limit=2) == [
+        ['d0.test', 'd3.test'], ['d6.test', 'd9.test']]
+
+
+def test_rows_only_carry_the_requested_fields(store):
+    rows, cursor = app.query_result_store(store, fields=['domain', 'timings', 'not_a_column'], cursor=9, limit=5)
+    assert rows == [{'domain': 'd9.test', 'timings': {'MX': 0.09}}]
+    assert cursor is None
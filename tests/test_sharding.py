@@ -0,0 +1,48 @@
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def test_metric_deltas_merge_into_the_parent_registry():
+    shard = app.Histogram('shard_seconds', 'test', ('lookup',))
+    parent = app.Histogram('shard_seconds', 'test', ('lookup',))
+    parent.observe(0.2, 'DMARC')
+    shard.observe(0.02, 'DMARC')
+    shard.observe(3.0, 'SPF')
+    parent.merge(shard.drain())
+    assert shard.drain() == {}
+    snapshot = parent.snapshot()
+    assert snapshot['DMARC']['count'] == 2
+    assert snapshot['SPF']['max_seconds'] == 3.0
+
+    shard_counter, parent_counter = app.Counter('c', 'test', ('result',)), app.Counter('c', 'test', ('result',))
+    shard_counter.inc('ok', amount=3)
+    parent_counter.inc('ok')
+    parent_counter.merge(shard_counter.drain())
+    assert parent_counter.render()[-1] == 'c{result="ok"} 4'
+
+
+def test_sharded_limiter_sums_the_latest_snapshot_of_each_shard():
+    limiter = app.ShardedLimiter()
+    snapshot = {'limit': 4, 'in_flight': 2, 'min': 1, 'max': 5, 'successes': 10, 'failures': 1}
+    limiter.update(0, snapshot)
+    limiter.update(1, dict(snapshot, in_flight=0))
+    limiter.update(0, dict(snapshot, limit=5))
+    assert limiter.snapshot() == {'limit': 9, 'in_flight': 2, 'min': 2, 'max': 10, 'successes': 20, 'failures': 2}
+
+
+def test_live_counts_of_shards_are_summed():
+    first = {'charts': {'mx_class': {'JNJ MX': 2}}, 'failed_lookups': 1, 'rows': 3}
+    second = {'charts': {'mx_class': {'JNJ MX': 1, 'Third Party MX': 4}}, 'failed_lookups': 0, 'rows': 5}
+    assert app.sum_live_counts([first, second]) == {
+        'charts': {'mx_class': {'JNJ MX': 3, 'Third Party MX': 4}}, 'failed_lookups': 1, 'rows': 8}
+
+
+def test_shards_split_the_per_tld_whois_rate(monkeypatch):
+    monkeypatch.setattr(app, 'whois_limiter', app.whois_limiter)
+    monkeypatch.setattr(app, 'shard_progress', None)
+    monkeypatch.setattr(app, 'shard_live', False)
+    app.init_shard_worker(None, False, 6.0, 4, 2, 3)
+    assert (app.whois_limiter.rate, app.whois_limiter.capacity, app.whois_limiter.concurrency) == (2.0, 1, 1)
+    app.init_shard_worker(None, False, 0, 3, 0, 3)
+    assert app.whois_limiter.reserve('example.com') == 0.0
+    assert app.whois_limiter.tld_slots().get('example.com') is None
+
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+def fake_engine(monkeypatch, zone):
+    # zone maps (name, record type) to a list of TXT strings or addresses;
+    # anything missing is NXDOMAIN
+    engine = app.DNSLookupEngine(nameservers=['192.0.2.9'], cache=app.DNSAnswerCache(), spf_cache=app.DNSAnswerCache())
+    queries = []
+
+    async def lookup(name, record_type):
+        queries.append((name, record_type))
+        values = zone.get((name, record_type))
+        if values is None:
+            return app.OUTCOME_NXDOMAIN, None
+        if record_type == 'TXT':
+            return app.OUTCOME_ANSWER, [SimpleNamespace(strings=[value.encode()]) for value in values]
+        if record_type == 'MX':
+            return app.OUTCOME_ANSWER, [SimpleNamespace(exchange=value) for value in values]
+        return app.OUTCOME_ANSWER, [SimpleNamespace(address=value) for value in values]
+
+    monkeypatch.setattr(engine, 'lookup', lookup)
+    monkeypatch.setattr(engine, 'remaining_ttl', lambda name, record_type: 300.0)
+    return engine, queries
+
+
+def evaluate(engine, name):
+    return asyncio.run(engine.spf_tree(name))
+
+
+def test_includes_are_counted_and_their_ranges_flattened(monkeypatch):
+    engine, _ = fake_engine(monkeypatch, {
+        ('example.test', 'TXT'): ['v=spf1 ip4:192.0.2.0/25 include:a.test a:mail.example.test ~all'],
+        ('a.test', 'TXT'): ['v=spf1 ip4:192.0.2.128/25 include:b.test -all'],
+        ('b.test', 'TXT'): ['v=spf1 ip6:2001:db8::/32 -all'],
+        ('mail.example.test', 'A'): ['198.51.100.7'],
+    })
+    tree = evaluate(engine, 'example.test')
+    assert (tree.lookups, tree.void_lookups, tree.verdict()) == (3, 0, None)
+    assert tree.flattened_ips() == ['192.0.2.0/24', '198.51.100.7/32', '2001:db8::/32']
+
+
+def test_too_many_lookups_is_a_permerror(monkeypatch):
+    includes = ' '.join(f'include:n{i}.test' for i in range(11))
+    zone = {('example.test', 'TXT'): [f'v=spf1 {includes} -all']}
+    zone.update({(f'n{i}.test', 'TXT'): ['v=spf1 -all'] for i in range(11)})
+    engine, _ = fake_engine(monkeypatch, zone)
+    assert evaluate(engine, 'example.test').verdict() == 'permerror: 11 DNS lookups (limit 10)'
+
+
+def test_void_lookups_and_missing_include_targets(monkeypatch):
+    engine, _ = fake_engine(monkeypatch, {
+        ('example.test', 'TXT'): ['v=spf1 a:gone1.test a:gone2.test include:gone3.test -all'],
+    })
+    tree = evaluate(engine, 'example.test')
+    assert tree.void_lookups == 3
+    assert tree.verdict() == 'permerror: 3 void lookups (limit 2)'
+    assert tree.error == 'permerror: include:gone3.test has no SPF record'
+
+
+def test_include_loops_are_detected(monkeypatch):
+    engine, _ = fake_engine(monkeypatch, {
+        ('example.test', 'TXT'): ['v=spf1 include:a.test -all'],
+        ('a.test', 'TXT'): ['v=spf1 include:example.test -all'],
+    })
+    tree = evaluate(engine, 'example.test')
+    assert tree.error == 'permerror: include loop at example.test'
+
+
+def test_redirect_only_applies_without_all(monkeypatch):
+    engine, _ = fake_engine(monkeypatch, {
+        ('example.test', 'TXT'): ['v=spf1 redirect=_spf.test'],
+        ('other.test', 'TXT'): ['v=spf1 -all redirect=_spf.test'],
+        ('_spf.test', 'TXT'): ['v=spf1 ip4:203.0.113.0/24 -all'],
+    })
+    redirected = evaluate(engine, 'example.test')
+    assert (redirected.lookups, redirected.flattened_ips()) == (1, ['203.0.113.0/24'])
+    assert evaluate(engine, 'other.test').lookups == 0
+
+
+def test_shared_subtrees_are_evaluated_once(monkeypatch):
+    engine, queries = fake_engine(monkeypatch, {
+        ('one.test', 'TXT'): ['v=spf1 include:provider.test -all'],
+        ('two.test', 'TXT'): ['v=spf1 include:provider.test -all'],
+        ('provider.test', 'TXT'): ['v=spf1 ip4:192.0.2.1 -all'],
+    })
+
+    async def both():
+        return await asyncio.gather(engine.spf_tree('one.test'), engine.spf_tree('two.test'))
+
+    one, two = asyncio.run(both())
+    assert one.flattened_ips() == two.flattened_ips() == ['192.0.2.1/32']
+    assert queries.count(('provider.test', 'TXT')) == 1
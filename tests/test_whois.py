@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytest
+
+import Enhanced_DNS_Lookup_WebApp as app
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return app.WhoisCache(path=str(tmp_path / 'whois.sqlite3'), max_age=3600)
+
+
+def test_token_bucket_allows_a_burst_then_queues_callers(clock):
+    bucket = app.TokenBucket(rate=2.0, capacity=2)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock[0] += 10
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_each_tld_has_its_own_bucket(clock):
+    limiter = app.WhoisRateLimiter(rate=1.0, capacity=1)
+    assert [limiter.reserve(d) for d in ('a.com', 'b.COM', 'a.org', 'c.com')] == [0.0, 1.0, 0.0, 2.0]
+    assert app.WhoisRateLimiter(rate=0).reserve('a.com') == 0.0
+
+
+def test_cached_records_round_trip_and_expire(cache, monkeypatch):
+    created = datetime(2001, 2, 3, 4, 5, 6)
+    cache.put('example.com', {'name_servers': ['ns1.example.net'], 'registrar': 'R', 'creation_date': created,
+                              'expiration_date': None})
+    record = cache.get('example.com')
+    assert (record['registrar'], record['name_servers'], record['creation_date']) == ('R', ['ns1.example.net'], created)
+    assert record['expiration_date'] is None
+    fetched_at = record['fetched_at']
+    monkeypatch.setattr(app.time, 'time', lambda: fetched_at + 3601)
+    assert cache.get('example.com') is None
+    assert cache.get('example.com', max_age=7200)['registrar'] == 'R'
+    assert (cache.stats()['entries'], cache.stats()['hits'], cache.stats()['misses']) == (1, 2, 1)
+
+
+def test_locked_whois_cache_is_a_miss_not_a_failure(cache, monkeypatch):
+    cache.put('example.com', {'name_servers': ['ns1.example.net'], 'registrar': 'R'})
+    assert cache.get('example.com')['registrar'] == 'R'
+
+    def locked():
+        raise app.sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(cache, '_connect', locked)
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    cache.put('example.org', {'name_servers': [], 'registrar': None})
+    assert cache.get('example.com') is None
+
+
+def test_queries_per_tld_are_capped(cache, monkeypatch):
+    monkeypatch.setattr(app, 'whois_cache', cache)
+    monkeypatch.setattr(app, 'whois_limiter', app.WhoisRateLimiter(rate=0, concurrency=2))
+    lock = threading.Lock()
+    running, peak = {}, {}
+
+    def lookup_whois(domain):
+        tld = domain.rsplit('.', 1)[-1]
+        with lock:
+            running[tld] = running.get(tld, 0) + 1
+            peak[tld] = max(peak.get(tld, 0), running[tld])
+        time.sleep(0.02)
+        with lock:
+            running[tld] -= 1
+        return {'name_servers': [], 'registrar': None}, None
+    monkeypatch.setattr(app, 'lookup_whois', lookup_whois)
+
+    async def fetch_all():
+        concurrency = app.AdaptiveLimiter('whois', 12, 12, app.WHOIS_LATENCY_TARGET)
+        tld_slots = app.whois_limiter.tld_slots()
+        with ThreadPoolExecutor(max_workers=12) as executor:
+            return await asyncio.gather(*(app.fetch_whois(f'd{i}.{tld}', executor, concurrency, tld_slots)
+                                          for i in range(6) for tld in ('com', 'org')))
+    results = asyncio.run(fetch_all())
+    assert all(error is None for _, error in results)
+    assert peak == {'com': 2, 'org': 2}